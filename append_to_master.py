@@ -14,53 +14,93 @@ Uso:
 
 Se omitido --replace-existing, o script ERRA caso o Fundo já exista no MASTER
 (pra evitar duplicar).
+
+Se --master for um store particionado (caminho sem extensão, ver master_store.py),
+só a partição do fundo é regravada; --saida pode ser omitido.
+
+Grava sob a trava dos MASTER e por troca atômica. Para vários fundos de uma vez
+(e já atualizando garantias limpas/codificadas), ver transacao_master.py.
 """
 
 import argparse
 import pandas as pd
 from pathlib import Path
 
-ap = argparse.ArgumentParser(description="Append/replace de um fundo no MASTER financeiro.")
-ap.add_argument("--new-csv", required=True, help="CSV staging do novo fundo.")
-ap.add_argument("--master",  required=True, help="MASTER financeiro atual.")
-ap.add_argument("--saida",   required=True, help="Caminho de saída para novo MASTER.")
-ap.add_argument("--replace-existing", action="store_true",
-                help="Se fornecido, remove linhas existentes do fundo antes de anexar.")
-args = ap.parse_args()
-
-NEW   = Path(args.new_csv)
-MASTER= Path(args.master)
-SAIDA = Path(args.saida)
+import master_store
+import metricas
 
-df_new = pd.read_csv(NEW)
 # padronizar nomes de colunas → converter para esquema MASTER
-colmap = {
+COLMAP = {
     'NOME DO FUNDO': 'Fundo',
     'CÓDIGO DO ATIVO': 'Ativo',
     '% DA CARTEIRA': '%PL',
     'GARANTIAS': 'Garantia',
 }
-df_new = df_new.rename(columns=colmap)
-# garante colunas mínimas
-need = ['Fundo','Ativo','%PL','Norm.','Garantia']
-missing = [c for c in need if c not in df_new.columns]
-if missing:
-    raise ValueError(f"Novo CSV sem colunas: {missing}")
-
-if MASTER.exists():
-    df_master = pd.read_csv(MASTER)
-else:
-    df_master = pd.DataFrame(columns=need)
-
-# substituição?
-fundo = df_new['Fundo'].iloc[0]
-if not args.replace_existing and (df_master['Fundo'] == fundo).any():
-    raise RuntimeError(f"Fundo {fundo} já existe no MASTER; use --replace-existing.")
-if args.replace_existing:
-    df_master = df_master[df_master['Fundo'] != fundo]
-
-df_out = pd.concat([df_master, df_new[need + [c for c in df_new.columns if c not in need]]],
-                   ignore_index=True)
-
-df_out.to_csv(SAIDA, index=False)
-print(f"MASTER atualizado salvou {len(df_out)} linhas em: {SAIDA}")
+# colunas mínimas
+NEED = ['Fundo','Ativo','%PL','Norm.','Garantia']
+
+
+def padronizar_staging(df_new: pd.DataFrame) -> pd.DataFrame:
+    """Staging (ingest_fundo) → esquema MASTER, colunas mínimas primeiro."""
+    df_new = df_new.rename(columns=COLMAP)
+    missing = [c for c in NEED if c not in df_new.columns]
+    if missing:
+        raise ValueError(f"Novo CSV sem colunas: {missing}")
+    return df_new[NEED + [c for c in df_new.columns if c not in NEED]]
+
+
+@metricas.medir()
+def anexar(df_master: pd.DataFrame | None, df_new: pd.DataFrame,
+           replace_existing: bool = False) -> pd.DataFrame:
+    """MASTER + fundo novo (já padronizado). Erra se o fundo existir e replace=False."""
+    if df_master is None:
+        df_master = pd.DataFrame(columns=NEED)
+
+    # substituição?
+    fundo = df_new['Fundo'].iloc[0]
+    if not replace_existing and (df_master['Fundo'] == fundo).any():
+        raise RuntimeError(f"Fundo {fundo} já existe no MASTER; use --replace-existing.")
+    if replace_existing:
+        df_master = df_master[df_master['Fundo'] != fundo]
+
+    return pd.concat([df_master, df_new], ignore_index=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Append/replace de um fundo no MASTER financeiro.")
+    ap.add_argument("--new-csv", required=True, help="CSV staging do novo fundo.")
+    ap.add_argument("--master",  required=True, help="MASTER financeiro atual.")
+    ap.add_argument("--saida",   default=None,
+                    help="Caminho de saída para novo MASTER (padrão: o próprio --master).")
+    ap.add_argument("--replace-existing", action="store_true",
+                    help="Se fornecido, remove linhas existentes do fundo antes de anexar.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    NEW   = Path(args.new_csv)
+    MASTER= Path(args.master)
+    SAIDA = Path(args.saida) if args.saida else MASTER
+
+    with metricas.execucao("append_to_master", args):
+        df_new = padronizar_staging(pd.read_csv(NEW))
+
+        # store particionado: regrava só a partição do fundo
+        if master_store.eh_store(MASTER):
+            if SAIDA != MASTER:
+                raise ValueError("Com MASTER particionado, --saida deve ser o próprio --master (ou omitido).")
+            with master_store.travar(MASTER.parent, exclusiva=True):
+                entrada = master_store.upsert_fundo(MASTER, df_new, replace=args.replace_existing)
+            print(f"MASTER particionado atualizado: {df_new['Fundo'].iloc[0]} "
+                  f"({entrada['linhas']} linhas) em {MASTER / entrada['arquivo']}")
+            return
+
+        # trava exclusiva + troca atômica: leitores nunca veem o CSV pela metade
+        with master_store.travar(SAIDA.parent, exclusiva=True):
+            df_master = pd.read_csv(MASTER) if MASTER.exists() else None
+            df_out = anexar(df_master, df_new, replace_existing=args.replace_existing)
+            master_store.escrever_atomico(SAIDA, lambda tmp: df_out.to_csv(tmp, index=False))
+        print(f"MASTER atualizado salvou {len(df_out)} linhas em: {SAIDA}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench.py
+--------
+Benchmark do pipeline completo sobre dados sintéticos (gerar_dados.py), em
+várias escalas (padrão 1×, 10× e 100× de --base-fundos):
+
+    ingest_fundo → append_to_master → limpeza → mapear_codigo → score [1/9]..[9/9]
+
+Para cada etapa: tempo de parede, tempo de CPU, pico de RSS durante a etapa e
+linhas processadas, medidos com metricas.py (os mesmos números do
+--metrics-out dos scripts). Cada escala roda num processo novo (o pico de
+memória de uma não contamina a outra). As etapas do score são os passos
+"n/9" que o próprio score_app marca.
+
+O resultado de cada execução vira uma linha JSON em --saida (padrão
+benchmarks/resultados.jsonl), com commit, versões e parâmetros, para comparar
+ao longo do tempo; a tabela impressa no fim traz a variação contra a última
+execução com os mesmos parâmetros.
+
+Uso:
+    python benchmarks/bench.py
+    python benchmarks/bench.py --escalas 1,10 --base-fundos 200 --engine matrix
+    python benchmarks/bench.py --escalas 1 --pasta /tmp/bench --manter
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import gerar_dados  # noqa: E402
+import metricas  # noqa: E402
+
+SAIDA_PADRAO = Path(__file__).resolve().parent / "resultados.jsonl"
+NIVEL_TABELA = 1   # etapas e passos do score; sub-etapas só no JSON
+
+
+# ------------------------------------------------------------------
+# Uma escala (processo próprio)
+# ------------------------------------------------------------------
+def rodar_escala(pasta: Path, fundos: int, args) -> dict:
+    """Gera os dados em `pasta` e mede cada etapa do pipeline."""
+    import append_to_master
+    import ingest_fundo
+    import limpeza
+    import mapear_codigo
+    import master_store
+    import score_app
+    import tokens_csr
+    from classificacao import carregar_regras
+
+    pasta = Path(pasta)
+    t0 = time.perf_counter()
+    dados = gerar_dados.gerar(pasta, fundos=fundos, ativos=args.ativos, fragmentos=args.fragmentos,
+                              acerto=args.acerto, planilhas=args.planilhas, seed=args.seed)
+    segundos_gerar = round(time.perf_counter() - t0, 2)
+
+    master = dados['master']
+    limpas = pasta / "garantias_limpas_MASTER.csv"
+    cod = pasta / "garantias_cod_MASTER.csv"
+    metricas.configurar("bench", tabela=False)
+    log = open(pasta / "bench.log", 'w', encoding='utf-8')
+    stdout = sys.stdout
+    sys.stdout = log
+    try:
+        with metricas.etapa("ingest_fundo") as e:
+            stagings = []
+            for arq in dados['planilhas']:
+                df_stg = ingest_fundo.ingerir_fundo(arq, arq.stem, gerar_dados.SHEET_GESTORA, None, layouts=None)
+                stagings.append(ingest_fundo.salvar_staging(df_stg, arq.stem, pasta / "staging")[1])
+            e['linhas_out'] = sum(len(pd.read_csv(p)) for p in stagings)
+
+        # um append por fundo, como no uso normal (lê/grava o MASTER inteiro a cada vez)
+        with metricas.etapa("append_to_master") as e:
+            for p in stagings:
+                df_new = append_to_master.padronizar_staging(pd.read_csv(p))
+                df_out = append_to_master.anexar(pd.read_csv(master), df_new, replace_existing=True)
+                master_store.escrever_atomico(master, lambda tmp: df_out.to_csv(tmp, index=False))
+            e['linhas_out'] = linhas_master = len(df_out)
+        del df_out
+
+        regras = carregar_regras(dados['classif'], cache_dir=pasta / ".cache")
+
+        with metricas.etapa("limpeza") as e:
+            df_fin = pd.read_csv(master)
+            df_clean, _ = limpeza.limpar_garantias(df_fin, regras)
+            limpeza.salvar_limpas(df_clean, limpas)
+            e['linhas_out'] = len(df_clean)
+        del df_fin, df_clean
+
+        with metricas.etapa("mapear_codigo") as e:
+            df_limpas = tokens_csr.ler_largo(limpas)
+            df_cod, _ = mapear_codigo.mapear_codigos(df_limpas, regras)
+            tokens_csr.gravar_tokens(cod, df_cod)
+            e['linhas_out'] = len(df_cod)
+        del df_limpas, df_cod
+
+        with metricas.etapa("score", linhas_in=linhas_master) as e:
+            res = score_app.run_score(
+                master, cod, dados['classif'],
+                saida_xlsx=pasta / "score_debug.xlsx",
+                engine=args.engine,
+                formato=args.formato,
+            )
+            e['linhas_out'] = len(res['scores'])
+        etapas = sorted(metricas.registros(), key=lambda r: r['ordem'])
+    finally:
+        sys.stdout = stdout
+        log.close()
+        metricas.desligar()
+
+    principais = [e for e in etapas if e['nivel'] == 0]
+    picos = [e['pico_rss_mb'] for e in principais if e['pico_rss_mb'] is not None]
+    return {
+        'fundos': fundos,
+        'linhas': dados['linhas'],
+        'segundos_gerar': segundos_gerar,
+        'total_segundos': round(sum(e['segundos'] for e in principais), 3),
+        'pico_rss_mb': max(picos) if picos else None,
+        'etapas': etapas,
+    }
+
+
+# ------------------------------------------------------------------
+# Orquestração / relatório
+# ------------------------------------------------------------------
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _params(args) -> dict:
+    return {k: getattr(args, k) for k in
+            ('base_fundos', 'ativos', 'fragmentos', 'acerto', 'planilhas', 'seed', 'engine', 'formato')}
+
+
+def _anterior(saida: Path, params: dict) -> dict | None:
+    if not saida.exists():
+        return None
+    ultimo = None
+    for linha in saida.read_text(encoding='utf-8').splitlines():
+        if linha.strip():
+            r = json.loads(linha)
+            if r.get('params') == params:
+                ultimo = r
+    return ultimo
+
+
+def tabela(registro: dict, anterior: dict | None = None) -> str:
+    ant = {}
+    if anterior:
+        for esc in anterior['escalas']:
+            for e in metricas.agregar(esc['etapas']):
+                ant[(esc['escala'], e['etapa'])] = e['segundos']
+    linhas = [f"{'escala':>6} {'etapa':<28} {'seg':>9} {'cpu':>9} {'pico MB':>9} "
+              f"{'linhas':>9} {'linhas/s':>10} {'vs ant.':>8}"]
+    for esc in registro['escalas']:
+        for e in metricas.agregar(esc['etapas']):
+            if e['nivel'] > NIVEL_TABELA:
+                continue
+            n = e['linhas_in'] if e['linhas_in'] is not None else e['linhas_out']
+            lps = f"{e['linhas_s']:,.0f}" if e['linhas_s'] else '-'
+            a = ant.get((esc['escala'], e['etapa']))
+            var = f"{(e['segundos'] / a - 1):+.0%}" if a else ''
+            nome = "  " * e['nivel'] + e['etapa'].rsplit(metricas.SEP, 1)[-1]
+            if e['chamadas'] > 1:
+                nome += f" ×{e['chamadas']}"
+            linhas.append(
+                f"{esc['escala']:>5}× {nome:<28} {e['segundos']:>9.3f} {e['cpu_segundos']:>9.3f} "
+                f"{e['pico_rss_mb'] if e['pico_rss_mb'] is not None else '-':>9} "
+                f"{n if n is not None else '-':>9} "
+                f"{lps:>10} {var:>8}")
+        linhas.append(f"{esc['escala']:>5}× {'TOTAL':<28} {esc['total_segundos']:>9.3f} {'':>9} "
+                      f"{esc['pico_rss_mb'] if esc['pico_rss_mb'] is not None else '-':>9}   "
+                      f"({esc['fundos']} fundos, {esc['linhas']} linhas)")
+    return "\n".join(linhas)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark do pipeline ingest → score sobre dados sintéticos.")
+    ap.add_argument("--escalas", default="1,10,100", help="Multiplicadores de --base-fundos (ex.: 1,10,100).")
+    ap.add_argument("--base-fundos", type=int, default=100, help="Nº de fundos na escala 1×.")
+    ap.add_argument("--ativos", type=float, default=30, help="Posições por fundo (média).")
+    ap.add_argument("--fragmentos", type=float, default=3, help="Trechos por texto de Garantia (média).")
+    ap.add_argument("--acerto", type=float, default=0.8, help="Fração de trechos do vocabulário.")
+    ap.add_argument("--planilhas", type=int, default=5, help="Planilhas de gestora ingeridas/anexadas.")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--engine", choices=["colunar", "matrix"], default="colunar")
+    ap.add_argument("--formato", choices=["xlsx", "csv", "parquet"], default="parquet",
+                    help="Saída detalhada do score (xlsx não comporta >1M linhas de debug).")
+    ap.add_argument("--saida", default=str(SAIDA_PADRAO), help="Arquivo JSON lines de resultados.")
+    ap.add_argument("--pasta", default=None, help="Pasta de trabalho (padrão: temporária).")
+    ap.add_argument("--manter", action="store_true", help="Não apaga os dados gerados.")
+    ap.add_argument("--_uma-escala", dest="uma_escala", type=int, default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--_json", dest="json_out", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    # processo filho: uma escala só
+    if args.uma_escala is not None:
+        res = rodar_escala(Path(args.pasta), args.base_fundos * args.uma_escala, args)
+        Path(args.json_out).write_text(json.dumps(res), encoding='utf-8')
+        return
+
+    escalas = [int(x) for x in args.escalas.split(',') if x.strip()]
+    base = Path(args.pasta) if args.pasta else Path(tempfile.mkdtemp(prefix="bench_score_"))
+    registro = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': _params(args),
+        'escalas': [],
+    }
+    try:
+        for k in escalas:
+            pasta = base / f"{k}x"
+            out = base / f"{k}x.json"
+            print(f"[bench] {k}× ({args.base_fundos * k} fundos) em {pasta} ...", flush=True)
+            cmd = [sys.executable, __file__, "--_uma-escala", str(k), "--_json", str(out),
+                   "--pasta", str(pasta)]
+            for nome, v in _params(args).items():
+                cmd += [f"--{nome.replace('_', '-')}", str(v)]
+            subprocess.run(cmd, check=True)
+            res = json.loads(out.read_text(encoding='utf-8'))
+            res['escala'] = k
+            registro['escalas'].append(res)
+    finally:
+        if not args.manter and not args.pasta:
+            shutil.rmtree(base, ignore_errors=True)
+
+    saida = Path(args.saida)
+    anterior = _anterior(saida, registro['params'])
+    print(tabela(registro, anterior))
+    with open(saida, 'a', encoding='utf-8') as fh:
+        fh.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    print(f"[OK] Resultado acrescentado em {saida}"
+          + (f" (comparado com {anterior['ts']}, commit {anterior.get('commit')})" if anterior else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+gerar_dados.py
+--------------
+Dados sintéticos p/ benchmark do pipeline ingest → score, em escala
+configurável:
+
+  - Estudo_de_Garantias_v3.xlsx: aba Classificação (tipos, códigos,
+    subclasses e notas no mesmo formato da planilha real);
+  - df_tidy_simp_MASTER.csv: MASTER financeiro com --fundos fundos e, em
+    média, --ativos posições por fundo;
+  - planilhas/<FUNDO>.xlsx: --planilhas relatórios de gestora (preâmbulo,
+    cabeçalho na linha 5, rodapé), para o ingest_fundo.
+
+A Garantia de cada posição junta ~--fragmentos trechos com os separadores
+de sempre (+ , e ; -). Cada trecho vem do vocabulário da Classificação com
+probabilidade --acerto, senão é ruído (texto que a limpeza descarta).
+
+Uso:
+    python benchmarks/gerar_dados.py /tmp/bench_1x --fundos 100 --ativos 30
+    python benchmarks/gerar_dados.py /tmp/bench_10x --fundos 1000 --fragmentos 5 --acerto 0.6
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SHEET_GESTORA = "Carteira de Ativos"
+HEADER_GESTORA = 4
+
+# Tipos de Garantia, Código, Subclasse, Nota
+CLASSIFICACAO = [
+    ("Alienação Fiduciária", "AF", "Imóvel", 3), (None, "AF", "Terreno", 3), (None, "AF", "SPE", 2),
+    (None, "AF", "Terras", 3), (None, "AF", "Grãos", 2),
+    (None, "AF", "Cotas de fundo (FIP, FII etc.) e ações", 2),
+    (None, "AF", "Recebíveis/ Crédito/ Direito Creditório", 1), (None, "AF", "Equipamentos", 1),
+    ("Cessão Fiduciária", "CF", "Recebíveis/ Crédito/ Direito Creditório", 2), (None, "CF", "Aluguéis", 2),
+    (None, "CF", "Sobrecolateral", 2),
+    ("Fiança", "F", "Sócios", 1), (None, "F", "Empresa", 1),
+    ("Aval", "A", "Sócios", 1), (None, "A", "Empresa", 1),
+    ("Fundo de Reserva", "FR", None, 1),
+    ("Cash Sweep", "CS", None, 1),
+    ("Recompra", "R", None, 0),
+    ("Hipoteca", "H", "Imóvel", 2),
+    ("Clean", "CL", None, 0),
+    ("Coobrigação", "CO", "Empresa", 1),
+    ("Penhor", "P", "Grãos", 1), (None, "P", "Equipamentos", np.nan),
+    ("Garantia Locatícia", "GL", "Aluguéis", 2),
+    ("Sobregarantia", "S", "Imóvel", 2),
+]
+
+# trechos que a limpeza/mapeamento reconhecem
+FRAGMENTOS_VOCAB = [
+    "AF Imóvel", "AF Imóveis", "AF Terreno", "AF SPE", "AF Terras", "AF Grãos", "AF de Cotas",
+    "AF Quotas da SPE", "AF Equipamentos", "Alienação Fiduciária de Imóvel", "CF", "CF de Recebíveis",
+    "CF Aluguéis", "Cessão Fiduciária", "Sobrecolateral", "Fiança", "Fiança dos sócios", "Aval",
+    "Fundo de Reserva", "Fundo de Reserva 5%", "Cash Sweep", "cash sweep", "Recompra", "Hipoteca",
+    "Clean", "Coobrigação", "Penhor de Grãos", "GL", "1 AF Imóvel", "• Aval",
+]
+# trechos que sobram como ruído
+FRAGMENTOS_RUIDO = [
+    "Obras", "Promessa", "CDA/WA Estoques", "R$ 10.000.000", "sócios pessoa física",
+    "Reserva (03 PMTs)", "Seguro", "Subordinação", "Razão de garantia 120%", "Carta de crédito",
+]
+SEPARADORES = [" + ", ", ", " e ", "; ", " - "]
+TIPOS_ATIVO = ["CRI", "CRI", "CRI", "CRA", "LCI", "Debênture"]
+
+
+# ------------------------------------------------------------------
+# Geração
+# ------------------------------------------------------------------
+def gerar_classificacao(path: Path):
+    df = pd.DataFrame(CLASSIFICACAO, columns=["Tipos de Garantia", "Código", "Subclasse", "Nota"])
+    with pd.ExcelWriter(path) as xw:
+        pd.DataFrame([["Classificação das garantias"]]).to_excel(
+            xw, sheet_name="Classificação", header=False, index=False)
+        df.to_excel(xw, sheet_name="Classificação", startrow=1, index=False)
+
+
+def gerar_garantias(rng: np.random.Generator, n: int, fragmentos: float, acerto: float,
+                    frac_nan: float = 0.03) -> list:
+    """`n` textos de Garantia com ~`fragmentos` trechos cada."""
+    k = np.maximum(1, rng.poisson(fragmentos, n))
+    total = int(k.sum())
+    do_vocab = rng.random(total) < acerto
+    trechos = np.where(do_vocab,
+                       rng.choice(np.array(FRAGMENTOS_VOCAB, dtype=object), total),
+                       rng.choice(np.array(FRAGMENTOS_RUIDO, dtype=object), total))
+    seps = rng.choice(np.array(SEPARADORES, dtype=object), n)
+    nan = rng.random(n) < frac_nan
+    out = []
+    ini = 0
+    for i in range(n):
+        fim = ini + k[i]
+        out.append(np.nan if nan[i] else seps[i].join(trechos[ini:fim]))
+        ini = fim
+    return out
+
+
+def _codigos(rng: np.random.Generator, n: int) -> np.ndarray:
+    a = rng.integers(10, 100, n).astype(str).astype(object)
+    b = rng.integers(1_000_000, 10_000_000, n).astype(str).astype(object)
+    return a + "X" + b
+
+
+def gerar_master(rng: np.random.Generator, fundos: int, ativos: float,
+                 fragmentos: float, acerto: float) -> pd.DataFrame:
+    por_fundo = np.maximum(1, rng.poisson(ativos, fundos))
+    nomes = np.array([f"F{i:05d}11" for i in range(fundos)], dtype=object)
+    fundo = np.repeat(nomes, por_fundo)
+    n = len(fundo)
+    df = pd.DataFrame({
+        'Fundo':    fundo,
+        'Ativo':    _codigos(rng, n),
+        '%PL':      np.round(rng.random(n) * 0.05, 6),
+        'Norm.':    np.nan,
+        'Garantia': gerar_garantias(rng, n, fragmentos, acerto),
+    })
+    df['Norm.'] = df['%PL'] / df.groupby('Fundo', sort=False)['%PL'].transform('sum')
+    return df
+
+
+def gerar_planilha_gestora(rng: np.random.Generator, path: Path, ativos: float,
+                           fragmentos: float, acerto: float):
+    """Relatório no layout típico: preâmbulo, cabeçalho na linha 5, rodapé."""
+    n = max(1, int(rng.poisson(ativos)))
+    pl = rng.random(n) * 5
+    carteira = pd.DataFrame({
+        "ATIVO":           rng.choice(TIPOS_ATIVO, n),
+        "CÓDIGO DO ATIVO": _codigos(rng, n),
+        "EMISSOR":         [f"Emissor {i}" for i in rng.integers(1, 500, n)],
+        "% DO PL":         [f"{v:.2f}%".replace('.', ',') for v in pl],
+        "GARANTIAS":       gerar_garantias(rng, n, fragmentos, acerto, frac_nan=0.0),
+    })
+    with pd.ExcelWriter(path) as xw:
+        pd.DataFrame([["Relatório gerencial"], [], ["Carteira"]]).to_excel(
+            xw, sheet_name=SHEET_GESTORA, header=False, index=False)
+        carteira.to_excel(xw, sheet_name=SHEET_GESTORA, startrow=HEADER_GESTORA, index=False)
+        pd.DataFrame([["Total", "", f"{pl.sum():.2f}%"], ["Fonte: gestora"]]).to_excel(
+            xw, sheet_name=SHEET_GESTORA, startrow=HEADER_GESTORA + n + 3, header=False, index=False)
+
+
+def gerar(pasta: Path,
+          fundos: int = 100,
+          ativos: float = 30,
+          fragmentos: float = 3,
+          acerto: float = 0.8,
+          planilhas: int = 5,
+          seed: int = 1) -> dict:
+    """Gera tudo em `pasta`. Retorna os caminhos e o nº de linhas do MASTER."""
+    pasta = Path(pasta)
+    (pasta / "planilhas").mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    classif = pasta / "Estudo_de_Garantias_v3.xlsx"
+    gerar_classificacao(classif)
+
+    master = pasta / "df_tidy_simp_MASTER.csv"
+    df = gerar_master(rng, fundos, ativos, fragmentos, acerto)
+    df.to_csv(master, index=False)
+
+    arquivos = []
+    for i in range(planilhas):
+        p = pasta / "planilhas" / f"G{i:04d}11.xlsx"
+        gerar_planilha_gestora(rng, p, ativos, fragmentos, acerto)
+        arquivos.append(p)
+
+    return {'classif': classif, 'master': master, 'planilhas': arquivos,
+            'linhas': len(df), 'fundos': fundos}
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Gera dados sintéticos (Classificação, MASTER, planilhas de gestora).")
+    ap.add_argument("pasta", help="Pasta de saída.")
+    ap.add_argument("--fundos", type=int, default=100, help="Nº de fundos no MASTER.")
+    ap.add_argument("--ativos", type=float, default=30, help="Posições por fundo (média, Poisson).")
+    ap.add_argument("--fragmentos", type=float, default=3,
+                    help="Trechos por texto de Garantia (média, Poisson; mede o tamanho do texto).")
+    ap.add_argument("--acerto", type=float, default=0.8,
+                    help="Fração dos trechos tirados do vocabulário da Classificação (o resto é ruído).")
+    ap.add_argument("--planilhas", type=int, default=5, help="Nº de planilhas de gestora p/ o ingest.")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    res = gerar(Path(args.pasta), fundos=args.fundos, ativos=args.ativos, fragmentos=args.fragmentos,
+                acerto=args.acerto, planilhas=args.planilhas, seed=args.seed)
+    print(f"[OK] {res['master']}: {res['fundos']} fundos, {res['linhas']} linhas; "
+          f"{len(res['planilhas'])} planilha(s) em {Path(args.pasta) / 'planilhas'}; {res['classif']}")
+
+
+if __name__ == "__main__":
+    main()
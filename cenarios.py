@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+cenarios.py
+-----------
+What-if da Classificação: recalcula o score de todos os fundos sob K tabelas
+de nota alternativas numa única passada.
+
+A nota de uma linha só depende da sua assinatura (conjunto de códigos,
+conjunto de subclasses), então as linhas são deduplicadas uma vez
+(score_matriz.assinaturas) e cada cenário custa J assinaturas × P pares da
+Classificação, não milhões de linhas. O score por fundo sai de um único
+produto (fundos × J) @ (J × K).
+
+Cenários (todos partem da Classificação atual; a coluna 'base' é ela mesma):
+  * --cenarios CSV/JSON com colunas cenario, Código, Subclasse, Nota
+    (Subclasse vazia = todos os pares do código). Ex.:
+        cenario,Código,Subclasse,Nota
+        af_imovel_2,AF,Imóvel,2
+        clean_1,CL,,1
+  * --varredura DELTA: para cada par, um cenário com nota + DELTA e outro
+    com nota − DELTA (gera a aba Derivadas: dScore/dNota por fundo × par);
+  * --aleatorios K --delta D [--seed S]: K cenários com cada nota somada a
+    um ruído uniforme em [−D, D].
+
+Saída (xlsx): Notas_Cenarios, Scores (fundos × cenários), Ranks, Delta_Rank
+(rank no cenário − rank na base; positivo = caiu), Sensibilidade (faixa de
+score e de rank por fundo) e Derivadas (com --varredura).
+
+Requer scipy (mesmo motor do score_app.py --engine matrix).
+
+Uso:
+    python cenarios.py --cenarios data/cenarios.csv --saida cenarios_score.xlsx
+    python cenarios.py --varredura 1 --aleatorios 1000 --delta 0.5 --saida sensibilidade.xlsx
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import master_store
+import metricas
+import score_app
+import score_matriz
+import tokens_csr
+from texto import normalizar
+
+LIMITE_COLUNAS_XLSX = 16_384
+
+
+# ------------------------------------------------------------------
+# Pares da Classificação e tabelas de cenário
+# ------------------------------------------------------------------
+def pares_base(notas_idx) -> tuple[list, np.ndarray]:
+    """Pares (código, subclasse_norm) da Classificação e a nota atual de cada um."""
+    pares = list(notas_idx['pares'])
+    return pares, np.array([notas_idx['pares'][p] for p in pares], dtype=float)
+
+
+def nome_par(par) -> str:
+    return f"{par[0]}|{par[1]}"
+
+
+def ler_cenarios(path: Path, pares: list, base: np.ndarray) -> tuple[list, np.ndarray]:
+    """CSV/JSON de overrides → (nomes, V[K × P]), cada cenário partindo da base."""
+    path = Path(path)
+    df = pd.read_json(path) if path.suffix.lower() == '.json' else pd.read_csv(path)
+    faltando = {'cenario', 'Código', 'Nota'} - set(df.columns)
+    if faltando:
+        raise ValueError(f"{path}: colunas ausentes {sorted(faltando)}")
+    if 'Subclasse' not in df.columns:
+        df['Subclasse'] = np.nan
+
+    pos = {p: i for i, p in enumerate(pares)}
+    por_codigo = {}
+    for i, (c, _s) in enumerate(pares):
+        por_codigo.setdefault(c, []).append(i)
+
+    nomes = list(pd.unique(df['cenario'].astype(str)))
+    V = np.tile(base, (len(nomes), 1))
+    linha = {n: k for k, n in enumerate(nomes)}
+    for r in df.itertuples(index=False):
+        cod = str(getattr(r, 'Código')).strip().upper()
+        sub = r.Subclasse
+        if pd.isna(sub) or str(sub).strip() == '':
+            alvo = por_codigo.get(cod)
+        else:
+            par = (cod, normalizar(str(sub).strip()))
+            alvo = [pos[par]] if par in pos else None
+        if not alvo:
+            raise ValueError(f"{path}: par não existe na Classificação: {cod} / {sub}")
+        V[linha[str(r.cenario)], alvo] = float(r.Nota)
+    return nomes, V
+
+
+def cenarios_varredura(pares: list, base: np.ndarray, delta: float) -> tuple[list, np.ndarray]:
+    """Dois cenários por par: nota + delta e nota − delta."""
+    nomes, linhas = [], []
+    for i, p in enumerate(pares):
+        for sinal in (+1, -1):
+            v = base.copy()
+            v[i] = base[i] + sinal * delta
+            nomes.append(f"{nome_par(p)} {'+' if sinal > 0 else '-'}{delta:g}")
+            linhas.append(v)
+    return nomes, np.array(linhas).reshape(len(linhas), len(pares))
+
+
+def cenarios_aleatorios(base: np.ndarray, k: int, delta: float, seed: int | None = None):
+    """K cenários com ruído uniforme em [−delta, delta] em cada nota (NaN fica NaN)."""
+    rng = np.random.default_rng(seed)
+    V = base[None, :] + rng.uniform(-delta, delta, size=(k, len(base)))
+    return [f"aleatorio_{i + 1}" for i in range(k)], V
+
+
+# ------------------------------------------------------------------
+# Notas por assinatura × cenário
+# ------------------------------------------------------------------
+def _max_mascarado(M: np.ndarray, V: np.ndarray) -> np.ndarray:
+    """out[j, k] = max{V[k, p] : M[j, p]} ignorando NaN; NaN se vazio."""
+    out = np.full((M.shape[0], V.shape[0]), np.nan)
+    for p in range(M.shape[1]):
+        lin = M[:, p]
+        if lin.any():
+            out[lin] = np.fmax(out[lin], V[None, :, p])
+    return out
+
+
+@metricas.medir()
+def notas_cenarios(sigs: dict, pares: list, V: np.ndarray) -> np.ndarray:
+    """
+    Mesma regra de score_app.notas_colunar_detalhe p/ cada assinatura ×
+    cenário: max dos pares presentes; sem par válido, max das notas dos
+    códigos (max_codigo recalculado em cada cenário).
+    """
+    idx_cod = {c: i for i, c in enumerate(sigs['codigos'])}
+    idx_sub = {s: i for i, s in enumerate(sigs['subs_n'])}
+    J = sigs['codes'].shape[0]
+    tem_cod = np.zeros((J, len(pares)), dtype=bool)
+    tem_sub = np.zeros((J, len(pares)), dtype=bool)
+    for p, (c, s) in enumerate(pares):
+        if c in idx_cod:
+            tem_cod[:, p] = sigs['codes'][:, idx_cod[c]]
+        if s in idx_sub:
+            tem_sub[:, p] = sigs['subs'][:, idx_sub[s]]
+    par = _max_mascarado(tem_cod & tem_sub, V)
+    cod = _max_mascarado(tem_cod, V)
+    return np.where(np.isnan(par), cod, par)
+
+
+# ------------------------------------------------------------------
+# Score fundos × cenários
+# ------------------------------------------------------------------
+@metricas.medir()
+def scores_cenarios(fundo, norm, sig, notas: np.ndarray, nomes: list,
+                    drop_na_score: bool = False,
+                    drop_na_norm: bool = False) -> pd.DataFrame:
+    """Σ Norm. × nota / 0.03 por fundo e cenário (NaN = fundo sem linha mantida)."""
+    sp = score_matriz.sp
+    norm = np.asarray(norm, dtype=float)
+    ids, fundos = pd.factorize(pd.Series(fundo), sort=False)
+    manter = ids >= 0
+    if drop_na_norm:
+        manter &= ~np.isnan(norm)
+    F, J = len(fundos), notas.shape[0]
+    W = sp.csr_matrix((np.nan_to_num(norm[manter]), (ids[manter], sig[manter])), shape=(F, J))
+    out = np.asarray(W @ np.nan_to_num(notas)) / 0.03
+
+    cnt = sp.csr_matrix((np.ones(int(manter.sum())), (ids[manter], sig[manter])), shape=(F, J))
+    if drop_na_score:
+        presente = np.asarray(cnt @ (~np.isnan(notas)).astype(float)) > 0
+    else:
+        presente = np.repeat(np.asarray(cnt.sum(axis=1)) > 0, notas.shape[1], axis=1)
+    out[~presente] = np.nan
+    return pd.DataFrame(out, index=pd.Index(fundos, name='Fundo'), columns=nomes)
+
+
+def ranks(df_scores: pd.DataFrame) -> pd.DataFrame:
+    """Rank por cenário (1 = maior score)."""
+    return df_scores.rank(ascending=False, method='min')
+
+
+def sensibilidade(df_scores: pd.DataFrame, df_ranks: pd.DataFrame) -> pd.DataFrame:
+    """Faixa de score e de rank de cada fundo nos cenários (fora a base)."""
+    alt = df_scores.drop(columns='base')
+    alt_r = df_ranks.drop(columns='base')
+    delta = alt_r.sub(df_ranks['base'], axis=0)
+    return pd.DataFrame({
+        'Score_base':   df_scores['base'],
+        'Score_min':    alt.min(axis=1),
+        'Score_max':    alt.max(axis=1),
+        'Score_desvio': alt.std(axis=1),
+        'Rank_base':    df_ranks['base'],
+        'Rank_melhor':  alt_r.min(axis=1),
+        'Rank_pior':    alt_r.max(axis=1),
+        'Max_abs_Delta_rank': delta.abs().max(axis=1),
+    }).reset_index()
+
+
+def derivadas(df_scores: pd.DataFrame, pares: list, delta: float) -> pd.DataFrame:
+    """dScore/dNota por fundo × par (diferença central da varredura)."""
+    cols = {}
+    for p in pares:
+        n = nome_par(p)
+        cols[n] = (df_scores[f"{n} +{delta:g}"] - df_scores[f"{n} -{delta:g}"]) / (2 * delta)
+    return pd.DataFrame(cols, index=df_scores.index).reset_index()
+
+
+# ------------------------------------------------------------------
+# Pipeline
+# ------------------------------------------------------------------
+@metricas.medir()
+def rodar_cenarios(df_fin: pd.DataFrame,
+                   df_tok,
+                   classif: tuple,
+                   path_cenarios: Path | None = None,
+                   varredura: float | None = None,
+                   n_aleatorios: int = 0,
+                   delta: float = 1.0,
+                   seed: int | None = None,
+                   drop_na_norm: bool = False,
+                   drop_na_score: bool = False) -> dict:
+    """
+    `df_fin`/`df_tok`/`classif` como em score_app.run_score_df (linhas na
+    mesma ordem). Retorna {'notas', 'scores', 'ranks', 'delta_rank',
+    'sensibilidade', 'derivadas'}.
+    """
+    _df_class, _class_map, CODIGOS_OFICIAIS, SUB_NORM2CANON, NOTAS_IDX, _hash = classif
+    csr = df_tok if isinstance(df_tok, dict) else tokens_csr.de_largo(df_tok)
+    if len(df_fin) != tokens_csr.n_linhas(csr):
+        raise ValueError(
+            f"Número de linhas difere entre financeiro ({len(df_fin)}) e tokens "
+            f"({tokens_csr.n_linhas(csr)}). Re-rode limpeza/mapear."
+        )
+
+    pares, base = pares_base(NOTAS_IDX)
+    nomes, blocos = ['base'], [base[None, :]]
+    if path_cenarios is not None:
+        n, V = ler_cenarios(path_cenarios, pares, base)
+        nomes += n; blocos.append(V)
+    if varredura:
+        n, V = cenarios_varredura(pares, base, varredura)
+        nomes += n; blocos.append(V)
+    if n_aleatorios:
+        n, V = cenarios_aleatorios(base, n_aleatorios, delta, seed)
+        nomes += n; blocos.append(V)
+    if len(set(nomes)) != len(nomes):
+        raise ValueError("Nomes de cenário repetidos.")
+    V = np.vstack(blocos)
+    print(f"[cenarios] {len(nomes) - 1} cenário(s) × {len(pares)} pares")
+
+    sigs = score_matriz.assinaturas(csr, CODIGOS_OFICIAIS, SUB_NORM2CANON, NOTAS_IDX)
+    print(f"[cenarios] {len(sigs['sig'])} linhas → {sigs['codes'].shape[0]} assinaturas distintas")
+    notas = notas_cenarios(sigs, pares, V)
+
+    df_scores = scores_cenarios(df_fin['Fundo'], df_fin['Norm.'], sigs['sig'], notas, nomes,
+                                drop_na_score=drop_na_score, drop_na_norm=drop_na_norm)
+    df_ranks = ranks(df_scores)
+    df_notas = pd.DataFrame(V.T, index=pd.Index([nome_par(p) for p in pares], name='Par'),
+                            columns=nomes).reset_index()
+    return {
+        'notas': df_notas,
+        'scores': df_scores.reset_index(),
+        'ranks': df_ranks.reset_index(),
+        'delta_rank': df_ranks.sub(df_ranks['base'], axis=0).drop(columns='base').reset_index(),
+        'sensibilidade': sensibilidade(df_scores, df_ranks) if len(nomes) > 1 else None,
+        'derivadas': derivadas(df_scores, pares, varredura) if varredura else None,
+    }
+
+
+@metricas.medir()
+def salvar_cenarios(res: dict, saida: Path):
+    if res['scores'].shape[1] > LIMITE_COLUNAS_XLSX:
+        raise ValueError(f"Cenários demais para uma aba xlsx ({res['scores'].shape[1] - 1}).")
+    abas = [('Notas_Cenarios', 'notas'), ('Scores', 'scores'), ('Ranks', 'ranks'),
+            ('Delta_Rank', 'delta_rank'), ('Sensibilidade', 'sensibilidade'),
+            ('Derivadas', 'derivadas')]
+    with pd.ExcelWriter(saida, engine=score_app._pick_excel_engine()) as xlw:
+        for aba, chave in abas:
+            if res[chave] is not None:
+                res[chave].to_excel(xlw, sheet_name=aba, index=False)
+    print(f"✅ Cenários salvos em: {saida}")
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Score de todos os fundos sob notas alternativas da Classificação.")
+    ap.add_argument("--fin",     default="data/df_tidy_simp_MASTER.csv",
+                    help="CSV financeiro MASTER (ou store particionado).")
+    ap.add_argument("--tok",     default="data/garantias_cod_MASTER.csv",
+                    help="Tokens codificados MASTER (CSV largo ou .npz CSR).")
+    ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
+                    help="Planilha Classificação (notas da base).")
+    ap.add_argument("--cenarios", default=None,
+                    help="CSV/JSON com cenario, Código, Subclasse, Nota.")
+    ap.add_argument("--varredura", type=float, default=None,
+                    help="Cada par ± DELTA (um cenário por sinal) + aba Derivadas.")
+    ap.add_argument("--aleatorios", type=int, default=0,
+                    help="Número de cenários com ruído uniforme em [−delta, delta].")
+    ap.add_argument("--delta", type=float, default=1.0,
+                    help="Amplitude do ruído de --aleatorios.")
+    ap.add_argument("--seed", type=int, default=None,
+                    help="Semente de --aleatorios.")
+    ap.add_argument("--drop-na-norm", action="store_true",
+                    help="Drop linhas com Norm. NaN antes do score.")
+    ap.add_argument("--drop-na-score", action="store_true",
+                    help="Drop linhas com nota NaN antes do score.")
+    ap.add_argument("--saida", default="cenarios_score.xlsx",
+                    help="XLSX de saída.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    if not (args.cenarios or args.varredura or args.aleatorios):
+        ap.error("informe --cenarios, --varredura e/ou --aleatorios.")
+
+    with metricas.execucao("cenarios", args):
+        classif = score_app.load_classificacao(Path(args.classif))
+        with master_store.travar(Path(args.fin).parent, exclusiva=False):
+            df_fin = score_app.load_fin(Path(args.fin))
+            df_tok = score_app.load_tokens(Path(args.tok))
+        metricas.fim_passos("score")
+
+        res = rodar_cenarios(
+            df_fin, df_tok, classif,
+            path_cenarios=Path(args.cenarios) if args.cenarios else None,
+            varredura=args.varredura,
+            n_aleatorios=args.aleatorios,
+            delta=args.delta,
+            seed=args.seed,
+            drop_na_norm=args.drop_na_norm,
+            drop_na_score=args.drop_na_score,
+        )
+        salvar_cenarios(res, Path(args.saida))
+
+        if res['sensibilidade'] is not None:
+            print("\n─── Fundos mais sensíveis (|Δrank| máx) ───")
+            top = res['sensibilidade'].sort_values('Max_abs_Delta_rank', ascending=False).head(10)
+            for _, r in top.iterrows():
+                print(f"{r['Fundo']}: score {r['Score_base']:.2f} "
+                      f"[{r['Score_min']:.2f}, {r['Score_max']:.2f}], Δrank máx {r['Max_abs_Delta_rank']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
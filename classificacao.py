@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+classificacao.py
+----------------
+Carrega a aba "Classificação" (Estudo_de_Garantias_v3.xlsx) uma única vez e
+compila os vocabulários usados por limpeza, mapear_codigo e score_app.
+
+O resultado é gravado como artefato binário (pickle) em `<pasta do xlsx>/.cache/`,
+com nome derivado do hash (SHA-256) do conteúdo da planilha. Enquanto o xlsx não
+mudar, qualquer processo reaproveita o artefato sem abrir o Excel; se a planilha
+for editada, o hash muda e o artefato é refeito na próxima execução.
+
+Uso (pré-compilar / inspecionar):
+    python classificacao.py --classif data/Estudo_de_Garantias_v3.xlsx
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from texto import normalizar, normalizar_serie
+
+
+# Incrementar quando o conteúdo do artefato mudar de formato
+CACHE_VERSAO = 1
+
+
+# ------------------------------------------------------------------
+# Utils
+# ------------------------------------------------------------------
+
+def hash_arquivo(path: Path, bloco: int = 1 << 20) -> str:
+    """SHA-256 do conteúdo do arquivo."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(bloco), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ------------------------------------------------------------------
+# Vocabulários por etapa
+# ------------------------------------------------------------------
+def _vocab_limpeza(df_raw: pd.DataFrame) -> dict:
+    tipos_garantia = set(df_raw['Tipos de Garantia'].dropna().str.strip().unique())
+    codigo = set(df_raw['Código'].dropna().str.strip().unique())
+    subclasses = set(df_raw['Subclasse'].dropna().str.strip().unique())
+
+    tipos_norm = {normalizar(t) for t in tipos_garantia}
+    return {
+        'tipos_norm':  tipos_norm,
+        'codigos':     {c.upper() for c in codigo},
+        'subs_norm':   {normalizar(s) for s in subclasses},
+        'prefix_tipo': {t.split(' ', 1)[0]: t for t in tipos_norm},
+    }
+
+
+def _vocab_mapear(df_raw: pd.DataFrame) -> dict:
+    # mapear_codigo lia a planilha com dtype=str
+    df_class = df_raw[['Tipos de Garantia', 'Código', 'Subclasse']]
+
+    CODIGOS_OFICIAIS    = set(df_class['Código'].dropna().astype(str).str.upper())
+    SUBCLASSES_OFICIAIS = {normalizar(s) for s in df_class['Subclasse'].dropna().astype(str)}
+
+    ALIAS2CODE = {}
+    for tipo, code in df_class[['Tipos de Garantia', 'Código']].dropna().astype(str).itertuples(index=False):
+        ALIAS2CODE.setdefault(normalizar(tipo), code.upper().strip())
+
+    return {
+        'CODIGOS_OFICIAIS':    CODIGOS_OFICIAIS,
+        'SUBCLASSES_OFICIAIS': SUBCLASSES_OFICIAIS,
+        'ALIAS2CODE':          ALIAS2CODE,
+    }
+
+
+def compilar_notas(class_map, SUB_NORM2CANON):
+    """
+    Índice compilado p/ score_app.notas_colunar_detalhe:
+      - 'pares':      (código, subclasse_norm) → nota (o próprio class_map)
+      - 'max_codigo': código → melhor nota válida (fallback sem subclasse)
+      - 'sub_norm':   subclasse canônica → subclasse normalizada
+    """
+    max_codigo = {}
+    for (c, _s), n in class_map.items():
+        if np.isnan(n):
+            continue
+        if c not in max_codigo or n > max_codigo[c]:
+            max_codigo[c] = n
+
+    sub_norm = {canon: s_norm for s_norm, canon in SUB_NORM2CANON.items()}
+
+    return {
+        'pares': class_map,
+        'max_codigo': max_codigo,
+        'sub_norm': sub_norm,
+    }
+
+
+def _vocab_score(df_raw: pd.DataFrame) -> dict:
+    df_class = df_raw.copy()
+
+    # Limpeza
+    df_class['Código']    = df_class['Código'].astype(str).str.strip().str.upper()
+    df_class['Subclasse'] = df_class['Subclasse'].astype(str).str.strip()
+
+    # Nota para numérico
+    df_class['Nota'] = pd.to_numeric(df_class['Nota'], errors='coerce')
+
+    # Normalizado
+    df_class['Subclasse_norm'] = normalizar_serie(df_class['Subclasse'])
+
+    # Mapas
+    class_map = (
+        df_class
+        .dropna(subset=['Código','Subclasse_norm'])
+        .set_index(['Código','Subclasse_norm'])['Nota']
+        .to_dict()
+    )
+
+    CODIGOS_OFICIAIS = set(df_class['Código'].dropna().unique())
+
+    SUB_NORM2CANON = (
+        df_class.dropna(subset=['Subclasse'])
+                .set_index('Subclasse_norm')['Subclasse']
+                .to_dict()
+    )
+
+    return {
+        'df_class':         df_class,
+        'class_map':        class_map,
+        'CODIGOS_OFICIAIS': CODIGOS_OFICIAIS,
+        'SUB_NORM2CANON':   SUB_NORM2CANON,
+        'NOTAS_IDX':        compilar_notas(class_map, SUB_NORM2CANON),
+    }
+
+
+def compilar_regras(path_xlsx: Path, sheet_name: str = "Classificação") -> dict:
+    """Lê o xlsx (lento) e monta o dicionário completo de regras."""
+    df_raw = pd.read_excel(path_xlsx, sheet_name=sheet_name, header=1)
+    return {
+        'versao':   CACHE_VERSAO,
+        'sheet':    sheet_name,
+        'df_raw':   df_raw,
+        'limpeza':  _vocab_limpeza(df_raw),
+        'mapear':   _vocab_mapear(df_raw),
+        'score':    _vocab_score(df_raw),
+    }
+
+
+# ------------------------------------------------------------------
+# Loader com cache
+# ------------------------------------------------------------------
+def _digest(path_xlsx: Path, sheet_name: str) -> str:
+    """Chave do artefato: conteúdo do xlsx + aba + versão do formato."""
+    return hashlib.sha256(
+        f"{hash_arquivo(path_xlsx)}|{sheet_name}|{CACHE_VERSAO}".encode('utf-8')
+    ).hexdigest()
+
+
+def _caminho_cache(path_xlsx: Path, digest: str, cache_dir: Path | None) -> Path:
+    cache_dir = Path(cache_dir) if cache_dir is not None else path_xlsx.parent / '.cache'
+    return cache_dir / f"classificacao_{digest[:20]}.pkl"
+
+
+def carregar_regras(path_xlsx: Path,
+                    sheet_name: str = "Classificação",
+                    cache_dir: Path | None = None,
+                    usar_cache: bool = True,
+                    forcar: bool = False) -> dict:
+    """
+    Regras compiladas da Classificação. Chaves:
+      'hash', 'df_raw', 'limpeza', 'mapear', 'score' (ver _vocab_*).
+    forcar=True ignora o artefato existente e o regrava.
+    """
+    path_xlsx = Path(path_xlsx)
+    digest = _digest(path_xlsx, sheet_name)
+    arq_cache = _caminho_cache(path_xlsx, digest, cache_dir)
+
+    if usar_cache and not forcar and arq_cache.exists():
+        try:
+            with open(arq_cache, 'rb') as fh:
+                regras = pickle.load(fh)
+            if regras.get('hash') == digest:
+                return regras
+        except Exception as e:
+            print(f"    [WARN] Cache de Classificação inválido ({arq_cache}): {e}; recompilando.")
+
+    regras = compilar_regras(path_xlsx, sheet_name)
+    regras['hash'] = digest
+
+    if usar_cache:
+        try:
+            arq_cache.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=arq_cache.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(regras, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, arq_cache)
+        except OSError as e:
+            print(f"    [WARN] Não foi possível gravar cache em {arq_cache}: {e}")
+
+    return regras
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Compila (e guarda em cache) as regras da aba Classificação.")
+    ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
+                    help="Planilha Classificação.")
+    ap.add_argument("--sheet", default="Classificação",
+                    help="Nome da aba.")
+    ap.add_argument("--cache-dir", default=None,
+                    help="Pasta do cache (padrão: <pasta do xlsx>/.cache).")
+    ap.add_argument("--forcar", action="store_true",
+                    help="Ignora o cache existente e recompila.")
+    args = ap.parse_args()
+
+    path_xlsx = Path(args.classif)
+    cache_dir = Path(args.cache_dir) if args.cache_dir else None
+    regras = carregar_regras(path_xlsx, args.sheet, cache_dir=cache_dir, forcar=args.forcar)
+    arq_cache = _caminho_cache(path_xlsx, regras['hash'], cache_dir)
+
+    sc = regras['score']
+    print(f"Classificação: {path_xlsx} (aba: {args.sheet})")
+    print(f"Hash:          {regras['hash'][:20]}")
+    print(f"Cache:         {arq_cache}")
+    print(f"Códigos: {len(sc['CODIGOS_OFICIAIS'])}, Subclasses: {len(sc['SUB_NORM2CANON'])}, "
+          f"Aliases→código: {len(regras['mapear']['ALIAS2CODE'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+historico_scores.py
+-------------------
+Histórico append-only dos scores em SQLite (stdlib sqlite3), no lugar de
+regravar o placar xlsx inteiro a cada rodada.
+
+Tabelas:
+    rodadas(id, ts, regras_hash, origem)
+    scores(rodada, fundo, score, master_hash, stats)   -- stats em JSON
+    índice (fundo, rodada)
+
+Cada rodada do score_app com --historico grava uma linha em `rodadas` e uma
+por fundo em `scores`, só para os fundos cujo (score, master_hash,
+regras_hash) mudou em relação ao último registro do fundo: custo
+proporcional aos fundos atualizados. Nada é sobrescrito.
+
+Consultas (indexadas por fundo/rodada):
+  - ultimos: último score de cada fundo (opcionalmente até uma data);
+  - serie:   série temporal de um fundo;
+  - deltas:  score em --de × score em --ate por fundo (variação no período).
+O placar xlsx (--scores-master-xlsx) vira uma exportação de `ultimos`;
+fundos do placar que o histórico ainda não tem são importados antes
+(semear_placar), então a exportação nunca encolhe o placar.
+
+Uso:
+    python score_app.py --historico data/scores_historico.sqlite --scores-only --saida-xlsx ''
+    python historico_scores.py data/scores_historico.sqlite ultimos
+    python historico_scores.py data/scores_historico.sqlite serie MXRF11
+    python historico_scores.py data/scores_historico.sqlite deltas --de 2026-09-30 --ate 2026-10-31
+    python historico_scores.py data/scores_historico.sqlite exportar score_placar_MASTER.xlsx
+    python historico_scores.py data/scores_historico.sqlite importar-placar score_placar_MASTER.xlsx
+"""
+
+import argparse
+import json
+import math
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import saida_score
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS rodadas (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts          TEXT NOT NULL,
+    regras_hash TEXT,
+    origem      TEXT
+);
+CREATE TABLE IF NOT EXISTS scores (
+    rodada      INTEGER NOT NULL REFERENCES rodadas(id),
+    fundo       TEXT NOT NULL,
+    score       REAL,
+    master_hash TEXT,
+    stats       TEXT,
+    PRIMARY KEY (fundo, rodada)
+);
+CREATE INDEX IF NOT EXISTS ix_rodadas_ts ON rodadas(ts);
+"""
+
+
+def conectar(path: Path) -> sqlite3.Connection:
+    con = sqlite3.connect(str(path))
+    con.executescript(ESQUEMA)
+    return con
+
+
+def _ts_limite(ate: str | None) -> str | None:
+    """'AAAA-MM-DD' vale até o fim do dia."""
+    if ate is not None and len(ate) == 10:
+        return ate + "T23:59:59"
+    return ate
+
+
+# ------------------------------------------------------------------
+# Escrita
+# ------------------------------------------------------------------
+def _mesmo(a, b) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    return math.isclose(a, b, rel_tol=0, abs_tol=1e-12)
+
+
+def gravar_rodada(path: Path,
+                  df_scores: pd.DataFrame,
+                  df_stats: pd.DataFrame | None = None,
+                  regras_hash: str | None = None,
+                  master_hashes: dict | None = None,
+                  origem: str | None = None,
+                  ts: str | None = None) -> dict:
+    """
+    Acrescenta uma rodada. Só entram os fundos de `df_scores` cujo score,
+    master_hash ou regras_hash difere do último registro do fundo.
+    Retorna {'rodada', 'gravados', 'iguais'}.
+    """
+    ts = ts or time.strftime('%Y-%m-%dT%H:%M:%S')
+    master_hashes = master_hashes or {}
+    stats = {}
+    if df_stats is not None and len(df_stats):
+        for r in json.loads(df_stats.to_json(orient='records', force_ascii=False)):
+            stats[r.pop('Fundo')] = r
+
+    novos = []
+    for fundo, score in zip(df_scores['Fundo'], df_scores['Score_Garantia']):
+        score = None if pd.isna(score) else float(score)
+        novos.append((str(fundo), score, master_hashes.get(fundo),
+                      json.dumps(stats.get(fundo), ensure_ascii=False) if fundo in stats else None))
+
+    con = conectar(path)
+    try:
+        with con:   # uma transação por rodada
+            anteriores = {}
+            fundos = [n[0] for n in novos]
+            for i in range(0, len(fundos), 500):   # limite de parâmetros do sqlite
+                lote = fundos[i:i + 500]
+                q = f"""
+                    SELECT s.fundo, s.score, s.master_hash, r.regras_hash
+                    FROM scores s JOIN rodadas r ON r.id = s.rodada
+                    WHERE s.fundo IN ({','.join('?' * len(lote))})
+                      AND s.rodada = (SELECT MAX(rodada) FROM scores WHERE fundo = s.fundo)
+                """
+                for f, sc, mh, rh in con.execute(q, lote):
+                    anteriores[f] = (sc, mh, rh)
+
+            gravar = [n for n in novos
+                      if n[0] not in anteriores
+                      or not _mesmo(anteriores[n[0]][0], n[1])
+                      or anteriores[n[0]][1] != n[2]
+                      or anteriores[n[0]][2] != regras_hash]
+            rodada = con.execute(
+                "INSERT INTO rodadas (ts, regras_hash, origem) VALUES (?, ?, ?)",
+                (ts, regras_hash, origem),
+            ).lastrowid
+            con.executemany(
+                "INSERT INTO scores (rodada, fundo, score, master_hash, stats) VALUES (?, ?, ?, ?, ?)",
+                [(rodada,) + n for n in gravar],
+            )
+    finally:
+        con.close()
+    return {'rodada': rodada, 'gravados': len(gravar), 'iguais': len(novos) - len(gravar)}
+
+
+# ------------------------------------------------------------------
+# Consultas
+# ------------------------------------------------------------------
+def ultimos(path: Path, ate: str | None = None, fundos=None, com_stats: bool = False) -> pd.DataFrame:
+    """Último score de cada fundo (até `ate`, se informado)."""
+    ate = _ts_limite(ate)
+    where, params = [], []
+    if ate is not None:
+        where.append("r.ts <= ?"); params.append(ate)
+    if fundos:
+        where.append(f"s.fundo IN ({','.join('?' * len(fundos))})"); params += list(fundos)
+    q = f"""
+        SELECT fundo AS Fundo, score AS Score_Garantia, ts, rodada, master_hash, regras_hash, stats
+        FROM (
+            SELECT s.*, r.ts, r.regras_hash,
+                   ROW_NUMBER() OVER (PARTITION BY s.fundo ORDER BY s.rodada DESC) AS n
+            FROM scores s JOIN rodadas r ON r.id = s.rodada
+            {('WHERE ' + ' AND '.join(where)) if where else ''}
+        )
+        WHERE n = 1
+        ORDER BY fundo
+    """
+    con = conectar(path)
+    try:
+        df = pd.read_sql_query(q, con, params=params)
+    finally:
+        con.close()
+    return _expandir_stats(df) if com_stats else df.drop(columns='stats')
+
+
+def serie(path: Path, fundo: str) -> pd.DataFrame:
+    """Série temporal do score de um fundo (uma linha por rodada em que mudou)."""
+    q = """
+        SELECT r.ts, s.rodada, s.score AS Score_Garantia, s.master_hash, r.regras_hash
+        FROM scores s JOIN rodadas r ON r.id = s.rodada
+        WHERE s.fundo = ?
+        ORDER BY s.rodada
+    """
+    con = conectar(path)
+    try:
+        return pd.read_sql_query(q, con, params=[fundo])
+    finally:
+        con.close()
+
+
+def deltas(path: Path, de: str, ate: str | None = None) -> pd.DataFrame:
+    """Score de cada fundo em `de` e em `ate` (padrão: agora) e a variação."""
+    a = ultimos(path, ate=de)[['Fundo', 'Score_Garantia', 'ts']]
+    b = ultimos(path, ate=ate)[['Fundo', 'Score_Garantia', 'ts']]
+    df = a.merge(b, on='Fundo', how='outer', suffixes=('_de', '_ate'))
+    df['Delta'] = df['Score_Garantia_ate'] - df['Score_Garantia_de']
+    df['Delta_pct'] = df['Delta'] / df['Score_Garantia_de'].where(df['Score_Garantia_de'] != 0)
+    return df.sort_values('Delta', key=lambda s: s.abs(), ascending=False, na_position='last',
+                          ignore_index=True)
+
+
+def _expandir_stats(df: pd.DataFrame) -> pd.DataFrame:
+    st = pd.DataFrame([json.loads(s) if s else {} for s in df['stats']], index=df.index)
+    st = st.drop(columns=[c for c in st.columns if c in df.columns], errors='ignore')
+    return pd.concat([df.drop(columns='stats'), st], axis=1)
+
+
+# ------------------------------------------------------------------
+# Placar xlsx ↔ histórico
+# ------------------------------------------------------------------
+def exportar_placar(path: Path, path_xlsx: Path, sort_by: str = "Fundo") -> pd.DataFrame:
+    """Placar (aba Scores: Fundo, Score_Garantia) a partir dos últimos scores."""
+    df = ultimos(path)[['Fundo', 'Score_Garantia']]
+    if sort_by == "Score_Garantia":
+        df = df.sort_values('Score_Garantia', ascending=False, ignore_index=True)
+    saida_score.gravar_xlsx_streaming(path_xlsx, [('Scores', df)])
+    return df
+
+
+def importar_placar(path: Path, path_xlsx: Path) -> dict:
+    """Semeia o histórico com um placar xlsx antigo (uma rodada, origem = o arquivo)."""
+    df = pd.read_excel(path_xlsx, sheet_name='Scores')
+    return gravar_rodada(path, df[['Fundo', 'Score_Garantia']], origem=f"placar:{Path(path_xlsx).name}")
+
+
+def semear_placar(path: Path, path_xlsx: Path) -> dict | None:
+    """
+    Importa do placar xlsx só os fundos que o histórico ainda não tem, p/ que
+    exportar_placar não deixe de fora fundos do placar acumulado (histórico
+    novo ou parcial). Placar inexistente: nada a fazer (None).
+    """
+    path_xlsx = Path(path_xlsx)
+    if not path_xlsx.exists():
+        return None
+    df = pd.read_excel(path_xlsx, sheet_name='Scores')
+    if 'Fundo' not in df.columns or 'Score_Garantia' not in df.columns:
+        raise ValueError(f"{path_xlsx}: aba 'Scores' sem Fundo/Score_Garantia; "
+                         "não dá p/ exportar o placar do histórico sem perder fundos.")
+    conhecidos = set(ultimos(path)['Fundo'])
+    faltam = df[~df['Fundo'].astype(str).isin(conhecidos)]
+    if not len(faltam):
+        return None
+    return gravar_rodada(path, faltam[['Fundo', 'Score_Garantia']], origem=f"placar:{path_xlsx.name}")
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Histórico append-only de scores (SQLite).")
+    ap.add_argument("db", help="Arquivo SQLite do histórico.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    u = sub.add_parser("ultimos", help="Último score de cada fundo.")
+    u.add_argument("--ate", default=None, help="Data/hora limite (AAAA-MM-DD[THH:MM:SS]).")
+    u.add_argument("--stats", action="store_true", help="Inclui as colunas de Stats.")
+
+    s = sub.add_parser("serie", help="Série temporal de um fundo.")
+    s.add_argument("fundo")
+
+    d = sub.add_parser("deltas", help="Variação do score por fundo entre duas datas.")
+    d.add_argument("--de", required=True)
+    d.add_argument("--ate", default=None)
+
+    e = sub.add_parser("exportar", help="Gera o placar xlsx a partir do histórico.")
+    e.add_argument("xlsx")
+    e.add_argument("--sort-by", choices=["Fundo", "Score_Garantia"], default="Fundo")
+
+    i = sub.add_parser("importar-placar", help="Semeia o histórico com um placar xlsx existente.")
+    i.add_argument("xlsx")
+
+    for p in (u, s, d):
+        p.add_argument("--csv", default=None, help="Salva o resultado em CSV.")
+
+    args = ap.parse_args()
+    db = Path(args.db)
+
+    if args.cmd == "exportar":
+        df = exportar_placar(db, Path(args.xlsx), sort_by=args.sort_by)
+        print(f"[OK] Placar exportado: {args.xlsx} ({len(df)} fundos)")
+        return
+    if args.cmd == "importar-placar":
+        r = importar_placar(db, Path(args.xlsx))
+        print(f"[OK] Rodada {r['rodada']}: {r['gravados']} fundo(s) importado(s)")
+        return
+
+    if args.cmd == "ultimos":
+        df = ultimos(db, ate=args.ate, com_stats=args.stats)
+    elif args.cmd == "serie":
+        df = serie(db, args.fundo)
+    else:
+        df = deltas(db, de=args.de, ate=args.ate)
+
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+        print(f"[OK] {len(df)} linha(s) salvas em {args.csv}")
+    else:
+        with pd.option_context('display.max_rows', 200, 'display.width', 200):
+            print(df)
+
+
+if __name__ == "__main__":
+    main()
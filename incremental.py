@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+incremental.py
+--------------
+Fingerprints por fundo p/ rodar limpeza / mapear_codigo / score_app só nos
+fundos cujas entradas mudaram.
+
+Cada saída ganha um arquivo irmão `<saida>.fp.json` com o fingerprint de cada
+fundo usado na última rodada. Todo caminho que regrava a saída apaga o
+sidecar antes e só o recria com os fingerprints do que foi gravado (rodada
+não incremental: fica sem sidecar e o próximo --incremental recalcula tudo). O fingerprint combina:
+  - o hash das linhas do fundo nas colunas de entrada da etapa;
+  - um "extra" da etapa (hash das regras da Classificação + do próprio script),
+    de modo que mudar a planilha ou o código invalida todos os fundos.
+"""
+
+import hashlib
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from classificacao import hash_arquivo
+
+
+# ------------------------------------------------------------------
+# Fingerprints
+# ------------------------------------------------------------------
+def _hash_tokens(df: pd.DataFrame, gcols) -> np.ndarray:
+    """
+    Hash por linha só dos tokens não vazios de G1..Gn, em ordem. Não depende
+    da largura do frame: acrescentar colunas G vazias não muda o hash.
+    """
+    h = np.zeros(len(df), dtype=np.uint64)
+    for c in gcols:
+        v = df[c]
+        ok = v.notna().to_numpy()
+        hv = pd.util.hash_array(v.astype(str).to_numpy(dtype=object))
+        with np.errstate(over='ignore'):
+            h = np.where(ok, (h * np.uint64(1000003)) ^ hv, h)
+    return h
+
+
+def fingerprints(df: pd.DataFrame, colunas, extra: str = '', gcols=None) -> dict:
+    """
+    {fundo: sha256(extra + hashes das linhas do fundo em `colunas`)}.
+    `gcols` (G1..Gn) entram pelo hash independente de largura (_hash_tokens).
+    """
+    colunas = [c for c in colunas if c in df.columns]
+    h_linhas = pd.util.hash_pandas_object(df[colunas], index=False).to_numpy()
+    if gcols:
+        h_linhas = np.stack([h_linhas, _hash_tokens(df, gcols)], axis=1)
+    out = {}
+    for fundo, idx in df.groupby('Fundo', sort=False).indices.items():
+        d = hashlib.sha256(extra.encode('utf-8'))
+        d.update("|".join(colunas).encode('utf-8'))
+        d.update(h_linhas[idx].tobytes())
+        out[fundo] = d.hexdigest()
+    return out
+
+
+def extra_etapa(*partes) -> str:
+    """Combina hashes de regras e caminhos de scripts num único texto."""
+    out = []
+    for p in partes:
+        if isinstance(p, Path):
+            out.append(hash_arquivo(p))
+        else:
+            out.append(str(p))
+    return "|".join(out)
+
+
+# ------------------------------------------------------------------
+# Estado (sidecar .fp.json)
+# ------------------------------------------------------------------
+def _arq_estado(path_saida: Path) -> Path:
+    return Path(str(path_saida) + '.fp.json')
+
+
+def ler_estado(path_saida: Path) -> dict:
+    arq = _arq_estado(path_saida)
+    if not Path(path_saida).exists() or not arq.exists():
+        return {}
+    try:
+        with open(arq, encoding='utf-8') as fh:
+            return json.load(fh).get('fundos', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def invalidar_estado(path_saida: Path):
+    """Apaga o sidecar. Chamar antes de regravar a saída: sem ele, o próximo --incremental recalcula tudo."""
+    _arq_estado(path_saida).unlink(missing_ok=True)
+
+
+def gravar_estado(path_saida: Path, fps: dict | None):
+    """Grava os fingerprints da saída recém-gravada; None (rodada completa) = sem sidecar."""
+    if fps is None:
+        invalidar_estado(path_saida)
+        return
+    with open(_arq_estado(path_saida), 'w', encoding='utf-8') as fh:
+        json.dump({'fundos': fps}, fh, ensure_ascii=False, indent=1)
+
+
+# ------------------------------------------------------------------
+# Planejamento / merge
+# ------------------------------------------------------------------
+def planejar(fps: dict, estado: dict, df_ref: pd.DataFrame,
+             df_antigo: pd.DataFrame | None) -> list:
+    """
+    Fundos a recalcular: fingerprint novo/alterado, ou cujo nº de linhas na
+    saída existente não bate com a entrada (saída editada/corrompida).
+    """
+    if df_antigo is None or not estado:
+        return list(fps)
+
+    n_ref = df_ref.groupby('Fundo', sort=False).size()
+    n_ant = df_antigo.groupby('Fundo', sort=False).size()
+    out = []
+    for fundo, fp in fps.items():
+        if estado.get(fundo) != fp or n_ant.get(fundo, -1) != n_ref.get(fundo):
+            out.append(fundo)
+    return out
+
+
+def _ordenar_gcols(df: pd.DataFrame) -> pd.DataFrame:
+    """G1..Gn em ordem numérica, sem colunas G finais 100% vazias."""
+    gcols = sorted((c for c in df.columns if re.fullmatch(r'G\d+', c)),
+                   key=lambda c: int(c[1:]))
+    while gcols and df[gcols[-1]].isna().all():
+        gcols.pop()
+    outras = [c for c in df.columns if not re.fullmatch(r'G\d+', c)]
+    return df[outras + gcols]
+
+
+def mesclar_por_linha(df_ref: pd.DataFrame,
+                      df_antigo: pd.DataFrame | None,
+                      df_novo: pd.DataFrame,
+                      fundos_novos) -> pd.DataFrame:
+    """
+    Monta a saída completa na ordem de linhas de `df_ref` (chave Fundo + nº da
+    linha dentro do fundo): fundos em `fundos_novos` vêm de `df_novo`, os
+    demais de `df_antigo`. Fundos que saíram do ref são descartados.
+    """
+    novos = set(fundos_novos)
+    partes = [df_novo.reset_index(drop=True)]
+    if df_antigo is not None:
+        partes.insert(0, df_antigo[~df_antigo['Fundo'].isin(novos)].reset_index(drop=True))
+    base = pd.concat(partes, ignore_index=True)
+    base['_row'] = base.groupby('Fundo', sort=False).cumcount()
+
+    ref = df_ref[['Fundo']].reset_index(drop=True)
+    ref['_row'] = ref.groupby('Fundo', sort=False).cumcount()
+
+    out = ref.merge(base, on=['Fundo', '_row'], how='left', validate='1:1')
+    cols = [c for c in base.columns if c != '_row']
+    return _ordenar_gcols(out[cols])
+
+
+def resumo(fundos_recalc, fps) -> str:
+    n, tot = len(fundos_recalc), len(fps)
+    if n == tot:
+        return f"incremental: recalculando todos os {tot} fundos"
+    return f"incremental: {n}/{tot} fundo(s) alterado(s) → {', '.join(map(str, fundos_recalc)) or '—'}"
+
+
+def linhas_de(df: pd.DataFrame, fundos) -> np.ndarray:
+    """Máscara booleana das linhas dos fundos pedidos."""
+    return df['Fundo'].isin(list(fundos)).to_numpy()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+indice_csv.py
+-------------
+Índice de bytes por fundo para os MASTER em CSV (financeiro e tokens), para
+ler só as linhas de alguns fundos sem varrer o arquivo inteiro com o parser.
+
+O índice fica ao lado do CSV (`<csv>.idx.json`):
+    {"tamanho": ..., "mtime_ns": ..., "cabecalho": [0, fim],
+     "fundos": {"MXRF11": [[ini, fim], ...], ...}}
+com as faixas de bytes (linhas contíguas do fundo) na ordem do arquivo. Vale
+enquanto tamanho/mtime do CSV não mudarem; se mudarem, é reconstruído na
+próxima leitura (append_to_master regrava o CSV → índice velho é descartado).
+
+Construção: os limites de registro são as quebras de linha fora de aspas,
+achadas por paridade de aspas (numpy, em blocos), de modo que campos com
+quebra de linha entre aspas não quebram o índice. O fundo de cada registro
+vem de um read_csv só da coluna Fundo.
+
+Uso:
+    python indice_csv.py construir data/df_tidy_simp_MASTER.csv
+    python indice_csv.py ler data/garantias_cod_MASTER.csv MXRF11 KNIP11
+"""
+
+import argparse
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import master_store
+
+SUFIXO = ".idx.json"
+BLOCO_BYTES = 64 << 20
+_ASPAS = ord('"')
+_NL = ord('\n')
+
+
+def caminho_indice(csv_path: Path) -> Path:
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.name + SUFIXO)
+
+
+def _assinatura(csv_path: Path):
+    st = Path(csv_path).stat()
+    return st.st_size, st.st_mtime_ns
+
+
+# ------------------------------------------------------------------
+# Construção
+# ------------------------------------------------------------------
+def limites_registros(csv_path: Path, bloco: int = BLOCO_BYTES) -> np.ndarray:
+    """
+    Offsets de fim (exclusivo) de cada registro: posição após cada '\\n' com
+    número par de aspas antes dele; o último registro sem '\\n' final também
+    entra.
+    """
+    fins = []
+    paridade = 0
+    pos = 0
+    with open(csv_path, 'rb') as f:
+        while True:
+            buf = f.read(bloco)
+            if not buf:
+                break
+            arr = np.frombuffer(buf, dtype=np.uint8)
+            aspas = np.cumsum(arr == _ASPAS) + paridade
+            nl = np.flatnonzero((arr == _NL) & (aspas % 2 == 0))
+            fins.append(nl + pos + 1)
+            paridade = int(aspas[-1] % 2)
+            pos += len(buf)
+    fins = np.concatenate(fins) if fins else np.empty(0, dtype=np.int64)
+    if not len(fins) or fins[-1] != pos:
+        fins = np.append(fins, pos)
+    return fins.astype(np.int64)
+
+
+def construir_indice(csv_path: Path, coluna: str = 'Fundo') -> dict:
+    """Varre o CSV e grava `<csv>.idx.json`. Retorna o índice."""
+    csv_path = Path(csv_path)
+    tamanho, mtime = _assinatura(csv_path)
+    fins = limites_registros(csv_path)
+    inis = np.r_[0, fins[:-1]]
+
+    # registros vazios (linhas em branco) são pulados pelo read_csv
+    vazio = _vazios(csv_path, inis, fins)
+    inis, fins = inis[~vazio], fins[~vazio]
+
+    fundos = pd.read_csv(csv_path, usecols=[coluna], dtype=str, keep_default_na=False)[coluna]
+    if len(fundos) != len(inis) - 1:
+        raise ValueError(f"{csv_path}: {len(inis) - 1} registros no scan × {len(fundos)} no read_csv; "
+                         "índice não construído.")
+
+    cod, nomes = pd.factorize(fundos.to_numpy(), sort=False)
+    ini_r, fim_r = inis[1:], fins[1:]
+    # faixas de linhas contíguas do mesmo fundo
+    quebra = np.flatnonzero(np.diff(cod) != 0) + 1
+    ini_run = np.r_[0, quebra]
+    fim_run = np.r_[quebra, len(cod)] - 1
+    faixas = {}
+    for a, b in zip(ini_run, fim_run):
+        faixas.setdefault(nomes[cod[a]], []).append([int(ini_r[a]), int(fim_r[b])])
+
+    indice = {
+        'tamanho': tamanho,
+        'mtime_ns': mtime,
+        'coluna': coluna,
+        'cabecalho': [int(inis[0]), int(fins[0])],
+        'fundos': faixas,
+    }
+    master_store.escrever_atomico(
+        caminho_indice(csv_path),
+        lambda tmp: Path(tmp).write_text(json.dumps(indice, ensure_ascii=False), encoding='utf-8'),
+    )
+    return indice
+
+
+def _vazios(csv_path: Path, inis, fins) -> np.ndarray:
+    """Registros vazios ('\\n', '\\r\\n' ou fim de arquivo): só esses são relidos."""
+    curtos = np.flatnonzero(fins - inis <= 2)
+    vazio = np.zeros(len(inis), dtype=bool)
+    with open(csv_path, 'rb') as f:
+        for i in curtos:
+            f.seek(inis[i])
+            vazio[i] = not f.read(fins[i] - inis[i]).strip()
+    return vazio
+
+
+def carregar_indice(csv_path: Path, construir: bool = True) -> dict | None:
+    """Índice válido do CSV (reconstruído se faltar ou estiver velho)."""
+    csv_path = Path(csv_path)
+    arq = caminho_indice(csv_path)
+    if arq.exists():
+        indice = json.loads(arq.read_text(encoding='utf-8'))
+        if (indice.get('tamanho'), indice.get('mtime_ns')) == _assinatura(csv_path):
+            return indice
+    return construir_indice(csv_path) if construir else None
+
+
+# ------------------------------------------------------------------
+# Leitura
+# ------------------------------------------------------------------
+def ler_fundos(csv_path: Path, fundos, **read_csv_kwargs) -> pd.DataFrame:
+    """
+    Só as linhas dos `fundos` (na ordem do arquivo), lendo apenas as faixas de
+    bytes do índice. Mesmo resultado de read_csv + filtro por Fundo.
+    """
+    csv_path = Path(csv_path)
+    indice = carregar_indice(csv_path)
+    faixas = sorted(fx for f in dict.fromkeys(fundos) for fx in indice['fundos'].get(f, []))
+    partes = []
+    with open(csv_path, 'rb') as f:
+        a, b = indice['cabecalho']
+        f.seek(a)
+        partes.append(f.read(b - a))
+        for a, b in faixas:
+            f.seek(a)
+            partes.append(f.read(b - a))
+    for i, p in enumerate(partes):
+        if not p.endswith(b'\n'):
+            partes[i] = p + b'\n'
+    return pd.read_csv(io.BytesIO(b''.join(partes)), **read_csv_kwargs)
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Índice de bytes por fundo para CSVs MASTER.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    c = sub.add_parser("construir", help="(Re)constrói <csv>.idx.json.")
+    c.add_argument("csv")
+
+    l = sub.add_parser("ler", help="Mostra as linhas de alguns fundos via índice.")
+    l.add_argument("csv")
+    l.add_argument("fundos", nargs="+")
+
+    args = ap.parse_args()
+    if args.cmd == "construir":
+        ind = construir_indice(Path(args.csv))
+        print(f"{caminho_indice(Path(args.csv))}: {len(ind['fundos'])} fundos indexados")
+    else:
+        print(ler_fundos(Path(args.csv), args.fundos, dtype=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,121 +2,275 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import hashlib
+import json
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from rapidfuzz import process, fuzz
+import openpyxl
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
 
+import master_store
+import metricas
 
-# Parse CLI
 
-ap = argparse.ArgumentParser(description="Ingestão de um único fundo e geração de CSV staging p/ MASTER.")
-ap.add_argument("arquivo", help="Arquivo Excel de entrada (caminho).")
-ap.add_argument("nome_fundo", help="Ticker do fundo (ex.: KNIP11).")
-ap.add_argument("sheet", help="Nome exato da aba no Excel.")
-ap.add_argument("header", type=int, help="Número da linha de cabeçalho (0-index).")
-ap.add_argument("--outdir", default=".", help="Diretório de saída para raw/staging.")
-args = ap.parse_args()
+# Candidatos de nome de coluna
 
-ARQ_XLS = Path(args.arquivo)
-FUNDO = args.nome_fundo
-SHEET = args.sheet
-HDR = args.header
-OUTDIR = Path(args.outdir)
-OUTDIR.mkdir(parents=True, exist_ok=True)
-
-
-# Ler Excel
-
-df = pd.read_excel(ARQ_XLS, sheet_name=SHEET, header=HDR)
-df = df.dropna(axis=1, how='all')
+possiveis_colunas_perc = [
+    '% DA CARTEIRA', '% DO PL', '%DO PL', '%PL',
+    '% DO PATRIMÔNIO', '% DO PATRIMONIO',
+    '%/PL', 'PCT PL', 'PCT/PL', '% do patrimonio'
+]
+possiveis_ativo = ['ATIVO', 'TIPO ATIVO', 'TIPO', 'TIPO LASTRO', 'CLASSE', 'ESPECIE']
+possiveis_cod = [
+    'CÓDIGO DO ATIVO', 'CODIGO DO ATIVO', 'CÓDIGO', 'CODIGO',
+    'CÓDIGO CRI', 'CÓDIGO CRI/CRA', 'CÓDIGO DO CRI'
+]
+possiveis_garantia = ['GARANTIAS', 'GARANTIA', 'DESCRIÇÃO GARANTIA', 'DESCRICAO GARANTIA']
 
 
 # Função de fuzzy‑match de colunas
 
-def fuzzy_match_column(df, candidatos, threshold=80):
+def fuzzy_match_column(colunas, candidatos, threshold=80):
+    """`colunas`: DataFrame ou lista de nomes de coluna."""
+    colunas = list(getattr(colunas, 'columns', colunas))
+    if not colunas:
+        return None
     for candidato in candidatos:
         match, score, _ = process.extractOne(
-            candidato, df.columns, scorer=fuzz.token_sort_ratio
+            candidato, colunas, scorer=fuzz.token_sort_ratio
         )
         if score >= threshold:
             return match
     return None
 
 
-# Detectar coluna de percentual
+def _por_substring(colunas, *partes):
+    for c in colunas:
+        if isinstance(c, str) and all(p in c.upper() for p in partes):
+            return c
+    return None
 
-possiveis_colunas_perc = [
-    '% DA CARTEIRA', '% DO PL', '%DO PL', '%PL',
-    '% DO PATRIMÔNIO', '% DO PATRIMONIO',
-    '%/PL', 'PCT PL', 'PCT/PL', '% do patrimonio'
-]
-col_perc = fuzzy_match_column(df, possiveis_colunas_perc)
-if col_perc is None:
-    # fallback simples por substring
-    cands = [c for c in df.columns if '%' in c and 'PL' in c.upper()]
-    if cands:
-        col_perc = cands[0]
-if not col_perc:
-    print("Colunas encontradas:", list(df.columns))
-    raise ValueError("Nenhuma coluna de percentual encontrada no arquivo!")
-df = df.rename(columns={col_perc: '% DA CARTEIRA'})
 
+def resolver_colunas(colunas) -> dict:
+    """
+    Nomes do cabeçalho → {'ATIVO', 'CÓDIGO DO ATIVO', '% DA CARTEIRA', 'GARANTIAS'}
+    com o nome original de cada coluna (None se não achou). ATIVO é opcional.
+    """
+    restantes = list(colunas)
+
+    def achar(candidatos, *substr):
+        col = fuzzy_match_column(restantes, candidatos)
+        if col is None and substr:
+            # fallback simples por substring
+            col = _por_substring(restantes, *substr)
+        if col is not None:
+            restantes.remove(col)
+        return col
+
+    col_perc     = achar(possiveis_colunas_perc, '%', 'PL')
+    col_ativo    = achar(possiveis_ativo)
+    col_cod      = achar(possiveis_cod, 'CÓDIGO')
+    col_garantia = achar(possiveis_garantia, 'GARANTIA')
+    return {
+        'ATIVO': col_ativo,
+        'CÓDIGO DO ATIVO': col_cod,
+        '% DA CARTEIRA': col_perc,
+        'GARANTIAS': col_garantia,
+    }
+
+
+def _validar_mapa(mapa: dict, colunas):
+    erros = {
+        '% DA CARTEIRA': "Nenhuma coluna de percentual encontrada no arquivo!",
+        'CÓDIGO DO ATIVO': "Nenhuma coluna de código do ativo encontrada!",
+        'GARANTIAS': "Nenhuma coluna de garantia encontrada!",
+    }
+    for alvo, msg in erros.items():
+        if not mapa[alvo]:
+            print("Colunas encontradas:", list(colunas))
+            raise ValueError(msg)
+
+
+# Registro de layouts de cabeçalho
+# assinatura do cabeçalho → mapa já resolvido; o rapidfuzz só roda para
+# layouts nunca vistos, e o resultado volta para o registro.
+
+REGISTRO_LAYOUTS = Path("data/layouts_cabecalho.json")
+
+# muda se as listas possiveis_* mudarem → layouts antigos deixam de casar
+_VERSAO_CANDIDATOS = hashlib.sha1(json.dumps(
+    [possiveis_colunas_perc, possiveis_ativo, possiveis_cod, possiveis_garantia],
+    ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+
+
+def assinatura_header(nomes) -> str:
+    bruto = json.dumps([_VERSAO_CANDIDATOS, [str(c) for c in nomes]], ensure_ascii=False)
+    return hashlib.sha1(bruto.encode('utf-8')).hexdigest()[:20]
+
+
+def carregar_registro(path: Path | None) -> dict | None:
+    """{'arquivo', 'layouts'}; None desliga o registro. Arquivo ausente/corrompido = registro vazio."""
+    if path is None:
+        return None
+    path = Path(path)
+    try:
+        layouts = json.loads(path.read_text(encoding='utf-8')).get('layouts', {})
+    except (OSError, ValueError):
+        layouts = {}
+    return {'arquivo': path, 'layouts': layouts}
 
-# Detectar colunas principais: ATIVO, CÓDIGO DO ATIVO, GARANTIAS
 
-possiveis_ativo = ['ATIVO', 'TIPO ATIVO', 'TIPO', 'TIPO LASTRO', 'CLASSE', 'ESPECIE']
-possiveis_cod = [
-    'CÓDIGO DO ATIVO', 'CODIGO DO ATIVO', 'CÓDIGO', 'CODIGO',
-    'CÓDIGO CRI', 'CÓDIGO CRI/CRA', 'CÓDIGO DO CRI'
-]
-possiveis_garantia = ['GARANTIAS', 'GARANTIA', 'DESCRIÇÃO GARANTIA', 'DESCRICAO GARANTIA']
+def _registrar_layout(registro: dict | None, nomes, mapa: dict):
+    if registro is None:
+        return
+    assinatura = assinatura_header(nomes)
+    if assinatura in registro['layouts']:
+        return
+    registro['layouts'][assinatura] = {'colunas': list(nomes), 'mapa': mapa}
+    # relê antes de gravar: outro processo (ingest_lote) pode ter registrado layouts
+    layouts = carregar_registro(registro['arquivo'])['layouts']
+    layouts.update(registro['layouts'])
+    texto = json.dumps({'versao': 1, 'layouts': layouts}, ensure_ascii=False, indent=1)
+    master_store.escrever_atomico(registro['arquivo'], lambda tmp: tmp.write_text(texto, encoding='utf-8'))
+    print(f"Layout de cabeçalho novo registrado em {registro['arquivo']} ({assinatura}).")
+
+
+def mapear_header(nomes, registro: dict | None = None) -> dict:
+    """resolver_colunas com atalho pelo registro (lookup exato pela assinatura)."""
+    if registro is not None:
+        entrada = registro['layouts'].get(assinatura_header(nomes))
+        if entrada is not None:
+            return dict(entrada['mapa'])
+    return resolver_colunas(nomes)
+
+
+# Detecção do cabeçalho
+
+MAX_BUSCA_HEADER = 50
+
+def _nomes_colunas(linha) -> list:
+    """Nomes de coluna como o pandas daria à linha (Unnamed: i, duplicadas .1)."""
+    return list(TextParser([list(linha)], header=0).read().columns)
+
 
-col_ativo = fuzzy_match_column(df, possiveis_ativo)
-if col_ativo is None:
-    # se não achou, assume tudo CRI
-    df['ATIVO'] = 'CRI'
-    col_ativo = 'ATIVO'
+def _nomes_validos(colunas) -> list:
+    return [c for c in colunas if not (isinstance(c, str) and c.startswith('Unnamed: '))]
 
-col_cod = fuzzy_match_column(df, possiveis_cod)
-if col_cod is None:
-    cands = [c for c in df.columns if 'CÓDIGO' in c.upper()]
-    if cands:
-        col_cod = cands[0]
-if not col_cod:
-    print("Colunas encontradas:", list(df.columns))
-    raise ValueError("Nenhuma coluna de código do ativo encontrada!")
 
-col_garantia = fuzzy_match_column(df, possiveis_garantia)
-if col_garantia is None:
-    cands = [c for c in df.columns if 'GARANTIA' in c.upper()]
-    if cands:
-        col_garantia = cands[0]
-if not col_garantia:
-    print("Colunas encontradas:", list(df.columns))
-    raise ValueError("Nenhuma coluna de garantia encontrada!")
+def _eh_header(linha, registro: dict | None = None) -> dict | None:
+    """Mapa de colunas se a linha parece o cabeçalho (percentual, código e garantia), senão None."""
+    # precisa de ao menos 3 textos (percentual, código e garantia): títulos nem passam pelo fuzzy
+    if sum(isinstance(v, str) and bool(v.strip()) for v in linha) < 3:
+        return None
+    mapa = mapear_header(_nomes_validos(_nomes_colunas(linha)), registro)
+    if mapa['% DA CARTEIRA'] and mapa['CÓDIGO DO ATIVO'] and mapa['GARANTIAS']:
+        return mapa
+    return None
+
 
-df = df.rename(columns={
-    col_ativo: 'ATIVO',
-    col_cod: 'CÓDIGO DO ATIVO',
-    col_garantia: 'GARANTIAS'
-})
+def detectar_header(linhas, max_busca: int = MAX_BUSCA_HEADER, registro: dict | None = None) -> int | None:
+    """Índice (0-index) da 1ª linha que casa com as listas possiveis_*; None se não achar."""
+    for i, linha in enumerate(linhas):
+        if i >= max_busca:
+            break
+        if _eh_header(linha, registro):
+            return i
+    return None
 
-needed = ['ATIVO', 'CÓDIGO DO ATIVO', '% DA CARTEIRA', 'GARANTIAS']
-df = df[needed]
 
+# Leitura estreita (xlsx/xlsm): varre a aba em modo read-only, acha o
+# cabeçalho, guarda só as 4 colunas necessárias e para no rodapé.
 
-# Remover rodapé: descarta tudo a partir da 1ª linha sem código
+def _converter_celula(cell):
+    """Mesma conversão do leitor openpyxl do pandas."""
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
 
-mask_sem_codigo = df['CÓDIGO DO ATIVO'].isna()
-if mask_sem_codigo.any():
-    cutoff = mask_sem_codigo.idxmax()
-    df = df.loc[:cutoff-1].copy()
 
+def _vazio(v) -> bool:
+    return v == "" or (isinstance(v, float) and np.isnan(v))
 
-# Filtrar apenas CRIs
 
-df = df[df['ATIVO'].astype(str).str.upper().str.contains('CRI', na=False)].copy()
+def _ler_estreito(arquivo, sheet: str, header: int | None, max_busca: int,
+                  registro: dict | None = None) -> pd.DataFrame:
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[sheet]
+        ws.reset_dimensions()
+        linhas = ws.rows
+
+        # 1) cabeçalho: informado ou detectado nas primeiras max_busca linhas
+        linha_header = None
+        mapa = None
+        for i, row in enumerate(linhas):
+            conv = [_converter_celula(c) for c in row]
+            if header is not None:
+                if i == header:
+                    linha_header = conv
+                    break
+            elif (mapa := _eh_header(conv, registro)):
+                header, linha_header = i, conv
+                print(f"Cabeçalho detectado na linha {header} (0-index).")
+                break
+            elif i + 1 >= max_busca:
+                break
+        if linha_header is None:
+            if header is None:
+                raise ValueError(f"Cabeçalho não encontrado nas primeiras {max_busca} linhas da aba {sheet!r}; "
+                                 "informe o header.")
+            raise ValueError(f"Aba {sheet!r} tem menos de {header + 1} linhas.")
+
+        colunas = _nomes_colunas(linha_header)
+        nomes = _nomes_validos(colunas)
+        if mapa is None:
+            mapa = mapear_header(nomes, registro)
+        _validar_mapa(mapa, colunas)
+        _registrar_layout(registro, nomes, mapa)
+        alvos = [a for a, c in mapa.items() if c is not None]
+        idx = [colunas.index(mapa[a]) for a in alvos]
+        i_cod = idx[alvos.index('CÓDIGO DO ATIVO')]
+
+        # 2) dados: só as colunas mapeadas, até a 1ª linha sem código (rodapé)
+        dados = []
+        for row in linhas:
+            cod = _converter_celula(row[i_cod]) if i_cod < len(row) else ""
+            if _vazio(cod):
+                break
+            dados.append([_converter_celula(row[j]) if j < len(row) else "" for j in idx])
+    finally:
+        wb.close()
+
+    return TextParser(dados, names=alvos, header=None).read()
+
+
+# Leitura completa (demais formatos: xls, ods...), como antes
+
+def _ler_completo(arquivo, sheet: str, header: int | None, max_busca: int,
+                  registro: dict | None = None) -> pd.DataFrame:
+    if header is None:
+        topo = pd.read_excel(arquivo, sheet_name=sheet, header=None, nrows=max_busca)
+        header = detectar_header(topo.fillna("").values.tolist(), max_busca, registro)
+        if header is None:
+            raise ValueError(f"Cabeçalho não encontrado nas primeiras {max_busca} linhas da aba {sheet!r}; "
+                             "informe o header.")
+        print(f"Cabeçalho detectado na linha {header} (0-index).")
+
+    df = pd.read_excel(arquivo, sheet_name=sheet, header=header)
+    df = df.dropna(axis=1, how='all')
+    mapa = mapear_header(list(df.columns), registro)
+    _validar_mapa(mapa, df.columns)
+    _registrar_layout(registro, list(df.columns), mapa)
+    alvos = [a for a, c in mapa.items() if c is not None]
+    return df.rename(columns={mapa[a]: a for a in alvos})[alvos]
 
 
 # Converter % DA CARTEIRA para float
@@ -134,42 +288,113 @@ def _to_float(x):
         return np.nan
     return v/100.0 if 1.0 < v <= 100.0 else v
 
-df['% DA CARTEIRA'] = df['% DA CARTEIRA'].apply(_to_float)
-
 
-# Normalizar pesos, adicionar nome do fundo e reordenar
-
-total = df['% DA CARTEIRA'].sum(skipna=True)
-df['Norm.'] = df['% DA CARTEIRA'] / total if total and not np.isnan(total) else np.nan
-df['NOME DO FUNDO'] = FUNDO
-df = df[['NOME DO FUNDO', 'ATIVO', 'CÓDIGO DO ATIVO', '% DA CARTEIRA', 'Norm.', 'GARANTIAS']]
-
-
-# Salvar
-
-arq_raw = OUTDIR / f"{FUNDO}_ingest_raw.xlsx"
-arq_csv = OUTDIR / f"{FUNDO}_staging.csv"
-try:
-    import xlsxwriter  # noqa
-    eng = "xlsxwriter"
-except ImportError:
-    eng = "openpyxl"
+# Ingestão de um fundo → DataFrame staging
+
+@metricas.medir()
+def ingerir_fundo(arquivo, fundo: str, sheet: str, header: int | None = None,
+                  max_busca: int = MAX_BUSCA_HEADER,
+                  layouts: Path | None = None) -> pd.DataFrame:
+    """
+    Lê a aba do relatório do fundo e devolve o staging:
+    ['NOME DO FUNDO', 'ATIVO', 'CÓDIGO DO ATIVO', '% DA CARTEIRA', 'Norm.', 'GARANTIAS'].
+    Sem `header`, o cabeçalho é procurado nas primeiras `max_busca` linhas.
+    `layouts`: JSON do registro de layouts de cabeçalho (None = sempre fuzzy).
+    """
+    registro = carregar_registro(layouts)
+    if Path(arquivo).suffix.lower() in ('.xlsx', '.xlsm'):
+        df = _ler_estreito(arquivo, sheet, header, max_busca, registro)
+    else:
+        df = _ler_completo(arquivo, sheet, header, max_busca, registro)
+
+    if 'ATIVO' not in df.columns:
+        # se não achou, assume tudo CRI
+        df['ATIVO'] = 'CRI'
+
+    needed = ['ATIVO', 'CÓDIGO DO ATIVO', '% DA CARTEIRA', 'GARANTIAS']
+    df = df[needed]
+
+    # Remover rodapé: descarta tudo a partir da 1ª linha sem código
+    mask_sem_codigo = df['CÓDIGO DO ATIVO'].isna()
+    if mask_sem_codigo.any():
+        cutoff = mask_sem_codigo.idxmax()
+        df = df.loc[:cutoff-1].copy()
+
+    # Filtrar apenas CRIs
+    df = df[df['ATIVO'].astype(str).str.upper().str.contains('CRI', na=False)].copy()
+
+    df['% DA CARTEIRA'] = df['% DA CARTEIRA'].apply(_to_float)
+
+    # Normalizar pesos, adicionar nome do fundo e reordenar
+    total = df['% DA CARTEIRA'].sum(skipna=True)
+    df['Norm.'] = df['% DA CARTEIRA'] / total if total and not np.isnan(total) else np.nan
+    df['NOME DO FUNDO'] = fundo
+    df = df[['NOME DO FUNDO', 'ATIVO', 'CÓDIGO DO ATIVO', '% DA CARTEIRA', 'Norm.', 'GARANTIAS']]
+    return df
+
+
+# Salvar raw (xlsx) + staging (csv)
+
+@metricas.medir()
+def salvar_staging(df: pd.DataFrame, fundo: str, outdir: Path) -> tuple[Path, Path]:
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    arq_raw = outdir / f"{fundo}_ingest_raw.xlsx"
+    arq_csv = outdir / f"{fundo}_staging.csv"
+    try:
+        import xlsxwriter  # noqa
+        eng = "xlsxwriter"
+    except ImportError:
+        eng = "openpyxl"
 
-with pd.ExcelWriter(arq_raw, engine=eng) as xlw:
-    df.to_excel(xlw, sheet_name="raw", index=False)
-df.to_csv(arq_csv, index=False)
+    with pd.ExcelWriter(arq_raw, engine=eng) as xlw:
+        df.to_excel(xlw, sheet_name="raw", index=False)
+    df.to_csv(arq_csv, index=False)
+    return arq_raw, arq_csv
 
 
 # Relatório curto
 
-print("\n=== INGESTÃO CONCLUÍDA ===")
-print(f"Arquivo origem: {ARQ_XLS}")
-print(f"Fundo:          {FUNDO}")
-print(f"Aba:            {SHEET}")
-print(f"Linhas válidas: {len(df)}")
-print(f"Soma % DA CARTEIRA: {df['% DA CARTEIRA'].sum():.6f}")
-print(f"Soma Norm.:         {df['Norm.'].sum():.6f}")
-print(f"Saída raw:          {arq_raw}")
-print(f"Saída staging:      {arq_csv}\n")
-print("Prévia (raw ordenado):")
-print(df.head(10).to_string(index=False))
+def relatorio(df, arquivo, fundo, sheet, arq_raw=None, arq_csv=None):
+    print("\n=== INGESTÃO CONCLUÍDA ===")
+    print(f"Arquivo origem: {arquivo}")
+    print(f"Fundo:          {fundo}")
+    print(f"Aba:            {sheet}")
+    print(f"Linhas válidas: {len(df)}")
+    print(f"Soma % DA CARTEIRA: {df['% DA CARTEIRA'].sum():.6f}")
+    print(f"Soma Norm.:         {df['Norm.'].sum():.6f}")
+    if arq_raw is not None:
+        print(f"Saída raw:          {arq_raw}")
+    if arq_csv is not None:
+        print(f"Saída staging:      {arq_csv}\n")
+    print("Prévia (raw ordenado):")
+    print(df.head(10).to_string(index=False))
+
+
+# CLI
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingestão de um único fundo e geração de CSV staging p/ MASTER.")
+    ap.add_argument("arquivo", help="Arquivo Excel de entrada (caminho).")
+    ap.add_argument("nome_fundo", help="Ticker do fundo (ex.: KNIP11).")
+    ap.add_argument("sheet", help="Nome exato da aba no Excel.")
+    ap.add_argument("header", type=int, nargs="?", default=None,
+                    help="Número da linha de cabeçalho (0-index). Omitido: detecta automaticamente.")
+    ap.add_argument("--max-busca", type=int, default=MAX_BUSCA_HEADER,
+                    help="Linhas varridas na detecção do cabeçalho.")
+    ap.add_argument("--layouts", default=str(REGISTRO_LAYOUTS),
+                    help="Registro JSON de layouts de cabeçalho. Use '' para desligar.")
+    ap.add_argument("--outdir", default=".", help="Diretório de saída para raw/staging.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    with metricas.execucao("ingest_fundo", args):
+        arquivo = Path(args.arquivo)
+        df = ingerir_fundo(arquivo, args.nome_fundo, args.sheet, args.header, args.max_busca,
+                           layouts=Path(args.layouts) if args.layouts else None)
+        arq_raw, arq_csv = salvar_staging(df, args.nome_fundo, Path(args.outdir))
+        relatorio(df, arquivo, args.nome_fundo, args.sheet, arq_raw, arq_csv)
+
+
+if __name__ == "__main__":
+    main()
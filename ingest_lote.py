@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ingest_lote.py
+--------------
+Ingestão de vários fundos de uma vez (mesma lógica do ingest_fundo.py),
+distribuída num pool de processos.
+
+Entrada:
+  * manifest CSV/JSON com colunas: arquivo, fundo, sheet, header
+    (caminhos relativos ao diretório de execução), ou
+  * um diretório: cada *.xlsx/*.xlsm vira um fundo com o nome do arquivo
+    (ex.: KNIP11.xlsx → KNIP11), usando --sheet/--header para todos.
+    Sem header (coluna vazia e sem --header), o cabeçalho é detectado.
+
+Saída:
+  * --outdir: raw/staging por fundo, como o ingest_fundo.py;
+  * --master: anexa todos os fundos bem-sucedidos ao MASTER numa única
+    gravação atômica (CSV via arquivo temporário + rename; store particionado
+    com uma só regravação do manifest).
+
+Falha em um arquivo não aborta o lote: o relatório final lista status e erro
+por arquivo (e vai para --relatorio, se informado).
+
+Uso:
+    python ingest_lote.py input_dados/lote.csv \
+      --outdir input_dados \
+      --master data/df_tidy_simp_MASTER.csv --replace-existing \
+      --relatorio input_dados/lote_relatorio.csv
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+
+import append_to_master
+import ingest_fundo
+import master_store
+import metricas
+
+EXTENSOES = ('.xlsx', '.xlsm')
+COLS_MANIFEST = ['arquivo', 'fundo', 'sheet', 'header']
+
+
+# --------------------------------------------------------------
+# Montagem do lote
+# --------------------------------------------------------------
+def ler_manifest(path: Path, sheet: str | None = None, header: int | None = None) -> list[dict]:
+    """Manifest CSV/JSON → lista de {arquivo, fundo, sheet, header}. sheet/header preenchem faltantes."""
+    path = Path(path)
+    if path.suffix.lower() == '.json':
+        with open(path, encoding='utf-8') as fh:
+            df = pd.DataFrame(json.load(fh))
+    else:
+        df = pd.read_csv(path, dtype=str)
+
+    faltando = [c for c in ('arquivo', 'fundo') if c not in df.columns]
+    if faltando:
+        raise ValueError(f"Manifest {path} sem colunas: {faltando}")
+    for col, padrao in (('sheet', sheet), ('header', header)):
+        if col not in df.columns:
+            df[col] = padrao
+        df[col] = df[col].where(df[col].notna(), padrao)
+
+    itens = []
+    for r in df[COLS_MANIFEST].to_dict('records'):
+        itens.append({
+            'arquivo': str(r['arquivo']),
+            'fundo':   str(r['fundo']).strip(),
+            'sheet':   r['sheet'],
+            'header':  None if r['header'] is None or pd.isna(r['header']) else int(r['header']),
+        })
+    return itens
+
+
+def itens_de_diretorio(pasta: Path, sheet: str | None, header: int | None) -> list[dict]:
+    """Cada planilha da pasta vira um item; o fundo é o nome do arquivo sem extensão."""
+    arquivos = sorted(p for p in Path(pasta).iterdir()
+                      if p.suffix.lower() in EXTENSOES and not p.name.startswith('~$'))
+    return [{'arquivo': str(p), 'fundo': p.stem, 'sheet': sheet, 'header': header}
+            for p in arquivos]
+
+
+# --------------------------------------------------------------
+# Worker (roda em processo separado)
+# --------------------------------------------------------------
+def _ingerir_item(item: dict, layouts: Path | None = None) -> dict:
+    """Ingestão de um item; nunca levanta exceção (o erro vai no resultado)."""
+    t0 = time.perf_counter()
+    res = dict(item, status='ok', linhas=0, erro='', df=None)
+    try:
+        if item['sheet'] is None:
+            raise ValueError("sheet não informada (manifest ou --sheet).")
+        df = ingest_fundo.ingerir_fundo(Path(item['arquivo']), item['fundo'], item['sheet'], item['header'],
+                                         layouts=layouts)
+        res['linhas'] = len(df)
+        res['df'] = df
+    except Exception as e:  # noqa: BLE001 - falha de um arquivo não derruba o lote
+        res['status'] = 'erro'
+        res['erro'] = f"{type(e).__name__}: {e}"
+    res['segundos'] = round(time.perf_counter() - t0, 3)
+    return res
+
+
+@metricas.medir()
+def ingerir_lote(itens: list[dict], workers: int | None = None,
+                 layouts: Path | None = None) -> list[dict]:
+    """Roda _ingerir_item para cada item, em paralelo se workers != 1. Mantém a ordem do lote."""
+    tarefa = partial(_ingerir_item, layouts=layouts)
+    if workers == 1 or len(itens) <= 1:
+        return [tarefa(it) for it in itens]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(tarefa, itens))
+
+
+# --------------------------------------------------------------
+# Gravação
+# --------------------------------------------------------------
+@metricas.medir()
+def salvar_stagings(resultados: list[dict], outdir: Path):
+    for r in resultados:
+        if r['status'] != 'ok':
+            continue
+        _, arq_csv = ingest_fundo.salvar_staging(r['df'], r['fundo'], outdir)
+        r['staging'] = str(arq_csv)
+
+
+@metricas.medir()
+def anexar_lote(resultados: list[dict], master: Path, replace_existing: bool = False) -> int:
+    """
+    Anexa os fundos ok ao MASTER numa única gravação. Fundos rejeitados pelo
+    append (ex.: já existentes sem --replace-existing) são marcados como erro.
+    Retorna o número de fundos anexados.
+    """
+    master = Path(master)
+    store = master_store.eh_store(master)
+    if store:
+        existentes = set(master_store.ler_manifest(master)['fundos'])
+        df_master = pd.DataFrame(columns=append_to_master.NEED)
+    else:
+        df_master = pd.read_csv(master) if master.exists() else None
+
+    novos = []
+    for r in resultados:
+        if r['status'] != 'ok':
+            continue
+        try:
+            df_new = append_to_master.padronizar_staging(r['df'])
+            if store and not replace_existing and r['fundo'] in existentes:
+                raise RuntimeError(f"Fundo {r['fundo']} já existe no MASTER; use --replace-existing.")
+            df_master = append_to_master.anexar(df_master, df_new, replace_existing=replace_existing)
+            novos.append(df_new)
+        except Exception as e:  # noqa: BLE001
+            r['status'] = 'erro'
+            r['erro'] = f"append: {type(e).__name__}: {e}"
+
+    if not novos:
+        return 0
+    if store:
+        master_store.upsert_fundos(master, pd.concat(novos, ignore_index=True), replace=True)
+    else:
+        master_store.escrever_atomico(master, lambda tmp: df_master.to_csv(tmp, index=False))
+    return len(novos)
+
+
+def relatorio_lote(resultados: list[dict]) -> pd.DataFrame:
+    cols = ['arquivo', 'fundo', 'sheet', 'header', 'status', 'linhas', 'segundos', 'erro']
+    return pd.DataFrame([{c: r.get(c) for c in cols} for r in resultados], columns=cols)
+
+
+# --------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Ingestão em lote de fundos (manifest ou diretório).")
+    ap.add_argument("entrada", help="Manifest CSV/JSON (arquivo, fundo, sheet, header) ou diretório de planilhas.")
+    ap.add_argument("--sheet", default=None, help="Aba padrão (diretório ou manifest sem 'sheet').")
+    ap.add_argument("--header", type=int, default=None, help="Linha de cabeçalho padrão (0-index). Omitido: detecta.")
+    ap.add_argument("--outdir", default=None, help="Diretório para raw/staging por fundo.")
+    ap.add_argument("--master", default=None, help="MASTER financeiro (CSV ou store) para anexar o lote.")
+    ap.add_argument("--replace-existing", action="store_true",
+                    help="Substitui fundos já existentes no MASTER.")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Processos em paralelo (padrão: nº de CPUs; 1 = sequencial).")
+    ap.add_argument("--layouts", default=str(ingest_fundo.REGISTRO_LAYOUTS),
+                    help="Registro JSON de layouts de cabeçalho. Use '' para desligar.")
+    ap.add_argument("--relatorio", default=None, help="CSV com status por arquivo.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    if not args.outdir and not args.master:
+        ap.error("informe --outdir e/ou --master.")
+
+    with metricas.execucao("ingest_lote", args):
+        entrada = Path(args.entrada)
+        if entrada.is_dir():
+            itens = itens_de_diretorio(entrada, args.sheet, args.header)
+        else:
+            itens = ler_manifest(entrada, args.sheet, args.header)
+        if not itens:
+            print(f"Nenhuma planilha encontrada em {entrada}.")
+            return
+
+        workers = args.workers or min(len(itens), os.cpu_count() or 1)
+        print(f"→ Ingerindo {len(itens)} arquivo(s) com {workers} processo(s)")
+        t0 = time.perf_counter()
+        resultados = ingerir_lote(itens, workers=workers,
+                                  layouts=Path(args.layouts) if args.layouts else None)
+
+        if args.outdir:
+            salvar_stagings(resultados, Path(args.outdir))
+        if args.master:
+            # trava exclusiva: lê e regrava o MASTER sem intercalar com uma transacao_master
+            with master_store.travar(Path(args.master).parent, exclusiva=True):
+                n = anexar_lote(resultados, Path(args.master), replace_existing=args.replace_existing)
+            print(f"→ MASTER {args.master}: {n} fundo(s) anexado(s) numa única gravação")
+
+        rel = relatorio_lote(resultados)
+        print("\n=== LOTE CONCLUÍDO ===")
+        print(rel.drop(columns=['erro']).to_string(index=False))
+        for _, r in rel[rel['status'] != 'ok'].iterrows():
+            print(f"  [erro] {r['arquivo']} ({r['fundo']}): {r['erro']}")
+        print(f"Ok: {(rel['status'] == 'ok').sum()}/{len(rel)} em {time.perf_counter() - t0:.1f}s")
+        if args.relatorio:
+            rel.to_csv(args.relatorio, index=False)
+            print(f"Relatório salvo em: {args.relatorio}")
+
+        if (rel['status'] != 'ok').any():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,79 +6,40 @@ import argparse
 import pandas as pd
 import numpy as np
 import re
-from unidecode import unidecode
 from pathlib import Path
 
-# --------------------------------------------------------------
-# CLI
-# --------------------------------------------------------------
-ap = argparse.ArgumentParser(description="Limpa e tokeniza Garantias a partir de MASTER financeiro.")
-ap.add_argument("--fin", default="data/df_tidy_simp_MASTER.csv",
-                help="CSV financeiro MASTER.")
-ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
-                help="Planilha de Classificação (p/ referência de tipos/subclasses).")
-ap.add_argument("--saida-csv", default="data/garantias_limpas_MASTER.csv",
-                help="CSV de tokens limpos.")
-ap.add_argument("--saida-xlsx", default="data/garantias_limpas_MASTER.xlsx",
-                help="Excel opcional com tokens limpos.")
-args = ap.parse_args()
-
-ARQ_FIN    = Path(args.fin)
-ARQ_CLASS  = Path(args.classif)
-ARQ_SAIDA  = Path(args.saida_csv)
-ARQ_SAIDAX = Path(args.saida_xlsx)
+from classificacao import carregar_regras
+import incremental
+import mapear_codigo
+import master_store
+import metricas
+import tokens_csr
+from texto import normalizar
 
 
 TOKEN_SPLIT_RE = re.compile(r'^(?P<cod>[A-Za-z]{1,4})\s+(?P<rest>.+)$')
 
 # separadores de garantia
-REGEX_SPLIT = r'\s*(?:\+|-|,|;|\bou\b|\be\b|\bem\b|\bde\b|\bda\b|\bdos\b|\bdo\b|\be/?ou\b|\(\w+\)|•)\s*'
-
-
-df_class = pd.read_excel(ARQ_CLASS, sheet_name='Classificação', header=1)
-df_original = pd.read_csv(ARQ_FIN)
+# (mesmo conjunto de sempre: + - , ; • (xx) ou e em de da dos do e/ou, com os
+#  símbolos numa classe e as palavras num grupo só → o regex não testa cada
+#  alternativa em toda posição. "e/ou" continua partindo em "e", como antes.)
+REGEX_SPLIT = r'\s*(?:[+\-,;•]|\b(?:ou|eou|em|e|de|da|dos|do)\b|\(\w+\))\s*'
 
-# usamos só as colunas mínimas
-df = df_original[['Fundo','Ativo','Garantia']].copy()
-
-# remove prefixos tipo "- GARANTIAS ..." etc
-df['Garantia'] = df['Garantia'].str.replace(r'^\s*(?:-+|•+|GARANTIAS)\s*', '', regex=True)
 
 # --------------------------------------------------------------
 # Limpeza célula a célula
 # --------------------------------------------------------------
+NUM_INI_RE = re.compile(r'^\d+\s*')
+NUM_FIM_RE = re.compile(r'\s*\d+$')
+
 def limpar_celula(x):
     if not isinstance(x, str):
         return x
     x = x.strip(" ;.•")
-    x = re.sub(r'^\d+\s*', '', x)
-    x = re.sub(r'\s*\d+$', '', x)
+    x = NUM_INI_RE.sub('', x)
+    x = NUM_FIM_RE.sub('', x)
     return x.strip()
 
-df_split = df['Garantia'].str.split(REGEX_SPLIT, expand=True)
-df_split = df_split.applymap(limpar_celula)
-df_split.columns = [f'Garantia_{i+1}' for i in range(df_split.shape[1])]
-df_split = pd.concat([df[['Fundo','Ativo']], df_split], axis=1)
-
-# --------------------------------------------------------------
-# Normalização básica & vocabulários oficiais
-# --------------------------------------------------------------
-def normalizar(s: str) -> str:
-    if not isinstance(s, str):
-        return s
-    s = unidecode(s).lower()
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
-
-tipos_garantia = set(df_class['Tipos de Garantia'].dropna().str.strip().unique())
-codigo = set(df_class['Código'].dropna().str.strip().unique())
-subclasses = set(df_class['Subclasse'].dropna().str.strip().unique())
-
-tipos_norm = {normalizar(t) for t in tipos_garantia}
-codigos = {c.upper() for c in codigo}
-subs_norm = {normalizar(s) for s in subclasses}
-prefix_tipo = {t.split(' ', 1)[0]: t for t in tipos_norm}
-
 # --------------------------------------------------------------
 # Alias mínimos (plurais / acentos / abreviações)
 # --------------------------------------------------------------
@@ -112,17 +73,25 @@ alias = {
 # --------------------------------------------------------------
 # keep_token()
 # --------------------------------------------------------------
-def keep_token(token):
-    """Converte token bruto em lista [tipo|subclasse|código] ou [] se descartar."""
+def keep_token(token, vocab):
+    """
+    Converte token bruto em lista [tipo|subclasse|código] ou [] se descartar.
+    `vocab` = carregar_regras(...)['limpeza'] (tipos_norm, codigos, subs_norm, prefix_tipo).
+    """
     if isinstance(token, list):
         out = []
         for item in token:
-            out.extend(keep_token(item))
+            out.extend(keep_token(item, vocab))
         return out
 
     if not isinstance(token, str) or token.strip() == "":
         return []
 
+    tipos_norm  = vocab['tipos_norm']
+    codigos     = vocab['codigos']
+    subs_norm   = vocab['subs_norm']
+    prefix_tipo = vocab['prefix_tipo']
+
     # limpeza básica
     t = normalizar(token)
     t = re.sub(r'[\d$\.]+', '', t)
@@ -178,32 +147,253 @@ def keep_token(token):
     return []
 
 # --------------------------------------------------------------
-# Aplicar linha a linha
+# Matcher: fragmento bruto → tokens, reaproveitado entre chamadas
 # --------------------------------------------------------------
-gar_cols = df_split.filter(like='Garantia_')
-tmp = gar_cols.apply(lambda r: pd.Series(sum((keep_token(x) for x in r.to_numpy()), [])), axis=1)
-tmp.columns = [f'G{i+1}' for i in range(tmp.shape[1])]
-
-df_clean = pd.concat([df_split[['Fundo','Ativo']], tmp], axis=1)
+PREFIXO_RE = re.compile(r'^\s*(?:-+|•+|GARANTIAS)\s*')
+SPLIT_RE   = re.compile(REGEX_SPLIT)
+
+# um único matcher: o do último vocabulário usado
+_MATCHER = {'atual': None}
+
+def matcher(vocab) -> dict:
+    """
+    Tabela fragmento bruto → tokens (limpar_celula + keep_token) para um
+    vocabulário. Guarda só a do último vocabulário: chamadas seguintes com as
+    mesmas regras (pipeline, serviço) já a encontram preenchida; regras
+    recarregadas a substituem (e a antiga pode ser coletada). Fragmento bruto
+    novo passa por limpar_celula e só vai a keep_token se a forma limpa
+    também for nova ('limpos').
+    """
+    m = _MATCHER['atual']
+    if m is None or m['vocab'] is not vocab:
+        m = _MATCHER['atual'] = {'vocab': vocab, 'fragmentos': {}, 'limpos': {}}
+    return m
+
+
+def _resolver_fragmento(frag: str, m: dict) -> tuple:
+    limpo = limpar_celula(frag)
+    kept = m['limpos'].get(limpo)
+    if kept is None:
+        kept = m['limpos'][limpo] = tuple(keep_token(limpo, m['vocab']))
+    m['fragmentos'][frag] = kept
+    return kept
+
+
+def tokenizar_texto(g: str, m: dict) -> tuple[list, int, int]:
+    """Uma Garantia → (tokens em ordem, nº de fragmentos, nº descartados)."""
+    tabela = m['fragmentos']
+    # remove prefixos tipo "- GARANTIAS ..." etc
+    frags = SPLIT_RE.split(PREFIXO_RE.sub('', g))
+    toks, descartados = [], 0
+    for frag in frags:
+        kept = tabela.get(frag)
+        if kept is None:
+            kept = _resolver_fragmento(frag, m)
+        toks.extend(kept)
+        descartados += not kept
+    return toks, len(frags), descartados
 
 # --------------------------------------------------------------
-# Métrica de ruído
+# Aplicar por string distinta
 # --------------------------------------------------------------
-ruido = (gar_cols.stack()
-                   .dropna()
-                   .apply(lambda x: keep_token(x) == []))
-print(f"Ruído remanescente: {ruido.mean():.2%}")
+def _tokenizar_distintas(df, vocab):
+    """(índice de cada linha nas Garantias distintas, listas de tokens por distinta, ruído)."""
+    m = matcher(vocab)
+
+    # índice de cada linha na lista de Garantias distintas (NaN → -1)
+    codigos, distintas = pd.factorize(df['Garantia'])
+
+    listas, n_frag, n_ruido = [], [], []
+    for g in distintas:
+        if not isinstance(g, str):
+            listas.append([]); n_frag.append(0); n_ruido.append(0)
+            continue
+        toks, nf, nr = tokenizar_texto(g, m)
+        listas.append(toks); n_frag.append(nf); n_ruido.append(nr)
+    listas.append([])   # posição -1: Garantia ausente
+
+    # ----------------------------------------------------------
+    # Métrica de ruído (mesma passada: fragmentos × ocorrências da Garantia)
+    # ----------------------------------------------------------
+    ocorr = np.bincount(codigos[codigos >= 0], minlength=len(distintas))
+    ruido = {
+        'fragmentos': int(ocorr @ np.asarray(n_frag, dtype=np.int64)),
+        'ruido':      int(ocorr @ np.asarray(n_ruido, dtype=np.int64)),
+    }
+    return codigos, listas, ruido
+
+
+@metricas.medir()
+def tokenizar(df, vocab):
+    """
+    Split + limpeza + keep_token → (df_clean [Fundo, Ativo, G1..Gn], ruído).
+    Cada Garantia distinta é tokenizada uma vez (tokenizar_texto) e o
+    resultado é espalhado de volta para as linhas.
+    ruído = {'fragmentos': n, 'ruido': fragmentos descartados por keep_token}.
+    """
+    if not len(df):
+        return pd.DataFrame(columns=['Fundo','Ativo']), {'fragmentos': 0, 'ruido': 0}
+
+    codigos, listas, ruido = _tokenizar_distintas(df, vocab)
+
+    tab = pd.DataFrame(listas)
+    tab = tab.where(tab.notna(), np.nan)
+    tmp = tab.iloc[codigos].set_axis(df.index, axis=0)
+    tmp.columns = [f'G{i+1}' for i in range(tmp.shape[1])]
+
+    df_clean = pd.concat([df[['Fundo','Ativo']], tmp], axis=1)
+    return df_clean, ruido
+
+
+@metricas.medir()
+def tokenizar_csr(df, vocab):
+    """Como tokenizar, mas devolve CSR (tokens_csr) sem montar o frame largo."""
+    if not len(df):
+        return tokens_csr.de_listas([], [], []), {'fragmentos': 0, 'ruido': 0}
+
+    codigos, listas, ruido = _tokenizar_distintas(df, vocab)
+
+    # CSR das distintas → CSR das linhas (gather dos trechos de cada linha)
+    vazio = [None] * len(listas)
+    dist = tokens_csr.de_listas(vazio, vazio, listas)
+    tam_d = np.diff(dist['offsets'])
+    tam = tam_d[codigos]
+    offsets = np.zeros(len(codigos) + 1, dtype=np.int64)
+    np.cumsum(tam, out=offsets[1:])
+    origem = np.repeat(dist['offsets'][:-1][codigos] - offsets[:-1], tam) + np.arange(offsets[-1])
+    csr = {
+        'fundo':   df['Fundo'].to_numpy(dtype=object),
+        'ativo':   df['Ativo'].to_numpy(dtype=object),
+        'offsets': offsets,
+        'ids':     dist['ids'][origem],
+        'vocab':   dist['vocab'],
+    }
+    return csr, ruido
+
+
+@metricas.medir()
+def limpar_garantias(df_fin: pd.DataFrame,
+                     regras: dict,
+                     saida_csv: Path | None = None,
+                     incremental_on: bool = False,
+                     csr: bool = False):
+    """
+    MASTER financeiro → tokens limpos [Fundo, Ativo, G1..Gn].
+    `regras` = carregar_regras(...). Com incremental_on, re-tokeniza só fundos
+    alterados e reaproveita o restante de `saida_csv` (ver incremental.py).
+    Com csr=True (e sem incremental) devolve os tokens em CSR (tokens_csr).
+    Retorna (df_clean | csr, fingerprints | None).
+    """
+    # usamos só as colunas mínimas
+    df = df_fin[['Fundo','Ativo','Garantia']].copy()
+
+    # Incremental: só fundos com fingerprint novo/alterado
+    fps = None
+    df_antigo = None
+    if incremental_on:
+        fps = incremental.fingerprints(
+            df, ['Fundo','Ativo','Garantia'],
+            extra=incremental.extra_etapa(regras['hash'], Path(__file__)),
+        )
+        estado = incremental.ler_estado(saida_csv)
+        if estado:
+            df_antigo = tokens_csr.ler_largo(saida_csv)
+        fundos_recalc = incremental.planejar(fps, estado, df, df_antigo)
+        print(incremental.resumo(fundos_recalc, fps))
+        df = df[incremental.linhas_de(df, fundos_recalc)]
+
+    if csr and not incremental_on:
+        df_clean, ruido = tokenizar_csr(df, regras['limpeza'])
+    else:
+        df_clean, ruido = tokenizar(df, regras['limpeza'])
+    if ruido['fragmentos']:
+        print(f"Ruído remanescente: {ruido['ruido'] / ruido['fragmentos']:.2%}"
+              + (" (fundos recalculados)" if incremental_on else ""))
+
+    if incremental_on:
+        df_clean = incremental.mesclar_por_linha(df_fin, df_antigo, df_clean, fundos_recalc)
+
+    return df_clean, fps
 
 # --------------------------------------------------------------
 # Salvar
 # --------------------------------------------------------------
-df_clean.to_csv(ARQ_SAIDA, index=False)
-try:
-    import xlsxwriter  # noqa
-    engine_name = "xlsxwriter"
-except ImportError:
-    engine_name = "openpyxl"
-with pd.ExcelWriter(ARQ_SAIDAX, engine=engine_name) as xlw:
-    df_clean.to_excel(xlw, sheet_name="limpas", index=False)
-
-print(f"Tokens limpos salvos em: {ARQ_SAIDA} (e {ARQ_SAIDAX})")
+@metricas.medir()
+def salvar_limpas(df_clean,
+                  saida_csv: Path,
+                  saida_xlsx: Path | None = None,
+                  fingerprints: dict | None = None):
+    incremental.invalidar_estado(saida_csv)
+    tokens_csr.gravar_tokens(saida_csv, df_clean)
+    incremental.gravar_estado(saida_csv, fingerprints)
+    if saida_xlsx is not None:
+        try:
+            import xlsxwriter  # noqa
+            engine_name = "xlsxwriter"
+        except ImportError:
+            engine_name = "openpyxl"
+        if isinstance(df_clean, dict):
+            df_clean = tokens_csr.para_largo(df_clean)
+        with pd.ExcelWriter(saida_xlsx, engine=engine_name) as xlw:
+            df_clean.to_excel(xlw, sheet_name="limpas", index=False)
+        print(f"Tokens limpos salvos em: {saida_csv} (e {saida_xlsx})")
+    else:
+        print(f"Tokens limpos salvos em: {saida_csv}")
+
+# --------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Limpa e tokeniza Garantias a partir de MASTER financeiro.")
+    ap.add_argument("--fin", default="data/df_tidy_simp_MASTER.csv",
+                    help="CSV financeiro MASTER (ou store particionado).")
+    ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
+                    help="Planilha de Classificação (p/ referência de tipos/subclasses).")
+    ap.add_argument("--saida-csv", default="data/garantias_limpas_MASTER.csv",
+                    help="Tokens limpos: CSV largo ou .npz (CSR, ver tokens_csr.py).")
+    ap.add_argument("--saida-xlsx", default="data/garantias_limpas_MASTER.xlsx",
+                    help="Excel opcional com tokens limpos. Use '' para pular.")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Re-tokeniza só os fundos cujas linhas (ou regras) mudaram desde a última rodada.")
+    ap.add_argument("--saida-cod", default=None,
+                    help="Também roda o mapear_codigo em memória e grava os tokens codificados aqui "
+                         "(dispensa reler o CSV limpo). Com --saida-csv '' o limpo nem é gravado.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    ARQ_FIN    = Path(args.fin)
+    ARQ_CLASS  = Path(args.classif)
+    ARQ_SAIDA  = Path(args.saida_csv) if args.saida_csv else None
+    ARQ_SAIDAX = Path(args.saida_xlsx) if args.saida_xlsx else None
+    ARQ_COD    = Path(args.saida_cod) if args.saida_cod else None
+
+    if ARQ_SAIDA is None and ARQ_COD is None:
+        ap.error("--saida-csv '' só faz sentido junto com --saida-cod.")
+    if ARQ_SAIDA is None and args.incremental:
+        ap.error("--incremental precisa de --saida-csv (o estado fica ao lado da saída).")
+
+    with metricas.execucao("limpeza", args):
+        regras = carregar_regras(ARQ_CLASS)
+        # trava exclusiva: lê o financeiro e grava limpas/cod sem intercalar
+        # com uma transacao_master
+        with master_store.travar(ARQ_FIN.parent, exclusiva=True):
+            df_original = master_store.ler_tabela(ARQ_FIN)
+
+            csr = any(p is not None and tokens_csr.eh_csr(p) for p in (ARQ_SAIDA, ARQ_COD))
+            df_clean, fps = limpar_garantias(df_original, regras, saida_csv=ARQ_SAIDA,
+                                             incremental_on=args.incremental, csr=csr)
+            if ARQ_SAIDA is not None:
+                salvar_limpas(df_clean, ARQ_SAIDA, ARQ_SAIDAX, fingerprints=fps)
+
+            # Fusão com mapear_codigo: traduz em memória e grava direto a saída codificada
+            if ARQ_COD is not None:
+                df_cod, fps_cod = mapear_codigo.mapear_codigos(df_clean, regras, saida_csv=ARQ_COD,
+                                                               incremental_on=args.incremental)
+                incremental.invalidar_estado(ARQ_COD)
+                tokens_csr.gravar_tokens(ARQ_COD, df_cod)
+                incremental.gravar_estado(ARQ_COD, fps_cod)
+                print(f"Tokens codificados salvos em: {ARQ_COD}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,52 +3,20 @@
 
 
 import argparse
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from unidecode import unidecode
-import re
 
-# --------------------------------------------------------------
-# CLI
-# --------------------------------------------------------------
-ap = argparse.ArgumentParser(description="Mapeia tokens limpos → códigos oficiais (MASTER).")
-ap.add_argument("--limpas",  default="data/garantias_limpas_MASTER.csv",
-                help="CSV limpo (fase 1).")
-ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
-                help="Planilha Classificação.")
-ap.add_argument("--saida-csv", default="data/garantias_cod_MASTER.csv",
-                help="CSV de saída.")
-args = ap.parse_args()
-
-ARQ_LIMPAS = Path(args.limpas)
-ARQ_CLASS  = Path(args.classif)
-ARQ_SAIDA  = Path(args.saida_csv)
+from classificacao import carregar_regras
+import incremental
+import master_store
+import metricas
+import tokens_csr
+from texto import normalizar
 
 # --------------------------------------------------------------
-# Normalizar
+# Classificação → ALIAS2CODE
 # --------------------------------------------------------------
-def normalizar(s: str) -> str:
-    if not isinstance(s, str):
-        return s
-    s = unidecode(s).lower()
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
-
-# --------------------------------------------------------------
-# Ler Classificação → ALIAS2CODE
-# --------------------------------------------------------------
-print("→ Gerando dicionários a partir de", ARQ_CLASS)
-df_class = pd.read_excel(ARQ_CLASS, sheet_name='Classificação', header=1, dtype=str)
-
-CODIGOS_OFICIAIS     = set(df_class['Código'].dropna().str.upper())
-SUBCLASSES_OFICIAIS  = {normalizar(s) for s in df_class['Subclasse'].dropna()}
-
-ALIAS2CODE = {}
-for _, row in df_class[['Tipos de Garantia', 'Código']].dropna().iterrows():
-    alias = normalizar(row['Tipos de Garantia'])
-    code  = str(row['Código']).upper().strip()
-    ALIAS2CODE.setdefault(alias, code)
-
 # Ajustes manuais úteis
 ADICIONAIS = {
     'fr':  'FR',
@@ -57,31 +25,131 @@ ADICIONAIS = {
     'spe': 'AF',  # cuidado! Se no limpas veio "spe" isolado como token de subclasse, NÃO traduzir a código.
                   # Por isso, NÃO adicionar 'spe' aqui a menos que saiba que é tipo → para já mapeado está falso.
 }
-# Observação: mantemos ADICIONAIS restrito. *Não* mapeamos SPE para AF.
-ALIAS2CODE.update({k:v for k,v in ADICIONAIS.items() if k != 'spe'})
 
-print(f"Encontrados {len(ALIAS2CODE)} aliases → código e {len(SUBCLASSES_OFICIAIS)} subclasses oficiais.")
+
+def montar_alias2code(regras_mapear: dict) -> dict:
+    """ALIAS2CODE da Classificação + ADICIONAIS (exceto 'spe')."""
+    ALIAS2CODE = dict(regras_mapear['ALIAS2CODE'])
+    # Observação: mantemos ADICIONAIS restrito. *Não* mapeamos SPE para AF.
+    ALIAS2CODE.update({k:v for k,v in ADICIONAIS.items() if k != 'spe'})
+    return ALIAS2CODE
 
 # --------------------------------------------------------------
-# Ler tokens limpos
+# Traduzir tokens limpos
 # --------------------------------------------------------------
-print("→ Lendo", ARQ_LIMPAS)
-df = pd.read_csv(ARQ_LIMPAS, dtype=str)
-
-token_cols = [c for c in df.columns if c.startswith('G')]
-
-def traduz_token(tok):
+def traduz_token(tok, ALIAS2CODE):
     if pd.isna(tok) or not isinstance(tok, str):
         return tok
     key = normalizar(tok)
     return ALIAS2CODE.get(key, tok)
 
-for col in token_cols:
-    df[col] = df[col].apply(traduz_token)
+
+def traduzir_tokens(df: pd.DataFrame, token_cols, ALIAS2CODE) -> pd.DataFrame:
+    """
+    traduz_token uma vez por valor distinto em todas as colunas G; o resultado
+    volta para as células por índice (factorize), sem apply célula a célula.
+    """
+    if not token_cols or not len(df):
+        return df
+    vals = df[token_cols].to_numpy(dtype=object)
+    cod, distintos = pd.factorize(vals.ravel())          # NaN → -1
+    trad = np.empty(len(distintos) + 1, dtype=object)
+    trad[:-1] = [traduz_token(t, ALIAS2CODE) for t in distintos]
+    trad[-1] = np.nan
+    df[token_cols] = pd.DataFrame(trad[cod].reshape(vals.shape), index=df.index, columns=token_cols)
+    return df
+
+
+@metricas.medir()
+def mapear_codigos(df_limpas,
+                   regras: dict,
+                   saida_csv: Path | None = None,
+                   incremental_on: bool = False):
+    """
+    Tokens limpos → tokens com aliases de tipo traduzidos para código.
+    `regras` = carregar_regras(...). Com incremental_on, traduz só os fundos
+    alterados e reaproveita o restante de `saida_csv`.
+    `df_limpas` pode ser frame largo ou CSR (tokens_csr): no CSR só o
+    vocabulário é traduzido.
+    Retorna (df_cod | csr, fingerprints | None).
+    """
+    ALIAS2CODE = montar_alias2code(regras['mapear'])
+    if isinstance(df_limpas, dict):
+        if not incremental_on:
+            return tokens_csr.traduzir_vocab(df_limpas, lambda t: traduz_token(t, ALIAS2CODE)), None
+        df_limpas = tokens_csr.para_largo(df_limpas)
+    token_cols = [c for c in df_limpas.columns if c.startswith('G')]
+
+    # Incremental: só fundos com fingerprint novo/alterado
+    fps = None
+    df_antigo = None
+    df = df_limpas.copy()
+    if incremental_on:
+        fps = incremental.fingerprints(
+            df_limpas, ['Fundo','Ativo'], gcols=token_cols,
+            extra=incremental.extra_etapa(regras['hash'], Path(__file__)),
+        )
+        estado = incremental.ler_estado(saida_csv)
+        if estado:
+            df_antigo = tokens_csr.ler_largo(saida_csv)
+        fundos_recalc = incremental.planejar(fps, estado, df_limpas, df_antigo)
+        print(incremental.resumo(fundos_recalc, fps))
+        df = df_limpas[incremental.linhas_de(df_limpas, fundos_recalc)].copy()
+
+    df = traduzir_tokens(df, token_cols, ALIAS2CODE)
+
+    if incremental_on:
+        df = incremental.mesclar_por_linha(df_limpas, df_antigo, df, fundos_recalc)
+
+    return df, fps
 
 # --------------------------------------------------------------
-# Salvar
+# CLI
 # --------------------------------------------------------------
-print("→ Salvando resultado em", ARQ_SAIDA)
-df.to_csv(ARQ_SAIDA, index=False)
-print(df.head(25))
+def main():
+    ap = argparse.ArgumentParser(description="Mapeia tokens limpos → códigos oficiais (MASTER).")
+    ap.add_argument("--limpas",  default="data/garantias_limpas_MASTER.csv",
+                    help="Tokens limpos (fase 1): CSV largo ou .npz (CSR).")
+    ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
+                    help="Planilha Classificação.")
+    ap.add_argument("--saida-csv", default="data/garantias_cod_MASTER.csv",
+                    help="Saída: CSV largo ou .npz (CSR).")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Traduz só os fundos cujos tokens (ou regras) mudaram desde a última rodada.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    ARQ_LIMPAS = Path(args.limpas)
+    ARQ_CLASS  = Path(args.classif)
+    ARQ_SAIDA  = Path(args.saida_csv)
+
+    with metricas.execucao("mapear_codigo", args):
+        print("→ Gerando dicionários a partir de", ARQ_CLASS)
+        regras = carregar_regras(ARQ_CLASS)
+        ALIAS2CODE = montar_alias2code(regras['mapear'])
+        print(f"Encontrados {len(ALIAS2CODE)} aliases → código e "
+              f"{len(regras['mapear']['SUBCLASSES_OFICIAIS'])} subclasses oficiais.")
+
+        # trava exclusiva: lê as limpas e grava o cod sem intercalar com uma
+        # transacao_master
+        with master_store.travar(ARQ_LIMPAS.parent, exclusiva=True):
+            print("→ Lendo", ARQ_LIMPAS)
+            if tokens_csr.eh_csr(ARQ_LIMPAS) and not args.incremental:
+                df_limpas = tokens_csr.ler(ARQ_LIMPAS)
+            else:
+                df_limpas = tokens_csr.ler_largo(ARQ_LIMPAS)
+
+            df, fps = mapear_codigos(df_limpas, regras, saida_csv=ARQ_SAIDA,
+                                     incremental_on=args.incremental)
+
+            print("→ Salvando resultado em", ARQ_SAIDA)
+            incremental.invalidar_estado(ARQ_SAIDA)
+            tokens_csr.gravar_tokens(ARQ_SAIDA, df)
+            incremental.gravar_estado(ARQ_SAIDA, fps)
+        if isinstance(df, dict):
+            df = tokens_csr.para_largo(tokens_csr.filtrar(df, np.arange(tokens_csr.n_linhas(df)) < 25))
+        print(df.head(25))
+
+
+if __name__ == "__main__":
+    main()
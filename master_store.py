@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+master_store.py
+---------------
+MASTER particionado por Fundo: uma pasta com um arquivo por fundo
+(Parquet; pickle se não houver pyarrow/fastparquet) + manifest.json.
+
+    data/df_tidy_simp_MASTER/
+        manifest.json
+        MXRF11-3fa9c0d1e2b4.parquet      # <fundo>-<hash do conteúdo>
+        KNIP11-07be5a41c9d3.parquet
+        ...
+
+Upsert/remoção de um fundo reescreve só a partição dele e o manifest. A
+partição nova ganha nome novo e a antiga só é apagada depois da troca do
+manifest: um leitor vê o store antes ou depois, nunca no meio.
+Colunas numéricas (%PL, Norm.) são gravadas já como float.
+
+Pasta com manifest.json (ou pasta existente) é tratada como store; caminhos
+.csv continuam funcionando como antes (ler_tabela / remover_de). Caminho sem
+extensão que não existe dá FileNotFoundError (stores novos: `importar`).
+
+Uso:
+    python master_store.py importar data/df_tidy_simp_MASTER.csv data/df_tidy_simp_MASTER
+    python master_store.py exportar data/df_tidy_simp_MASTER data/df_tidy_simp_MASTER.csv
+    python master_store.py listar   data/df_tidy_simp_MASTER
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import pandas as pd
+
+import indice_csv
+import metricas
+
+MANIFEST = "manifest.json"
+STORE_VERSAO = 1
+ARQ_TRAVA = ".masters.lock"
+ARQ_JORNAL = ".masters.journal.json"
+
+# Colunas gravadas como float nas partições
+COLUNAS_FLOAT = ['%PL', 'Norm.']
+
+
+# ------------------------------------------------------------------
+# Utils
+# ------------------------------------------------------------------
+def _pick_formato():
+    """Parquet se houver engine disponível; senão pickle."""
+    for mod in ("pyarrow", "fastparquet"):
+        try:
+            __import__(mod)
+            return "parquet"
+        except ImportError:
+            continue
+    return "pickle"
+
+
+def eh_store(path: Path) -> bool:
+    """
+    True se `path` é um store particionado (tem manifest.json ou é uma pasta
+    existente). Caminho sem extensão que não existe é erro: provável typo, e
+    gravar nele criaria um store vazio. Stores novos: `importar`.
+    """
+    path = Path(path)
+    if (path / MANIFEST).exists() or path.is_dir():
+        return True
+    if path.suffix == '':
+        raise FileNotFoundError(
+            f"{path}: não existe (nem store com {MANIFEST}, nem arquivo com extensão). "
+            f"Para criar um store: python master_store.py importar <csv> {path}"
+        )
+    return False
+
+
+def hash_df(df: pd.DataFrame) -> str:
+    """Hash estável do conteúdo (colunas + valores, sem índice)."""
+    h = hashlib.sha256()
+    h.update("|".join(map(str, df.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _nome_particao(fundo: str, formato: str, h: str) -> str:
+    """`<fundo>-<hash>`: uma partição nova nunca cai por cima de uma em uso."""
+    base = re.sub(r'[^\w.-]', '_', str(fundo))
+    base = f"{base}-{h[:12]}"
+    return f"{base}.parquet" if formato == "parquet" else f"{base}.pkl"
+
+
+def preparar_atomico(path: Path, escrever) -> Path:
+    """
+    Escreve num temporário na mesma pasta de `path` (mesma extensão no fim,
+    p/ quem escolhe o formato pela extensão) e o retorna, sem renomear.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp" + path.suffix)
+    os.close(fd)
+    try:
+        escrever(Path(tmp))
+        # mkstemp cria com 0600; devolve as permissões normais (umask) do arquivo final
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return Path(tmp)
+
+
+def escrever_atomico(path: Path, escrever):
+    """Escreve em arquivo temporário na mesma pasta e renomeia por cima."""
+    tmp = preparar_atomico(path, escrever)
+    try:
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def travar(pasta: Path, exclusiva: bool = True, timeout: float | None = None):
+    """
+    Trava `<pasta>/.masters.lock` (fcntl no Linux/macOS, msvcrt no Windows).
+    Exclusiva p/ quem grava os MASTER, compartilhada p/ quem só lê; no Windows
+    é sempre exclusiva. Leitor sem permissão de criar o lock segue sem trava.
+    Se houver jornal de uma transação interrompida, ela é concluída antes de
+    liberar a trava a quem pediu (ver efetivar / recuperar).
+    """
+    arq = Path(pasta) / ARQ_TRAVA
+    try:
+        arq.parent.mkdir(parents=True, exist_ok=True)
+        fh = open(arq, 'a+b')
+    except OSError:
+        if exclusiva:
+            raise
+        yield
+        return
+    t0 = time.monotonic()
+    try:
+        _esperar(fh, exclusiva, timeout, t0, arq)
+        if (arq.parent / ARQ_JORNAL).exists():
+            if not exclusiva:   # concluir exige a trava exclusiva
+                _destrancar(fh)
+                _esperar(fh, True, timeout, t0, arq)
+            recuperar(arq.parent)
+            if not exclusiva:
+                _destrancar(fh)
+                _esperar(fh, False, timeout, t0, arq)
+        yield
+    finally:
+        try:
+            _destrancar(fh)
+        finally:
+            fh.close()
+
+
+def _esperar(fh, exclusiva: bool, timeout, t0: float, arq: Path):
+    while True:
+        try:
+            _trancar(fh, exclusiva)
+            return
+        except OSError:
+            if timeout is not None and time.monotonic() - t0 >= timeout:
+                raise TimeoutError(f"MASTER travado por outro processo há {timeout:.0f}s ({arq}).")
+            time.sleep(0.2)
+
+
+def _trancar(fh, exclusiva: bool):
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), (fcntl.LOCK_EX if exclusiva else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _destrancar(fh):
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def resolver_master(base: str) -> Path:
+    """
+    Caminho com extensão: ele mesmo. Sem extensão: o store particionado, se
+    existir; senão o CSV de mesmo nome.
+    """
+    alvo = Path(base)
+    if alvo.suffix or (alvo / MANIFEST).exists():
+        return alvo
+    return Path(str(base) + ".csv")
+
+
+def tipar(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte as colunas numéricas conhecidas para float."""
+    df = df.copy()
+    for col in COLUNAS_FLOAT:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+    return df
+
+
+# ------------------------------------------------------------------
+# Manifest
+# ------------------------------------------------------------------
+def ler_manifest(raiz: Path) -> dict:
+    arq = Path(raiz) / MANIFEST
+    if not arq.exists():
+        return {'versao': STORE_VERSAO, 'colunas': [], 'fundos': {}}
+    with open(arq, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def _escritor_manifest(man: dict):
+    def _w(tmp):
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(man, fh, ensure_ascii=False, indent=1)
+    return _w
+
+
+def _gravar_manifest(raiz: Path, man: dict):
+    escrever_atomico(Path(raiz) / MANIFEST, _escritor_manifest(man))
+
+
+def _uniao_colunas(atuais, novas):
+    return list(atuais) + [c for c in novas if c not in atuais]
+
+
+# ------------------------------------------------------------------
+# Partições
+# ------------------------------------------------------------------
+def _gravar_particao(path: Path, df: pd.DataFrame, formato: str) -> Path:
+    if formato == "parquet":
+        try:
+            escrever_atomico(path, lambda tmp: df.to_parquet(tmp, index=False))
+            return path
+        except Exception as e:
+            # colunas object com tipos misturados → cai para pickle
+            print(f"    [WARN] Parquet falhou para {path.name} ({e}); usando pickle.")
+            path = path.with_suffix('.pkl')
+    escrever_atomico(path, lambda tmp: df.to_pickle(tmp))
+    return path
+
+
+def _ler_particao(path: Path, colunas=None) -> pd.DataFrame:
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path, columns=colunas)
+    df = pd.read_pickle(path)
+    return df[colunas] if colunas is not None else df
+
+
+def ler_store(raiz: Path, fundos=None, colunas=None) -> pd.DataFrame:
+    """
+    Lê o store na ordem do manifest. `fundos` restringe às partições pedidas
+    (só esses arquivos são abertos); `colunas` restringe colunas.
+    """
+    raiz = Path(raiz)
+    man = ler_manifest(raiz)
+    todas = man['colunas']
+    if colunas is not None:
+        todas = [c for c in todas if c in colunas]
+
+    nomes = list(man['fundos'])
+    if fundos is not None:
+        pedidos = set(fundos)
+        nomes = [f for f in nomes if f in pedidos]
+
+    partes = []
+    for f in nomes:
+        info = man['fundos'][f]
+        cols = None if colunas is None else [c for c in info['colunas'] if c in colunas]
+        partes.append(_ler_particao(raiz / info['arquivo'], cols))
+
+    if not partes:
+        return pd.DataFrame(columns=todas)
+    return pd.concat(partes, ignore_index=True).reindex(columns=todas)
+
+
+def _particao_existente(path: Path) -> Path | None:
+    """Partição com o mesmo nome (parquet, ou o pickle de reserva), se já gravada."""
+    for p in (path, path.with_suffix('.pkl')):
+        if p.exists():
+            return p
+    return None
+
+
+def preparar_lote(raiz: Path, df_novos: pd.DataFrame | None, remover=()) -> dict:
+    """
+    Prepara o lote sem mudar o que os leitores veem: partições de `df_novos`
+    vão para arquivos novos (nome com o hash do conteúdo) e o manifest novo
+    para um temporário. Fundos regravados vão para o fim da ordem, como no
+    append do CSV. Retorna o plano p/ efetivar / descartar:
+    {'trocas': [(tmp, destino)], 'apagar': [...], 'novos': [...],
+     'gravados': [...], 'removidos': [...]}.
+    """
+    raiz = Path(raiz)
+    man = ler_manifest(raiz)
+    formato = man.get('formato') or _pick_formato()
+    man['formato'] = formato
+    plano = {'trocas': [], 'apagar': [], 'novos': [], 'gravados': [], 'removidos': []}
+
+    apagar = []
+    try:
+        for fundo in remover:
+            info = man['fundos'].pop(fundo, None)
+            if info is not None:
+                apagar.append(info['arquivo'])
+                plano['removidos'].append(fundo)
+
+        if df_novos is not None and len(df_novos):
+            for fundo, g in df_novos.groupby('Fundo', sort=False):
+                g = tipar(g.reset_index(drop=True))
+                h = hash_df(g)
+                destino = raiz / _nome_particao(fundo, formato, h)
+                arq = _particao_existente(destino)
+                if arq is None:
+                    arq = _gravar_particao(destino, g, formato)
+                    plano['novos'].append(arq)
+                antigo = man['fundos'].pop(fundo, None)
+                if antigo is not None and antigo['arquivo'] != arq.name:
+                    apagar.append(antigo['arquivo'])
+                man['fundos'][fundo] = {
+                    'arquivo': arq.name,
+                    'linhas':  int(len(g)),
+                    'colunas': list(g.columns),
+                    'hash':    h,
+                }
+                man['colunas'] = _uniao_colunas(man['colunas'], g.columns)
+                plano['gravados'].append(fundo)
+
+        usados = {info['arquivo'] for info in man['fundos'].values()}
+        plano['apagar'] = [raiz / a for a in dict.fromkeys(apagar) if a not in usados]
+        plano['trocas'].append((preparar_atomico(raiz / MANIFEST, _escritor_manifest(man)),
+                                raiz / MANIFEST))
+    except BaseException:
+        descartar([plano])
+        raise
+    return plano
+
+
+def plano_arquivo(path: Path, escrever) -> dict:
+    """Plano (ver preparar_lote) de um MASTER em arquivo único: o temporário já escrito."""
+    return {'trocas': [(preparar_atomico(path, escrever), Path(path))], 'apagar': [], 'novos': []}
+
+
+def efetivar(planos: list, jornal: Path | None = None):
+    """
+    Troca os temporários de todos os `planos` pelos destinos (os.replace) e só
+    depois apaga as partições substituídas. Com `jornal` (pasta da trava),
+    grava antes a lista de trocas em <jornal>/.masters.journal.json: se o
+    processo morrer no meio, o próximo travar() conclui a transação.
+    """
+    trocas = [(Path(t).resolve(), Path(d).resolve()) for p in planos for t, d in p['trocas']]
+    apagar = [Path(a).resolve() for p in planos for a in p['apagar']]
+    arq = None
+    if jornal is not None:
+        arq = Path(jornal) / ARQ_JORNAL
+        conteudo = json.dumps({'trocas': [[str(t), str(d)] for t, d in trocas],
+                               'apagar': [str(a) for a in apagar]}, ensure_ascii=False, indent=1)
+        escrever_atomico(arq, lambda tmp: tmp.write_text(conteudo, encoding='utf-8'))
+    _concluir(trocas, apagar)
+    if arq is not None:
+        arq.unlink(missing_ok=True)
+
+
+def _concluir(trocas, apagar):
+    # temporário que já não existe = troca feita antes da interrupção
+    for tmp, destino in trocas:
+        if tmp.exists():
+            os.replace(tmp, destino)
+    for a in apagar:
+        a.unlink(missing_ok=True)
+
+
+def recuperar(pasta: Path) -> bool:
+    """Conclui a transação do jornal em `pasta`, se houver (sob trava exclusiva)."""
+    arq = Path(pasta) / ARQ_JORNAL
+    if not arq.exists():
+        return False
+    j = json.loads(arq.read_text(encoding='utf-8'))
+    _concluir([(Path(t), Path(d)) for t, d in j['trocas']], [Path(a) for a in j['apagar']])
+    arq.unlink(missing_ok=True)
+    print(f"[master_store] Transação interrompida concluída a partir de {arq}.")
+    return True
+
+
+def descartar(planos: list):
+    """Desfaz planos não efetivados: apaga temporários e partições novas."""
+    for p in planos:
+        for tmp, _ in p['trocas']:
+            Path(tmp).unlink(missing_ok=True)
+        for arq in p['novos']:
+            Path(arq).unlink(missing_ok=True)
+
+
+def aplicar_lote(raiz: Path, df_novos: pd.DataFrame | None, remover=()) -> dict:
+    """
+    Remove `remover` e grava as partições de `df_novos`: preparar_lote e então
+    a troca do manifest, que é o único passo visível (antes dela nada muda).
+    Retorna {'gravados': [...], 'removidos': [...]}.
+    """
+    plano = preparar_lote(raiz, df_novos, remover=remover)
+    efetivar([plano])
+    return {'gravados': plano['gravados'], 'removidos': plano['removidos']}
+
+
+def upsert_fundos(raiz: Path, df: pd.DataFrame, replace: bool = True) -> dict:
+    """
+    Grava (ou substitui) as partições dos fundos presentes em `df`, com uma
+    única regravação do manifest. Retorna {fundo: entrada do manifest}.
+    """
+    raiz = Path(raiz)
+    if not replace:
+        man = ler_manifest(raiz)
+        existentes = [f for f in df['Fundo'].drop_duplicates() if f in man['fundos']]
+        if existentes:
+            raise RuntimeError(f"Fundo(s) {existentes} já existe(m) no MASTER; use --replace-existing.")
+    res = aplicar_lote(raiz, df)
+    man = ler_manifest(raiz)
+    return {f: man['fundos'][f] for f in res['gravados']}
+
+
+def upsert_fundo(raiz: Path, df_fundo: pd.DataFrame, replace: bool = True) -> dict:
+    """Upsert de um único fundo. Retorna a entrada do manifest."""
+    fundos = df_fundo['Fundo'].dropna().unique()
+    if len(fundos) != 1:
+        raise ValueError(f"upsert_fundo espera um único Fundo; recebeu {list(fundos)}")
+    return upsert_fundos(raiz, df_fundo, replace=replace)[fundos[0]]
+
+
+def remover_fundo(raiz: Path, fundo: str) -> bool:
+    """Remove a partição do fundo. Retorna False se o fundo não existia."""
+    raiz = Path(raiz)
+    man = ler_manifest(raiz)
+    info = man['fundos'].pop(fundo, None)
+    if info is None:
+        return False
+    _gravar_manifest(raiz, man)
+    (raiz / info['arquivo']).unlink(missing_ok=True)
+    return True
+
+
+# ------------------------------------------------------------------
+# Leitura/escrita agnóstica (CSV monolítico ou store)
+# ------------------------------------------------------------------
+@metricas.medir()
+def ler_tabela(path: Path, fundos=None, **read_csv_kwargs) -> pd.DataFrame:
+    """
+    CSV → pd.read_csv; store → ler_store. Com `fundos`, só as linhas deles são
+    lidas (partições do store; faixas de bytes do índice do CSV, ver indice_csv.py).
+    """
+    path = Path(path)
+    if eh_store(path):
+        return ler_store(path, fundos=fundos)
+    if fundos is not None:
+        return indice_csv.ler_fundos(path, list(fundos), **read_csv_kwargs)
+    return pd.read_csv(path, **read_csv_kwargs)
+
+
+def remover_de(path: Path, fundo: str) -> bool:
+    """Remove um fundo de um MASTER (CSV ou store)."""
+    path = Path(path)
+    if eh_store(path):
+        return remover_fundo(path, fundo)
+    if not path.exists():
+        return False
+    df = pd.read_csv(path)
+    existe = (df['Fundo'] == fundo).any()
+    df[df['Fundo'] != fundo].to_csv(path, index=False)
+    return bool(existe)
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="MASTER particionado por Fundo (Parquet + manifest).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p_imp = sub.add_parser("importar", help="Converte um MASTER CSV em store particionado.")
+    p_imp.add_argument("csv")
+    p_imp.add_argument("store")
+
+    p_exp = sub.add_parser("exportar", help="Exporta o store como CSV monolítico.")
+    p_exp.add_argument("store")
+    p_exp.add_argument("csv")
+
+    p_ls = sub.add_parser("listar", help="Lista fundos e linhas do store.")
+    p_ls.add_argument("store")
+
+    args = ap.parse_args()
+
+    if args.cmd == "importar":
+        df = pd.read_csv(args.csv)
+        upsert_fundos(Path(args.store), df)
+        print(f"Store criado em {args.store}: {df['Fundo'].nunique()} fundos, {len(df)} linhas.")
+    elif args.cmd == "exportar":
+        df = ler_store(Path(args.store))
+        df.to_csv(args.csv, index=False)
+        print(f"Store exportado para {args.csv}: {len(df)} linhas.")
+    else:
+        man = ler_manifest(Path(args.store))
+        for f, info in man['fundos'].items():
+            print(f"{f:<10} {info['linhas']:>6} linhas  {info['arquivo']}")
+        print(f"Total: {len(man['fundos'])} fundos, formato {man.get('formato', '?')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+metricas.py
+-----------
+Instrumentação comum dos scripts: para cada etapa (e sub-etapa), tempo de
+parede, tempo de CPU, pico de RSS, linhas de entrada/saída e linhas/s.
+
+Três formas de marcar uma etapa:
+
+    with metricas.etapa("limpeza", linhas_in=len(df)) as m:
+        ...
+        m['linhas_out'] = len(out)
+
+    @metricas.medir("mapear_codigo")        # linhas in/out deduzidas dos
+    def mapear_codigos(df_limpas, ...):     # DataFrames de entrada/retorno
+
+    metricas.passo("score", "6/9 notas")    # sequência: fecha o passo anterior
+    ...                                     # da mesma sequência e abre este
+    metricas.fim_passos("score")
+
+Etapas abertas dentro de outras viram sub-etapas ("score_app > 6/9 notas > ...").
+Fora de uma execução configurada (ex.: funções chamadas pelo servico_score)
+tudo isso é no-op.
+
+Nos CLIs: metricas.adicionar_argumentos(ap) e `with metricas.execucao(nome,
+args):` em volta do trabalho. No fim sai a tabela-resumo; com --metrics-out,
+uma linha JSON por etapa (acrescentada ao arquivo); com --profile ETAPA, a
+etapa cujo nome contém ETAPA roda sob cProfile (dump em --profile-out e as
+funções mais caras no console).
+
+O pico de RSS vem de uma thread que lê a memória do processo a cada 10 ms
+(psutil, se instalado; senão /proc/self/statm). Sem nenhum dos dois (ex.:
+Windows sem psutil), a coluna fica vazia. CPU e memória são só do processo
+principal: workers de pool (ingest_lote, --debug-por-fundo) não entram.
+
+Uso:
+    python score_app.py --metrics-out metricas.jsonl
+    python score_app.py --profile "6/9" --profile-out nota.prof
+    python limpeza.py --metrics-out metricas.jsonl
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+INTERVALO_RSS = 0.01
+SEP = " > "           # etapa-mãe > sub-etapa (os nomes podem ter '/', ex.: '6/9 notas')
+
+_ESTADO = {
+    'ativo': False,
+    'pid': None,
+    'script': None,
+    'execucao': None,
+    'registros': [],
+    'inicios': 0,
+    'pilha': [],
+    'passos': {},
+    'amostrador': None,
+    'metrics_out': None,
+    'tabela': True,
+    'perfil': None,
+}
+
+
+# ------------------------------------------------------------------
+# Memória
+# ------------------------------------------------------------------
+def _leitor_rss():
+    """Função que devolve o RSS atual em bytes (psutil ou /proc), ou None."""
+    try:
+        import psutil
+        proc = psutil.Process()
+        return lambda: proc.memory_info().rss
+    except ImportError:
+        pass
+    statm = Path("/proc/self/statm")
+    if statm.exists():
+        pagina = os.sysconf("SC_PAGE_SIZE")
+        return lambda: int(statm.read_text().split()[1]) * pagina
+    return None
+
+
+def _amostrar(ler, parar: threading.Event):
+    """Atualiza o pico de todas as etapas abertas."""
+    while not parar.wait(INTERVALO_RSS):
+        rss = ler()
+        for reg in list(_ESTADO['pilha']):
+            if rss > reg['_pico']:
+                reg['_pico'] = rss
+
+
+def _rss() -> int:
+    am = _ESTADO['amostrador']
+    return am['ler']() if am and am['ler'] else 0
+
+
+# ------------------------------------------------------------------
+# Configuração
+# ------------------------------------------------------------------
+def ativo() -> bool:
+    # processos filhos (fork) herdam o estado, mas não medem
+    return _ESTADO['ativo'] and _ESTADO['pid'] == os.getpid()
+
+
+def configurar(script: str,
+               metrics_out: Path | None = None,
+               profile: str | None = None,
+               profile_out: Path | None = None,
+               tabela: bool = True):
+    """Liga a coleta para esta execução."""
+    ler = _leitor_rss()
+    parar = threading.Event()
+    if ler is not None:
+        threading.Thread(target=_amostrar, args=(ler, parar), daemon=True).start()
+    _ESTADO.update({
+        'ativo': True,
+        'pid': os.getpid(),
+        'script': script,
+        'execucao': f"{script}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}",
+        'registros': [],
+        'inicios': 0,
+        'pilha': [],
+        'passos': {},
+        'amostrador': {'ler': ler, 'parar': parar},
+        'metrics_out': Path(metrics_out) if metrics_out else None,
+        'tabela': tabela,
+        'perfil': None,
+    })
+    if profile:
+        slug = re.sub(r'[^\w.-]+', '_', profile).strip('_') or 'etapa'
+        _ESTADO['perfil'] = {
+            'alvo': profile,
+            'saida': Path(profile_out) if profile_out else Path(f"{script}_{slug}.prof"),
+            'prof': cProfile.Profile(),
+            'dono': None,
+            'usado': False,
+        }
+
+
+def desligar():
+    am = _ESTADO['amostrador']
+    if am is not None:
+        am['parar'].set()
+    _ESTADO.update({'ativo': False, 'amostrador': None, 'pilha': [], 'passos': {}})
+
+
+def registros() -> list:
+    """Etapas já fechadas desta execução (na ordem em que terminaram)."""
+    return list(_ESTADO['registros'])
+
+
+# ------------------------------------------------------------------
+# Etapas
+# ------------------------------------------------------------------
+def _linhas(obj):
+    """Nº de linhas de um DataFrame/Series, de um CSR (tokens_csr) ou do 1º item de uma tupla."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, dict) and 'offsets' in obj:
+        return len(obj['offsets']) - 1
+    if isinstance(obj, tuple) and obj:
+        return _linhas(obj[0])
+    return None
+
+
+def _abrir(nome: str, linhas_in=None) -> dict:
+    pilha = _ESTADO['pilha']
+    _ESTADO['inicios'] += 1
+    reg = {
+        'ordem': _ESTADO['inicios'],
+        'etapa': f"{pilha[-1]['etapa']}{SEP}{nome}" if pilha else nome,
+        'nivel': len(pilha),
+        'linhas_in': linhas_in,
+        'linhas_out': None,
+        '_t0': time.perf_counter(),
+        '_cpu0': time.process_time(),
+        '_pico': _rss(),
+    }
+    pilha.append(reg)
+    perfil = _ESTADO['perfil']
+    if perfil and perfil['dono'] is None and perfil['alvo'] in reg['etapa']:
+        perfil['dono'] = reg
+        perfil['usado'] = True
+        perfil['prof'].enable()
+    return reg
+
+
+def _fechar(reg: dict, erro: bool = False):
+    """Fecha `reg` (e o que tiver ficado aberto acima dele na pilha)."""
+    pilha = _ESTADO['pilha']
+    if not any(r is reg for r in pilha):
+        return
+    while pilha:
+        topo = pilha.pop()
+        _registrar(topo, erro)
+        if topo is reg:
+            break
+
+
+def _registrar(reg: dict, erro: bool):
+    perfil = _ESTADO['perfil']
+    if perfil and perfil['dono'] is reg:
+        perfil['prof'].disable()
+        perfil['dono'] = None
+    seg = time.perf_counter() - reg['_t0']
+    pico = max(reg['_pico'], _rss())
+    base = reg['linhas_in'] if reg['linhas_in'] is not None else reg['linhas_out']
+    _ESTADO['registros'].append({
+        'ordem':        reg['ordem'],
+        'etapa':        reg['etapa'],
+        'nivel':        reg['nivel'],
+        'segundos':     round(seg, 4),
+        'cpu_segundos': round(time.process_time() - reg['_cpu0'], 4),
+        'pico_rss_mb':  round(pico / 2**20, 1) if pico else None,
+        'linhas_in':    reg['linhas_in'],
+        'linhas_out':   reg['linhas_out'],
+        'linhas_s':     round(base / seg, 1) if base and seg > 0 else None,
+        'erro':         erro,
+    })
+    for grupo, aberto in list(_ESTADO['passos'].items()):
+        if aberto is reg:
+            del _ESTADO['passos'][grupo]
+
+
+@contextmanager
+def etapa(nome: str, linhas_in=None):
+    """Mede o bloco. O dict entregue aceita 'linhas_out' (e 'linhas_in')."""
+    if not ativo():
+        yield {}
+        return
+    reg = _abrir(nome, linhas_in)
+    try:
+        yield reg
+    except BaseException:
+        _fechar(reg, erro=True)
+        raise
+    _fechar(reg)
+
+
+def medir(nome: str | None = None):
+    """Decorator: mede cada chamada; linhas do 1º DataFrame de entrada e do retorno."""
+    def deco(func):
+        rotulo = nome or func.__name__
+
+        @functools.wraps(func)
+        def envolvida(*args, **kwargs):
+            if not ativo():
+                return func(*args, **kwargs)
+            linhas_in = next((n for n in map(_linhas, args) if n is not None), None)
+            with etapa(rotulo, linhas_in) as m:
+                out = func(*args, **kwargs)
+                m['linhas_out'] = _linhas(out)
+            return out
+        return envolvida
+    return deco
+
+
+def passo(grupo: str, nome: str, linhas_in=None) -> dict:
+    """Fecha o passo aberto de `grupo` (se houver) e abre `nome`."""
+    if not ativo():
+        return {}
+    anterior = _ESTADO['passos'].get(grupo)
+    if anterior is not None:
+        _fechar(anterior)
+    reg = _abrir(nome, linhas_in)
+    _ESTADO['passos'][grupo] = reg
+    return reg
+
+
+def fim_passos(grupo: str):
+    if not ativo():
+        return
+    anterior = _ESTADO['passos'].pop(grupo, None)
+    if anterior is not None:
+        _fechar(anterior)
+
+
+# ------------------------------------------------------------------
+# Saídas
+# ------------------------------------------------------------------
+def _fmt(v, fmt="{:,.0f}"):
+    return "-" if v is None else fmt.format(v)
+
+
+def agregar(regs: list) -> list:
+    """Uma linha por nome de etapa (chamadas repetidas somadas), na ordem de início."""
+    por_nome = {}
+    for r in sorted(regs, key=lambda r: r['ordem']):
+        a = por_nome.get(r['etapa'])
+        if a is None:
+            por_nome[r['etapa']] = dict(r, chamadas=1)
+            continue
+        a['chamadas'] += 1
+        a['erro'] = a['erro'] or r['erro']
+        for c in ('segundos', 'cpu_segundos', 'linhas_in', 'linhas_out'):
+            if r[c] is not None:
+                a[c] = (a[c] or 0) + r[c]
+        if r['pico_rss_mb'] is not None:
+            a['pico_rss_mb'] = max(a['pico_rss_mb'] or 0, r['pico_rss_mb'])
+    for a in por_nome.values():
+        base = a['linhas_in'] if a['linhas_in'] is not None else a['linhas_out']
+        a['linhas_s'] = round(base / a['segundos'], 1) if base and a['segundos'] > 0 else None
+    return list(por_nome.values())
+
+
+def tabela(regs: list | None = None) -> str:
+    """Tabela-resumo: sub-etapas indentadas sob a etapa-mãe, repetições agregadas (×n)."""
+    regs = agregar(registros() if regs is None else regs)
+
+    def rotulo(r):
+        nome = "  " * r['nivel'] + r['etapa'].rsplit(SEP, 1)[-1]
+        if r['chamadas'] > 1:
+            nome += f" ×{r['chamadas']}"
+        return nome + (" (erro)" if r['erro'] else "")
+
+    largura = max([len("etapa")] + [len(rotulo(r)) for r in regs])
+    linhas = [f"{'etapa':<{largura}} {'seg':>9} {'cpu':>9} {'pico MB':>8} "
+              f"{'linhas in':>10} {'linhas out':>10} {'linhas/s':>11}"]
+    for r in regs:
+        linhas.append(f"{rotulo(r):<{largura}} {r['segundos']:>9.3f} {r['cpu_segundos']:>9.3f} "
+                      f"{_fmt(r['pico_rss_mb'], '{:.1f}'):>8} {_fmt(r['linhas_in']):>10} "
+                      f"{_fmt(r['linhas_out']):>10} {_fmt(r['linhas_s']):>11}")
+    return "\n".join(linhas)
+
+
+def gravar_jsonl(path: Path, regs: list | None = None):
+    regs = registros() if regs is None else regs
+    ts = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(path, 'a', encoding='utf-8') as fh:
+        for r in sorted(regs, key=lambda r: r['ordem']):
+            fh.write(json.dumps({'ts': ts, 'execucao': _ESTADO['execucao'],
+                                 'script': _ESTADO['script'], **r}, ensure_ascii=False) + "\n")
+
+
+def _relatorio_perfil(perfil: dict, n: int = 20) -> str:
+    perfil['prof'].dump_stats(str(perfil['saida']))
+    buf = io.StringIO()
+    pstats.Stats(perfil['prof'], stream=buf).sort_stats('cumulative').print_stats(n)
+    return buf.getvalue()
+
+
+def finalizar():
+    """Fecha o que estiver aberto, imprime a tabela e grava --metrics-out / --profile-out."""
+    if not ativo():
+        return
+    while _ESTADO['pilha']:
+        _fechar(_ESTADO['pilha'][0])
+    regs = registros()
+    if _ESTADO['tabela'] and regs:
+        print("\n─── Métricas por etapa ───")
+        print(tabela(regs))
+    if _ESTADO['metrics_out'] is not None:
+        gravar_jsonl(_ESTADO['metrics_out'], regs)
+        print(f"Métricas acrescentadas em: {_ESTADO['metrics_out']}")
+    perfil = _ESTADO['perfil']
+    if perfil is not None:
+        if perfil['usado']:
+            print(f"\n─── Perfil (cProfile) de '{perfil['alvo']}' → {perfil['saida']} ───")
+            print(_relatorio_perfil(perfil))
+        else:
+            print(f"[WARN] --profile: nenhuma etapa contém '{perfil['alvo']}'.")
+    desligar()
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def adicionar_argumentos(ap):
+    g = ap.add_argument_group("métricas")
+    g.add_argument("--metrics-out", default=None,
+                   help="Acrescenta uma linha JSON por etapa (tempo, CPU, pico de RSS, linhas) neste arquivo.")
+    g.add_argument("--profile", default=None, metavar="ETAPA",
+                   help="Roda sob cProfile a etapa cujo nome contém ETAPA (ex.: '6/9', 'limpeza').")
+    g.add_argument("--profile-out", default=None,
+                   help="Arquivo .prof do --profile (padrão: <script>_<etapa>.prof).")
+
+
+@contextmanager
+def execucao(script: str, args=None):
+    """Configura a partir dos args do CLI e mede o bloco inteiro como etapa `script`."""
+    configurar(script,
+               metrics_out=getattr(args, 'metrics_out', None),
+               profile=getattr(args, 'profile', None),
+               profile_out=getattr(args, 'profile_out', None))
+    try:
+        with etapa(script):
+            yield
+    finally:
+        finalizar()
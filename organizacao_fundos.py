@@ -1,7 +1,7 @@
 # codigo_limpo.py
 import pandas as pd
 
-def _load_simplificado():
+def _load_simplificado(exportar: bool = False):
     df_raw = pd.read_excel(
         'data/Estudo_de_Garantias_v3.xlsx',
         sheet_name='Simplificado',
@@ -39,10 +39,24 @@ def _load_simplificado():
     df = df[['Fundo','%PL','Norm.','Ativo','Garantia','Nota']]
 
     # exporta para CSV
-    df.to_csv('data/df_tidy_simp.csv', index=False)
-    df.to_excel('data/df_tidy_simp.xlsx')
+    if exportar:
+        df.to_csv('data/df_tidy_simp.csv', index=False)
+        df.to_excel('data/df_tidy_simp.xlsx')
 
     return df
 
-# executa o carregamento e exportação assim que o módulo é importado
-df_tidy_simp = _load_simplificado()
+
+# `from organizacao_fundos import df_tidy_simp` continua funcionando, mas a
+# leitura só acontece no primeiro acesso (e sem gravar arquivos).
+_cache = {}
+
+def __getattr__(name):
+    if name == 'df_tidy_simp':
+        if name not in _cache:
+            _cache[name] = _load_simplificado()
+        return _cache[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    _load_simplificado(exportar=True)
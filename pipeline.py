@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+-----------
+Onboarding de um fundo num único processo:
+    ingest_fundo → append_to_master → limpeza → mapear_codigo → score_app
+
+Os DataFrames passam de uma etapa para a outra em memória (sem CSV
+intermediário e com a Classificação carregada uma vez só). Com --salvar, os
+mesmos artefatos das etapas avulsas são gravados no fim.
+
+Uso:
+    python pipeline.py input_dados/PlanilhadeFundamentos_KIP.xlsx KNIP11 "Carteira de Ativos" 10 \
+      --master data/df_tidy_simp_MASTER.csv \
+      --replace-existing --salvar \
+      --scores-out-xlsx score_ALL_placar.xlsx
+"""
+
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+import append_to_master
+import incremental
+import ingest_fundo
+import limpeza
+import mapear_codigo
+import master_store
+import metricas
+import score_app
+import tokens_csr
+from classificacao import carregar_regras
+
+
+def _ler_master(master: Path) -> pd.DataFrame | None:
+    master = Path(master)
+    if master_store.eh_store(master):
+        df = master_store.ler_store(master)
+        return df if len(df.columns) else None
+    return pd.read_csv(master) if master.exists() else None
+
+
+def gravar_masters(master: Path, df_new, df_fin, limpas: tuple, cod: tuple):
+    """
+    Grava os três MASTER como a transacao_master: prepara todos (temporários;
+    no store, partições novas + manifest temporário) e só então efetiva via
+    jornal. `limpas`/`cod` = (caminho, tokens, fingerprints). Chamar sob a
+    trava exclusiva.
+    """
+    planos = []
+    try:
+        if master_store.eh_store(master):
+            planos.append(master_store.preparar_lote(master, df_new))
+        else:
+            planos.append(master_store.plano_arquivo(master, lambda tmp: df_fin.to_csv(tmp, index=False)))
+        for path, tokens, _ in (limpas, cod):
+            planos.append(master_store.plano_arquivo(path, lambda tmp, t=tokens: tokens_csr.gravar_tokens(tmp, t)))
+    except BaseException:
+        master_store.descartar(planos)
+        raise
+
+    for path, _, _ in (limpas, cod):
+        incremental.invalidar_estado(path)
+    master_store.efetivar(planos, jornal=master.parent)
+    for path, _, fps in (limpas, cod):
+        incremental.gravar_estado(path, fps)
+
+
+def rodar_pipeline(arquivo: Path,
+                   fundo: str,
+                   sheet: str,
+                   header: int | None,
+                   master: Path,
+                   classif: Path,
+                   replace_existing: bool = False,
+                   salvar: bool = False,
+                   outdir: Path = Path("input_dados"),
+                   saida_limpas: Path = Path("data/garantias_limpas_MASTER.csv"),
+                   saida_cod: Path = Path("data/garantias_cod_MASTER.csv"),
+                   saida_xlsx: Path | None = None,
+                   scores_only: bool = True,
+                   scores_out_xlsx: Path | None = None,
+                   scores_out_stats: bool = False,
+                   incremental_on: bool = False,
+                   scores_cache: Path | None = None,
+                   layouts: Path | None = None,
+                   engine: str = "colunar") -> dict:
+    """
+    Roda as cinco etapas em memória. Retorna
+    {'staging', 'fin', 'limpas', 'cod', 'scores', 'debug', 'stats'}.
+    `incremental_on` só faz sentido com salvar=True (usa os artefatos em disco).
+    """
+    master = Path(master)
+
+    # 1. Ingestão
+    metricas.passo("pipeline", "1/5 ingestão")
+    print(f"[pipeline 1/5] Ingestão: {arquivo} ({fundo}, aba {sheet!r})")
+    df_stg = ingest_fundo.ingerir_fundo(arquivo, fundo, sheet, header, layouts=layouts)
+
+    # trava dos MASTER até os artefatos: exclusiva se grava, senão compartilhada
+    # (não lê no meio de uma transacao_master)
+    with master_store.travar(master.parent, exclusiva=salvar):
+        # 2. Append no MASTER (em memória)
+        metricas.passo("pipeline", "2/5 append", linhas_in=len(df_stg))
+        print(f"[pipeline 2/5] Append no MASTER: {master}")
+        df_new = append_to_master.padronizar_staging(df_stg)
+        df_fin = append_to_master.anexar(_ler_master(master), df_new, replace_existing=replace_existing)
+
+        # 3. Limpeza
+        metricas.passo("pipeline", "3/5 limpeza", linhas_in=len(df_fin))
+        print("[pipeline 3/5] Limpeza/tokenização")
+        regras = carregar_regras(classif)
+        df_limpas, fps_limpas = limpeza.limpar_garantias(
+            df_fin, regras, saida_csv=saida_limpas, incremental_on=incremental_on,
+            csr=tokens_csr.eh_csr(saida_cod))
+
+        # 4. Mapear códigos
+        metricas.passo("pipeline", "4/5 mapear_codigo", linhas_in=len(df_fin))
+        print("[pipeline 4/5] Mapeamento de códigos")
+        df_cod, fps_cod = mapear_codigo.mapear_codigos(
+            df_limpas, regras, saida_csv=saida_cod, incremental_on=incremental_on)
+
+        # Artefatos (mesmos das etapas avulsas)
+        if salvar:
+            metricas.passo("pipeline", "artefatos", linhas_in=len(df_fin))
+            ingest_fundo.salvar_staging(df_stg, fundo, outdir)
+            gravar_masters(master, df_new, df_fin, (saida_limpas, df_limpas, fps_limpas),
+                           (saida_cod, df_cod, fps_cod))
+            print(f"[pipeline] Artefatos gravados: {master}, {saida_limpas}, {saida_cod}")
+
+    # 5. Score
+    metricas.passo("pipeline", "5/5 score", linhas_in=len(df_fin))
+    print("[pipeline 5/5] Score")
+    classif_t = score_app.load_classificacao(classif, regras_all=regras)
+    res = score_app.run_score_df(
+        score_app.preparar_fin(df_fin.copy()),
+        score_app.preparar_tokens(df_cod.copy()),
+        classif_t,
+        saida_xlsx=saida_xlsx,
+        scores_only=scores_only,
+        scores_out_xlsx=scores_out_xlsx,
+        scores_out_stats=scores_out_stats,
+        scores_cache=scores_cache if incremental_on else None,
+        engine=engine,
+    )
+
+    metricas.fim_passos("pipeline")
+
+    res.update({'staging': df_stg, 'fin': df_fin, 'limpas': df_limpas, 'cod': df_cod})
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingest → append → limpeza → mapear → score num único processo.")
+    ap.add_argument("arquivo", help="Arquivo Excel do fundo.")
+    ap.add_argument("nome_fundo", help="Ticker do fundo (ex.: KNIP11).")
+    ap.add_argument("sheet", help="Nome exato da aba no Excel.")
+    ap.add_argument("header", type=int, nargs="?", default=None,
+                    help="Número da linha de cabeçalho (0-index). Omitido: detecta automaticamente.")
+
+    ap.add_argument("--master", default="data/df_tidy_simp_MASTER.csv",
+                    help="MASTER financeiro (CSV ou store particionado).")
+    ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
+                    help="Planilha Classificação.")
+    ap.add_argument("--replace-existing", action="store_true",
+                    help="Substitui o fundo se já existir no MASTER.")
+    ap.add_argument("--layouts", default=str(ingest_fundo.REGISTRO_LAYOUTS),
+                    help="Registro JSON de layouts de cabeçalho. Use '' para desligar.")
+
+    ap.add_argument("--salvar", action="store_true",
+                    help="Grava staging, MASTER, garantias_limpas e garantias_cod como nas etapas avulsas.")
+    ap.add_argument("--outdir", default="input_dados",
+                    help="Diretório do staging (com --salvar).")
+    ap.add_argument("--saida-limpas", default="data/garantias_limpas_MASTER.csv",
+                    help="Tokens limpos (com --salvar): CSV largo ou .npz (CSR).")
+    ap.add_argument("--saida-cod", default="data/garantias_cod_MASTER.csv",
+                    help="Tokens codificados (com --salvar): CSV largo ou .npz (CSR).")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Com --salvar: reprocessa só fundos alterados (ver incremental.py).")
+    ap.add_argument("--scores-cache", default="data/scores_cache.csv",
+                    help="Cache de scores por fundo usado com --incremental.")
+
+    ap.add_argument("--saida-xlsx", default="",
+                    help="XLSX detalhado do score (Scores + Debug + Stats). Padrão: não gera.")
+    ap.add_argument("--debug", action="store_true",
+                    help="Inclui Debug_Linhas no XLSX detalhado.")
+    ap.add_argument("--scores-out-xlsx", default=None,
+                    help="XLSX enxuto com o placar (Scores).")
+    ap.add_argument("--scores-out-stats", action="store_true",
+                    help="Inclui sheet Stats no placar enxuto.")
+    ap.add_argument("--engine", choices=["colunar", "matrix"], default="colunar",
+                    help="Motor do score (ver score_app.py --engine).")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    if args.incremental and not args.salvar:
+        ap.error("--incremental requer --salvar (o estado fica nos artefatos em disco).")
+
+    with metricas.execucao("pipeline", args):
+        rodar_pipeline(
+            arquivo=Path(args.arquivo),
+            fundo=args.nome_fundo,
+            sheet=args.sheet,
+            header=args.header,
+            master=Path(args.master),
+            classif=Path(args.classif),
+            replace_existing=args.replace_existing,
+            salvar=args.salvar,
+            outdir=Path(args.outdir),
+            saida_limpas=Path(args.saida_limpas),
+            saida_cod=Path(args.saida_cod),
+            saida_xlsx=Path(args.saida_xlsx) if args.saida_xlsx else None,
+            scores_only=not args.debug,
+            scores_out_xlsx=Path(args.scores_out_xlsx) if args.scores_out_xlsx else None,
+            scores_out_stats=args.scores_out_stats,
+            incremental_on=args.incremental,
+            scores_cache=Path(args.scores_cache),
+            layouts=Path(args.layouts) if args.layouts else None,
+            engine=args.engine,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,44 @@
-import pandas as pd
-import numpy as np
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+remover_fundo.py
+----------------
+Remove um ou mais fundos de todos os MASTER (financeiro, garantias limpas,
+tokens codificados) numa única transação: trava exclusiva, uma regravação
+de cada arquivo e troca atômica (ver transacao_master.py).
 
-fundo_remover = "HGCR11"  # ou qualquer outro nome do fundo que você acabou de adicionar
+Uso:
+    python remover_fundo.py HGCR11
+    python remover_fundo.py HGCR11 XPTO11 --simular
+"""
 
-# Carrega os arquivos MASTER
-df_tidy = pd.read_csv("data/df_tidy_simp_MASTER.csv")
-df_limpas = pd.read_csv("data/garantias_limpas_MASTER.csv")
-df_cod = pd.read_csv("data/garantias_cod_MASTER.csv")
+import argparse
 
-# Filtra para remover o fundo
-df_tidy = df_tidy[df_tidy["Fundo"] != fundo_remover]
-df_limpas = df_limpas[df_limpas["Fundo"] != fundo_remover]
-df_cod = df_cod[df_cod["Fundo"] != fundo_remover]
+import master_store
+import metricas
+import transacao_master
 
-# Salva de volta
-df_tidy.to_csv("data/df_tidy_simp_MASTER.csv", index=False)
-df_limpas.to_csv("data/garantias_limpas_MASTER.csv", index=False)
-df_cod.to_csv("data/garantias_cod_MASTER.csv", index=False)
 
-print(f"Fundo {fundo_remover} removido com sucesso dos arquivos MASTER.")
+def main():
+    ap = argparse.ArgumentParser(description="Remove fundo(s) de todos os MASTER.")
+    ap.add_argument("fundos", nargs="+", help="Fundo(s) a remover (espaço ou vírgula).")
+    ap.add_argument("--simular", action="store_true", help="Mostra o que mudaria, sem gravar.")
+    ap.add_argument("--timeout", type=float, default=transacao_master.TIMEOUT_PADRAO,
+                    help="Segundos esperando a trava antes de desistir.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    with metricas.execucao("remover_fundo", args):
+        fundos = transacao_master._lista(args.fundos)
+        masters = {nome: master_store.resolver_master(base) for nome, base in transacao_master.MASTERS.items()}
+        res = transacao_master.transacao(masters, remover=fundos, timeout=args.timeout, simular=args.simular)
+
+        for f in res['ausentes']:
+            print(f"[WARN] {f} não está no MASTER financeiro.")
+        if res['removidos']:
+            acao = "seriam removidos" if args.simular else "removido(s) com sucesso"
+            print(f"Fundo(s) {', '.join(res['removidos'])} {acao} dos arquivos MASTER.")
+
+
+if __name__ == "__main__":
+    main()
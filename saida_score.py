@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+saida_score.py
+--------------
+Gravação das saídas do score_app (Scores / Debug_Linhas / Stats).
+
+  - xlsx: escrita em streaming, linha a linha, em blocos. Com xlsxwriter usa
+    constant_memory (cada linha vai para o disco assim que a próxima começa);
+    sem xlsxwriter, openpyxl write_only. Nenhum dos dois monta o workbook
+    inteiro em memória, ao contrário do pd.ExcelWriter. Conteúdo igual ao do
+    to_excel (listas como texto, NaN como célula vazia).
+  - csv / parquet: um arquivo por aba, `<saida>_<Aba>.<formato>`.
+  - debug por fundo: um arquivo por fundo numa pasta, gerados em paralelo
+    (pool de processos).
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+
+FORMATOS = ("xlsx", "csv", "parquet")
+BLOCO_LINHAS = 50_000
+# limites de uma aba xlsx (cabeçalho conta como linha)
+MAX_LINHAS_XLSX = 1_048_576
+MAX_COLUNAS_XLSX = 16_384
+
+
+# ------------------------------------------------------------------
+# Conversão de células
+# ------------------------------------------------------------------
+def _coluna(s: pd.Series) -> list:
+    """Valores prontos p/ a planilha: NaN → None, listas → texto, numpy → Python."""
+    if s.dtype != object:
+        return s.astype(object).where(s.notna(), None).tolist()
+    out = []
+    for v in s.tolist():
+        if v is None or (isinstance(v, float) and v != v):
+            out.append(None)
+        elif isinstance(v, (list, tuple, set, dict)):
+            out.append(str(v))
+        else:
+            out.append(v)
+    return out
+
+
+def linhas(df: pd.DataFrame, bloco: int = BLOCO_LINHAS):
+    """Gera as linhas de `df` (tuplas) convertendo um bloco de cada vez."""
+    for ini in range(0, len(df), bloco):
+        parte = df.iloc[ini:ini + bloco]
+        yield from zip(*[_coluna(parte[c]) for c in parte.columns])
+
+
+# ------------------------------------------------------------------
+# xlsx em streaming
+# ------------------------------------------------------------------
+def _checar_limites_xlsx(abas: list):
+    """Erro antes de escrever se alguma aba não cabe (xlsxwriter truncaria calado)."""
+    for nome, df in abas:
+        if len(df) + 1 > MAX_LINHAS_XLSX or df.shape[1] > MAX_COLUNAS_XLSX:
+            raise ValueError(
+                f"Aba {nome!r} grande demais para xlsx: {len(df)} linhas + cabeçalho × "
+                f"{df.shape[1]} colunas (máx. {MAX_LINHAS_XLSX} × {MAX_COLUNAS_XLSX}). "
+                "Use --format parquet ou --format csv."
+            )
+
+
+def gravar_xlsx_streaming(path: Path, abas: list, bloco: int = BLOCO_LINHAS):
+    """`abas` = [(nome, df), ...] → xlsx sem montar o workbook em memória."""
+    _checar_limites_xlsx(abas)
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    if xlsxwriter is not None:
+        wb = xlsxwriter.Workbook(str(path), {'constant_memory': True})
+        negrito = wb.add_format({'bold': True, 'border': 1, 'align': 'center'})
+        for nome, df in abas:
+            ws = wb.add_worksheet(nome)
+            ws.write_row(0, 0, [str(c) for c in df.columns], negrito)
+            for i, linha in enumerate(linhas(df, bloco), start=1):
+                if ws.write_row(i, 0, linha) == -1:   # fora dos limites: não trunca calado
+                    wb.close()
+                    raise ValueError(f"Aba {nome!r}: linha {i} fora dos limites do xlsx.")
+        wb.close()
+        return
+
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    for nome, df in abas:
+        ws = wb.create_sheet(nome)
+        ws.append([str(c) for c in df.columns])
+        for linha in linhas(df, bloco):
+            ws.append(linha)
+    wb.save(path)
+
+
+# ------------------------------------------------------------------
+# csv / parquet
+# ------------------------------------------------------------------
+def _para_parquet(df: pd.DataFrame) -> pd.DataFrame:
+    """Colunas object com tipos misturados viram texto (parquet exige tipo único)."""
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype != object:
+            continue
+        tipos = {type(v) for v in df[c].dropna().tolist()}
+        if len(tipos) > 1 or (tipos and not tipos <= {str, list}):
+            df[c] = df[c].map(lambda v: v if v is None or (isinstance(v, float) and v != v) else str(v))
+    return df
+
+
+def gravar_tabela(path: Path, df: pd.DataFrame, formato: str):
+    if formato == "csv":
+        df.to_csv(path, index=False)
+    elif formato == "parquet":
+        _para_parquet(df).to_parquet(path, index=False)
+    else:
+        gravar_xlsx_streaming(path, [("Debug_Linhas", df)])
+
+
+def caminho_aba(saida: Path, aba: str, formato: str) -> Path:
+    saida = Path(saida)
+    return saida.with_name(f"{saida.stem}_{aba}.{formato}")
+
+
+def gravar_abas(saida: Path, abas: list, formato: str = "xlsx") -> list:
+    """
+    xlsx: um workbook com as abas; csv/parquet: um arquivo por aba ao lado de
+    `saida`. Retorna os caminhos gravados.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"formato inválido: {formato} (use {', '.join(FORMATOS)})")
+    if formato == "parquet":
+        _exigir_parquet()
+    saida = Path(saida)
+    if formato == "xlsx":
+        gravar_xlsx_streaming(saida, abas)
+        return [saida]
+    caminhos = []
+    for nome, df in abas:
+        p = caminho_aba(saida, nome, formato)
+        gravar_tabela(p, df, formato)
+        caminhos.append(p)
+    return caminhos
+
+
+def _exigir_parquet():
+    try:
+        import pyarrow  # noqa
+    except ImportError:
+        try:
+            import fastparquet  # noqa
+        except ImportError:
+            raise ImportError("--format parquet requer pyarrow ou fastparquet.")
+
+
+# ------------------------------------------------------------------
+# Debug por fundo, em paralelo
+# ------------------------------------------------------------------
+def _nome_arquivo(fundo) -> str:
+    return re.sub(r'[^\w.-]', '_', str(fundo))
+
+
+def _gravar_fundo(item, formato: str):
+    path, df = item
+    gravar_tabela(path, df, formato)
+    return path
+
+
+def gravar_debug_por_fundo(pasta: Path, df_debug: pd.DataFrame,
+                           formato: str = "xlsx", workers: int | None = None) -> list:
+    """Um arquivo `<pasta>/<Fundo>.<formato>` por fundo. Retorna os caminhos."""
+    if formato == "parquet":
+        _exigir_parquet()
+    pasta = Path(pasta)
+    pasta.mkdir(parents=True, exist_ok=True)
+    itens = [
+        (pasta / f"{_nome_arquivo(f)}.{formato}", g.reset_index(drop=True))
+        for f, g in df_debug.groupby('Fundo', sort=False)
+    ]
+    workers = workers or min(len(itens), os.cpu_count() or 1)
+    if workers <= 1 or len(itens) <= 1:
+        return [_gravar_fundo(it, formato) for it in itens]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(partial(_gravar_fundo, formato=formato), itens,
+                           chunksize=max(1, len(itens) // (workers * 4))))
@@ -6,22 +6,23 @@ import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
-import re
-from unidecode import unidecode
+
+from classificacao import carregar_regras
+import historico_scores
+import incremental
+import indice_csv
+import master_store
+import metricas
+import saida_score
+import score_matriz
+import snapshots
+import tokens_csr
+from texto import normalizar_serie
 
 
 # ------------------------------------------------------------------
 # Utils
 # ------------------------------------------------------------------
-def normalizar(s: str) -> str:
-    """Lowercase, sem acento, espaços colapsados."""
-    if not isinstance(s, str):
-        return s
-    s = unidecode(s).lower()
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
-
-
 def _pick_excel_engine():
     """Escolhe engine disponível."""
     try:
@@ -34,56 +35,49 @@ def _pick_excel_engine():
 # ------------------------------------------------------------------
 # Classificação loader
 # ------------------------------------------------------------------
-def load_classificacao(path_xlsx: Path, sheet_name: str = "Classificação"):
+def load_classificacao(path_xlsx: Path, sheet_name: str = "Classificação", regras_all: dict | None = None):
+    """`regras_all` já carregado (carregar_regras) evita reabrir o cache/xlsx."""
+    m = metricas.passo("score", "1/9 classificação")
     print(f"[1/9] Lendo Classificação: {path_xlsx} (aba: {sheet_name})")
-    df_class = pd.read_excel(path_xlsx, sheet_name=sheet_name, header=1)
-
-    # Limpeza
-    df_class['Código']    = df_class['Código'].astype(str).str.strip().str.upper()
-    df_class['Subclasse'] = df_class['Subclasse'].astype(str).str.strip()
-
-    # Nota para numérico
-    df_class['Nota'] = pd.to_numeric(df_class['Nota'], errors='coerce')
-
-    # Normalizado
-    df_class['Subclasse_norm'] = df_class['Subclasse'].apply(normalizar)
-
-    # Mapas
-    class_map = (
-        df_class
-        .dropna(subset=['Código','Subclasse_norm'])
-        .set_index(['Código','Subclasse_norm'])['Nota']
-        .to_dict()
-    )
+    if regras_all is None:
+        regras_all = carregar_regras(path_xlsx, sheet_name=sheet_name)
+    regras = regras_all['score']
 
-    CODIGOS_OFICIAIS = set(df_class['Código'].dropna().unique())
-
-    SUB_NORM2CANON = (
-        df_class.dropna(subset=['Subclasse'])
-                .set_index('Subclasse_norm')['Subclasse']
-                .to_dict()
-    )
+    df_class         = regras['df_class']
+    class_map        = regras['class_map']
+    CODIGOS_OFICIAIS = regras['CODIGOS_OFICIAIS']
+    SUB_NORM2CANON   = regras['SUB_NORM2CANON']
+    NOTAS_IDX        = regras['NOTAS_IDX']
 
     print(f"         Códigos: {len(CODIGOS_OFICIAIS)}, Subclasses: {len(SUB_NORM2CANON)}")
-    return df_class, class_map, CODIGOS_OFICIAIS, SUB_NORM2CANON
+    m['linhas_out'] = len(df_class)
+    return df_class, class_map, CODIGOS_OFICIAIS, SUB_NORM2CANON, NOTAS_IDX, regras_all['hash']
 
 
 # ------------------------------------------------------------------
 # Financeiro loader
 # ------------------------------------------------------------------
-def load_fin(path_fin: Path) -> pd.DataFrame:
+def load_fin(path_fin: Path, fundos=None) -> pd.DataFrame:
+    """`fundos`: lê só esses fundos (partições do store / faixas do índice do CSV)."""
+    m = metricas.passo("score", "2/9 financeiro")
     print(f"[2/9] Lendo Financeiro MASTER: {path_fin}")
-    df_fin = pd.read_csv(path_fin)
+    df_fin = master_store.ler_tabela(path_fin, fundos=fundos)
+    m['linhas_out'] = len(df_fin)
+    # store particionado já vem tipado
+    return preparar_fin(df_fin, origem=path_fin, tipar=not master_store.eh_store(path_fin))
 
+
+def preparar_fin(df_fin: pd.DataFrame, origem="financeiro", tipar: bool = True) -> pd.DataFrame:
     # Colunas mínimas
     needed = {'Fundo','Ativo','%PL','Norm.','Garantia'}
     missing = needed - set(df_fin.columns)
     if missing:
-        raise ValueError(f"Financeiro {path_fin} sem colunas: {missing}")
+        raise ValueError(f"Financeiro {origem} sem colunas: {missing}")
 
     # Numérico
-    for col in ['%PL','Norm.']:
-        df_fin[col] = pd.to_numeric(df_fin[col], errors='coerce')
+    if tipar:
+        for col in ['%PL','Norm.']:
+            df_fin[col] = pd.to_numeric(df_fin[col], errors='coerce')
 
     return df_fin
 
@@ -91,68 +85,133 @@ def load_fin(path_fin: Path) -> pd.DataFrame:
 # ------------------------------------------------------------------
 # Tokens loader
 # ------------------------------------------------------------------
-def load_tokens(path_tok: Path) -> pd.DataFrame:
+def load_tokens(path_tok: Path, fundos=None):
+    """
+    CSV largo → DataFrame [Fundo, Ativo, G1..Gn]; .npz → dict CSR (tokens_csr).
+    `fundos`: só esses fundos (CSV via índice de bytes; CSR filtrado após ler).
+    """
+    m = metricas.passo("score", "3/9 tokens")
     print(f"[3/9] Lendo Tokens COD: {path_tok}")
-    df_tok = pd.read_csv(path_tok, dtype=str)
+    if tokens_csr.eh_csr(path_tok):
+        csr = tokens_csr.ler(path_tok)
+        if fundos is not None:
+            csr = tokens_csr.filtrar(csr, pd.Series(csr['fundo']).isin(list(fundos)).to_numpy())
+        m['linhas_out'] = tokens_csr.n_linhas(csr)
+        return csr
+    if fundos is not None:
+        df_tok = indice_csv.ler_fundos(path_tok, fundos, dtype=str)
+    else:
+        df_tok = pd.read_csv(path_tok, dtype=str)
+    m['linhas_out'] = len(df_tok)
+    return preparar_tokens(df_tok)
+
+
+def preparar_tokens(df_tok):
     # Padroniza vazios → NaN
+    if isinstance(df_tok, dict):
+        return df_tok
     gcols = [c for c in df_tok.columns if c.startswith('G')]
     for c in gcols:
-        df_tok[c] = df_tok[c].replace({'': np.nan})
+        df_tok[c] = df_tok[c].mask(df_tok[c] == '')
     return df_tok
 
 
 # ------------------------------------------------------------------
-# Extrai códigos/subclasses de uma linha de tokens
+# Motor colunar: G1..Gn → tabela longa de tokens classificados
 # ------------------------------------------------------------------
-def extract_codes_subs(row, gcols, CODIGOS_OFICIAIS, SUB_NORM2CANON):
-    codes = []
-    subs  = []
-    for c in gcols:
-        tok = row.get(c, np.nan)
-        if not isinstance(tok, str) or tok.strip() == "":
-            continue
-
-        t_up   = tok.upper().strip()
-        t_norm = normalizar(tok)
-
-        # Código?
-        if t_up in CODIGOS_OFICIAIS:
-            if t_up not in codes:
-                codes.append(t_up)
-            continue
-
-        # Subclasse?
-        if t_norm in SUB_NORM2CANON:
-            subcanon = SUB_NORM2CANON[t_norm]
-            if subcanon not in subs:
-                subs.append(subcanon)
-            continue
-
-        # ruído → ignora
-        continue
-
-    return codes, subs
+@metricas.medir()
+def classificar_tokens(df_tok: pd.DataFrame, gcols, CODIGOS_OFICIAIS, SUB_NORM2CANON) -> pd.DataFrame:
+    """
+    Derrete G1..Gn numa tabela longa (_lin, _pos, tok) e classifica cada token
+    uma única vez por valor distinto. Colunas 'code'/'sub' ficam NaN p/ ruído.
+    Código tem prioridade sobre subclasse.
+    """
+    vals = df_tok[gcols].to_numpy(dtype=object)
+    n, g = vals.shape
+    toks = pd.Series(vals.ravel())
+    strip = toks.str.strip()
+    mask = (strip.notna() & (strip != '')).to_numpy()
+
+    long = pd.DataFrame({
+        '_lin': np.repeat(np.arange(n), g)[mask],
+        '_pos': np.tile(np.arange(g), n)[mask],
+        'tok':  toks[mask].to_numpy(),
+    })
+    return classificar_longo(long, CODIGOS_OFICIAIS, SUB_NORM2CANON)
+
+
+@metricas.medir()
+def classificar_csr(csr: dict, CODIGOS_OFICIAIS, SUB_NORM2CANON) -> pd.DataFrame:
+    """Mesmo que classificar_tokens, direto dos offsets/ids do CSR (sem frame largo)."""
+    long = tokens_csr.para_longo(csr)
+    strip = long['tok'].str.strip()
+    long = long[(strip.notna() & (strip != '')).to_numpy()]
+    return classificar_longo(long, CODIGOS_OFICIAIS, SUB_NORM2CANON)
+
+
+def classificar_longo(long: pd.DataFrame, CODIGOS_OFICIAIS, SUB_NORM2CANON) -> pd.DataFrame:
+    """(_lin, _pos, tok) → + colunas 'code'/'sub', classificando por token distinto."""
+    uniq = pd.Series(pd.unique(long['tok']), dtype=object)
+    t_up = uniq.str.upper().str.strip()
+    is_code = t_up.isin(CODIGOS_OFICIAIS)
+    sub = normalizar_serie(uniq).map(SUB_NORM2CANON).where(~is_code)
+
+    classe = pd.DataFrame({
+        'tok':  uniq,
+        'code': t_up.where(is_code),
+        'sub':  sub,
+    })
+    return long.merge(classe, on='tok', how='left', sort=False)
+
+
+def _listas_por_linha(long: pd.DataFrame, col: str, n: int) -> pd.Series:
+    """Lista ordenada (1ª ocorrência, sem repetição) de `col` por linha."""
+    sel = long.dropna(subset=[col]).drop_duplicates(subset=['_lin', col])
+    agg = sel.groupby('_lin', sort=True)[col].agg(list).reindex(range(n))
+    return agg.map(lambda x: x if isinstance(x, list) else [])
+
+
+def codes_subs_colunar(long: pd.DataFrame, n: int):
+    """Códigos e subclasses (1ª ocorrência, sem repetição) de cada linha."""
+    return _listas_por_linha(long, 'code', n), _listas_por_linha(long, 'sub', n)
+
+
+def notas_colunar_detalhe(long: pd.DataFrame, n: int, notas_idx) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Nota por linha: junta codes × subs, busca a nota do par e reduz por max;
+    linhas sem par válido caem no melhor valor do código (max_codigo), senão
+    NaN. Retorna (notas, máscara das linhas cuja nota veio do fallback).
+    """
+    codes = long.dropna(subset=['code'])[['_lin', 'code']].drop_duplicates()
+    subs  = long.dropna(subset=['sub'])[['_lin', 'sub']].drop_duplicates()
+
+    pares = codes.merge(subs, on='_lin')
+    s_norm = pares['sub'].map(notas_idx['sub_norm'])
+    falta = s_norm.isna()
+    if falta.any():
+        s_norm[falta] = normalizar_serie(pares.loc[falta, 'sub'])
+    chave = pd.MultiIndex.from_arrays([pares['code'], s_norm])
+    tabela = pd.Series(notas_idx['pares'], dtype=float)
+    if len(tabela):
+        pares['nota'] = tabela.reindex(chave).to_numpy()
+    else:
+        pares['nota'] = np.nan
+    nota_par = pares.dropna(subset=['nota']).groupby('_lin')['nota'].max()
 
+    codes['nota'] = codes['code'].map(notas_idx['max_codigo'])
+    nota_cod = codes.dropna(subset=['nota']).groupby('_lin')['nota'].max()
 
-# ------------------------------------------------------------------
-# Nota por linha
-# ------------------------------------------------------------------
-def nota_para_linha(codes, subs, class_map):
-    """Tenta (c,s); fallback melhor nota do código; senão NaN."""
-    notas = []
-    for c in codes:
-        for s in subs:
-            n = class_map.get((c, normalizar(s)), np.nan)
-            notas.append(n)
-    notas_validas = [n for n in notas if not np.isnan(n)]
-    if notas_validas:
-        return float(np.nanmax(notas_validas))
+    nota = nota_par.combine_first(nota_cod).reindex(range(n))
+    fallback = np.zeros(n, dtype=bool)
+    fallback[nota_cod.index.difference(nota_par.index).to_numpy(dtype=np.int64)] = True
+    return nota.to_numpy(dtype=float), fallback
 
-    notas_code = [n for (c0, _s0), n in class_map.items() if c0 in codes and not np.isnan(n)]
-    if notas_code:
-        return float(np.nanmax(notas_code))
 
-    return np.nan
+def contagens_longo(long: pd.DataFrame, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Tokens (não vazios) e tokens de ruído (nem código nem subclasse) por linha."""
+    lin = long['_lin'].to_numpy()
+    ruido = (long['code'].isna() & long['sub'].isna()).to_numpy()
+    return np.bincount(lin, minlength=n), np.bincount(lin[ruido], minlength=n)
 
 
 # ------------------------------------------------------------------
@@ -177,9 +236,53 @@ def calcular_scores(df_all: pd.DataFrame,
     return scores
 
 
+# ------------------------------------------------------------------
+# Stats (QC) por fundo
+# ------------------------------------------------------------------
+STATS_COLS = ['Fundo','Linhas','Sem_codes','Sem_subs','Nota_calc_NaN','Soma_Norm','Score_calc',
+              'Tokens','Frac_ruido','Nota_fallback','Taxa_fallback',
+              'Norm_nota_NaN','Frac_Norm_nota_NaN']
+
+
+def _razao(num: pd.Series, den: pd.Series) -> pd.Series:
+    return num.div(den).replace([np.inf, -np.inf], np.nan)
+
+
+@metricas.medir()
+def calcular_stats(df_all: pd.DataFrame, scores: pd.Series) -> pd.DataFrame:
+    """
+    Stats por fundo numa agregação só, sobre as contagens por linha
+    (_n_codes, _n_subs, _n_tok, _n_ruido, _fallback):
+      - Frac_ruido: tokens que não são código nem subclasse / tokens;
+      - Taxa_fallback: linhas cuja nota veio só do código (sem par válido);
+      - Frac_Norm_nota_NaN: parcela do Norm. em linhas sem nota.
+    """
+    nota_nan = df_all['Nota_calculada'].isna()
+    norm = df_all['Norm.']
+    g = pd.DataFrame({
+        'Fundo':         df_all['Fundo'],
+        'Linhas':        1,
+        'Sem_codes':     df_all['_n_codes'].eq(0),
+        'Sem_subs':      df_all['_n_subs'].eq(0),
+        'Nota_calc_NaN': nota_nan,
+        'Soma_Norm':     norm,
+        'Tokens':        df_all['_n_tok'],
+        'Tokens_ruido':  df_all['_n_ruido'],
+        'Nota_fallback': df_all['_fallback'],
+        'Norm_nota_NaN': norm.where(nota_nan),
+    }).groupby('Fundo', sort=False).sum()
+
+    g['Score_calc'] = scores.reindex(g.index)
+    g['Frac_ruido'] = _razao(g['Tokens_ruido'], g['Tokens'])
+    g['Taxa_fallback'] = _razao(g['Nota_fallback'], g['Linhas'])
+    g['Frac_Norm_nota_NaN'] = _razao(g['Norm_nota_NaN'], g['Soma_Norm'])
+    return g.reset_index().reindex(columns=STATS_COLS)
+
+
 # ------------------------------------------------------------------
 # Debug DataFrame (linhas)
 # ------------------------------------------------------------------
+@metricas.medir()
 def build_debug_df(df_fin, df_tok, df_all, gcols):
     dbg_cols = ['Fundo','Ativo','%PL','Norm.','Garantia']
     base = df_fin[dbg_cols].reset_index(drop=True)
@@ -242,6 +345,66 @@ def export_scores_xlsx(path_out: Path,
     print(f"→ Resultados (placar) salvos em: {path_out}")
 
 
+# ------------------------------------------------------------------
+# Cache incremental de scores/stats por fundo
+# ------------------------------------------------------------------
+def fingerprints_score(df_fin, df_tok, gcols, extra: str) -> dict:
+    """Fingerprint por fundo das linhas financeiras + tokens (+ regras/flags)."""
+    fp_fin = incremental.fingerprints(df_fin, ['Fundo','Ativo','%PL','Norm.','Garantia'], extra=extra)
+    fp_tok = incremental.fingerprints(df_tok, ['Fundo','Ativo'], extra=extra, gcols=gcols)
+    return {f: fp + fp_tok.get(f, '') for f, fp in fp_fin.items()}
+
+
+def ler_cache_scores(path_cache: Path) -> pd.DataFrame | None:
+    if path_cache is None or not path_cache.exists():
+        return None
+    return pd.read_csv(path_cache)
+
+
+def mesclar_cache_scores(cache: pd.DataFrame | None,
+                         df_scores: pd.DataFrame,
+                         df_stats: pd.DataFrame,
+                         fps: dict,
+                         fundos_recalc,
+                         selecao=None) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Junta scores/stats recalculados com os do cache (fundos inalterados), na
+    ordem dos fundos do MASTER. Retorna (df_scores, df_stats, novo_cache).
+    `selecao` (--fundo/--fundos): `fps` só cobre esses fundos; o resto do
+    cache passa intacto para o novo_cache (só sai fundo selecionado que não
+    está mais no MASTER).
+    """
+    novos = df_stats.merge(df_scores, on='Fundo', how='left')
+    novos['_fp'] = novos['Fundo'].map(fps)
+
+    partes = [novos] if len(novos) else []
+    if cache is not None:
+        recalc = set(fundos_recalc)
+        partes.insert(0, cache[cache['Fundo'].isin(fps) & ~cache['Fundo'].isin(recalc)])
+    todos = pd.concat(partes, ignore_index=True) if partes else novos
+
+    ordem = {f: i for i, f in enumerate(fps)}
+    todos = (todos.assign(_ord=todos['Fundo'].map(ordem))
+                  .sort_values('_ord', kind='stable')
+                  .drop(columns=['_ord'])
+                  .reset_index(drop=True))
+
+    out_scores = todos.dropna(subset=['Score_Garantia'])[['Fundo','Score_Garantia']].reset_index(drop=True)
+    out_stats  = todos.reindex(columns=list(df_stats.columns)).reset_index(drop=True)
+
+    novo_cache = todos
+    if selecao is not None and cache is not None:
+        fora = cache[~cache['Fundo'].isin(set(selecao))]
+        # ordem do cache antigo; fundos novos no fim
+        pos = {f: i for i, f in enumerate(cache['Fundo'])}
+        novo_cache = pd.concat([fora, todos], ignore_index=True)
+        novo_cache = (novo_cache.assign(_ord=novo_cache['Fundo'].map(pos).fillna(len(pos)))
+                                .sort_values('_ord', kind='stable')
+                                .drop(columns=['_ord'])
+                                .reset_index(drop=True))
+    return out_scores, out_stats, novo_cache
+
+
 # ------------------------------------------------------------------
 # Pipeline principal
 # ------------------------------------------------------------------
@@ -249,29 +412,127 @@ def run_score(path_fin: Path,
               path_tok: Path,
               path_classif: Path,
               saida_xlsx: Path | None,
-              fundo_filter: str | None = None,
+              fundo_filter: str | list | None = None,
               drop_na_norm: bool = False,
               drop_na_score: bool = False,
               scores_master_xlsx: Path | None = None,
               update_master_scores: bool = False,
               scores_only: bool = False,
               scores_out_xlsx: Path | None = None,
-              scores_out_stats: bool = False):
+              scores_out_stats: bool = False,
+              scores_cache: Path | None = None,
+              engine: str = "colunar",
+              formato: str = "xlsx",
+              debug_por_fundo: Path | None = None,
+              workers: int | None = None,
+              historico: Path | None = None,
+              as_of: str | None = None,
+              snapshots_raiz: Path = snapshots.RAIZ_PADRAO):
+    """
+    `fundo_filter` (um fundo ou lista) é empurrado para a leitura dos MASTER.
+    `as_of` (id de snapshot ou data): financeiro e tokens vêm do snapshot
+    (snapshots.py) em vez de `path_fin`/`path_tok`.
+    """
+    fundos = _lista_fundos(fundo_filter)
 
     # 1. Classificação
-    df_class, class_map, CODIGOS_OFICIAIS, SUB_NORM2CANON = load_classificacao(path_classif)
+    classif = load_classificacao(path_classif)
+
+    if as_of is not None:
+        snap = snapshots.resolver(snapshots_raiz, as_of)
+        m = metricas.passo("score", "2/9 financeiro")
+        print(f"[2/9] Lendo Financeiro do snapshot {snap['id']} ({snap['ts']})")
+        df_fin = preparar_fin(snapshots.ler(snapshots_raiz, snap, 'fin', fundos),
+                              origem=f"snapshot {snap['id']}")
+        m['linhas_out'] = len(df_fin)
+        m = metricas.passo("score", "3/9 tokens")
+        print(f"[3/9] Lendo Tokens COD do snapshot {snap['id']}")
+        df_tok = preparar_tokens(snapshots.ler(snapshots_raiz, snap, 'tok', fundos))
+        m['linhas_out'] = len(df_tok)
+    else:
+        # trava compartilhada: não lê no meio de uma transacao_master
+        with master_store.travar(Path(path_fin).parent, exclusiva=False):
+            # 2. Financeiro
+            df_fin = load_fin(path_fin, fundos=fundos)
+
+            # 3. Tokens
+            df_tok = load_tokens(path_tok, fundos=fundos)
+
+    return run_score_df(
+        df_fin, df_tok, classif,
+        saida_xlsx=saida_xlsx,
+        fundo_filter=fundo_filter,
+        drop_na_norm=drop_na_norm,
+        drop_na_score=drop_na_score,
+        scores_master_xlsx=scores_master_xlsx,
+        update_master_scores=update_master_scores,
+        scores_only=scores_only,
+        scores_out_xlsx=scores_out_xlsx,
+        scores_out_stats=scores_out_stats,
+        scores_cache=scores_cache,
+        engine=engine,
+        formato=formato,
+        debug_por_fundo=debug_por_fundo,
+        workers=workers,
+        historico=historico,
+    )
 
-    # 2. Financeiro
-    df_fin = load_fin(path_fin)
 
-    # 3. Tokens
-    df_tok = load_tokens(path_tok)
+def _lista_fundos(fundo_filter):
+    if fundo_filter is None:
+        return None
+    return [fundo_filter] if isinstance(fundo_filter, str) else list(fundo_filter)
+
+
+def run_score_df(df_fin: pd.DataFrame,
+                 df_tok: pd.DataFrame,
+                 classif: tuple,
+                 saida_xlsx: Path | None = None,
+                 fundo_filter: str | list | None = None,
+                 drop_na_norm: bool = False,
+                 drop_na_score: bool = False,
+                 scores_master_xlsx: Path | None = None,
+                 update_master_scores: bool = False,
+                 scores_only: bool = False,
+                 scores_out_xlsx: Path | None = None,
+                 scores_out_stats: bool = False,
+                 scores_cache: Path | None = None,
+                 engine: str = "colunar",
+                 formato: str = "xlsx",
+                 debug_por_fundo: Path | None = None,
+                 workers: int | None = None,
+                 historico: Path | None = None,
+                 resumo_console: bool = True):
+    """
+    Passos 4–9 sobre DataFrames já carregados (run_score / pipeline.py).
+    `classif` = retorno de load_classificacao; `df_tok` como em load_tokens
+    (frame largo ou dict CSR). `engine`: 'colunar' (tabela longa) ou
+    'matrix' (incidência esparsa, ver score_matriz.py). `formato` da saída
+    detalhada: xlsx (streaming), csv ou parquet (ver saida_score.py);
+    `debug_por_fundo`: pasta com um Debug_Linhas por fundo. `historico`:
+    SQLite append-only (historico_scores.py) onde a rodada é registrada; com
+    ele, o placar master vira exportação dos últimos scores. `resumo_console`
+    False omite a lista de scores por fundo no fim (servico_score).
+    """
+    df_class, class_map, CODIGOS_OFICIAIS, SUB_NORM2CANON, NOTAS_IDX, regras_hash = classif
+
+    # CSR: df_tok fica só com Fundo/Ativo (alinhamento); os tokens seguem no csr
+    csr = None
+    if isinstance(df_tok, dict):
+        csr = df_tok
+        df_tok = pd.DataFrame({'Fundo': csr['fundo'], 'Ativo': csr['ativo']})
 
     # 4. Opcional: filtrar fundo
-    if fundo_filter is not None:
-        print(f"[4/9] Filtrando fundo: {fundo_filter}")
-        df_fin = df_fin[df_fin['Fundo'] == fundo_filter].reset_index(drop=True)
-        df_tok = df_tok[df_tok['Fundo'] == fundo_filter].reset_index(drop=True)
+    fundos = _lista_fundos(fundo_filter)
+    if fundos is not None:
+        m = metricas.passo("score", "4/9 filtro", linhas_in=len(df_fin))
+        print(f"[4/9] Filtrando fundo(s): {', '.join(fundos)}")
+        df_fin = df_fin[df_fin['Fundo'].isin(fundos)].reset_index(drop=True)
+        sel = df_tok['Fundo'].isin(fundos).to_numpy()
+        df_tok = df_tok[sel].reset_index(drop=True)
+        if csr is not None:
+            csr = tokens_csr.filtrar(csr, sel)
+        m['linhas_out'] = len(df_fin)
 
     # 5. Checar alinhamento
     if len(df_fin) != len(df_tok):
@@ -280,14 +541,38 @@ def run_score(path_fin: Path,
             "Certifique-se de ter atualizado o MASTER e re-rodado limpeza/mapear."
         )
 
+    gcols = [c for c in df_tok.columns if c.startswith('G')]
+
+    # Incremental: só fundos com fingerprint novo/alterado
+    cache = None
+    if scores_cache is not None:
+        m = metricas.passo("score", "incremental (fingerprints)", linhas_in=len(df_fin))
+        tok_fp = tokens_csr.para_largo(csr) if csr is not None else df_tok
+        fps = fingerprints_score(
+            df_fin, tok_fp, [c for c in tok_fp.columns if c.startswith('G')],
+            extra=incremental.extra_etapa(regras_hash, Path(__file__), drop_na_norm, drop_na_score),
+        )
+        cache = ler_cache_scores(scores_cache)
+        if cache is None:
+            fundos_recalc = list(fps)
+        else:
+            fp_cache = dict(zip(cache['Fundo'], cache['_fp']))
+            fundos_recalc = [f for f, fp in fps.items() if fp_cache.get(f) != fp]
+        print(f"      {incremental.resumo(fundos_recalc, fps)}")
+        df_fin = df_fin[incremental.linhas_de(df_fin, fundos_recalc)].reset_index(drop=True)
+        sel = incremental.linhas_de(df_tok, fundos_recalc)
+        df_tok = df_tok[sel].reset_index(drop=True)
+        if csr is not None:
+            csr = tokens_csr.filtrar(csr, sel)
+        m['linhas_out'] = len(df_fin)
+
     # Criar índice incremental por fundo para merge 1:1
+    m = metricas.passo("score", "5/9 merge", linhas_in=len(df_fin))
     df_fin = df_fin.copy()
     df_tok = df_tok.copy()
     df_fin['_row'] = df_fin.groupby('Fundo').cumcount()
     df_tok['_row'] = df_tok.groupby('Fundo').cumcount()
 
-    gcols = [c for c in df_tok.columns if c.startswith('G')]
-
     print(f"[5/9] Fazendo merge financeiro × tokens (1:1 por Fundo/_row)...")
     df_all = df_fin.merge(
         df_tok[['Fundo','_row'] + gcols],
@@ -295,74 +580,125 @@ def run_score(path_fin: Path,
         how='left',
         validate='1:1'
     ).drop(columns=['_row'])
+    m['linhas_out'] = len(df_all)
 
     # 6. Extrair codes/subs + Nota
+    m = metricas.passo("score", "6/9 notas", linhas_in=len(df_all))
     print(f"[6/9] Extraindo codes/subs e calculando Nota por linha...")
-    codes_subs = df_tok.apply(
-        lambda r: extract_codes_subs(r, gcols, CODIGOS_OFICIAIS, SUB_NORM2CANON),
-        axis=1,
-        result_type='expand'
-    )
-    codes_subs.columns = ['codes','subs']
-    df_all['codes'] = codes_subs['codes'].values
-    df_all['subs']  = codes_subs['subs'].values
-
-    df_all['Nota_calculada'] = df_all.apply(
-        lambda r: nota_para_linha(r['codes'], r['subs'], class_map),
-        axis=1
-    )
+    if engine == 'matrix':
+        csr_m = csr if csr is not None else tokens_csr.de_largo(df_tok[['Fundo','Ativo'] + gcols])
+        res_m = score_matriz.notas_matriz(csr_m, CODIGOS_OFICIAIS, SUB_NORM2CANON, NOTAS_IDX)
+        df_all['Nota_calculada'] = res_m['nota']
+        for c in ('n_codes', 'n_subs', 'n_tok', 'n_ruido', 'fallback'):
+            df_all['_' + c] = res_m[c]
+        long = None
+        if not scores_only:   # listas codes/subs só para o Debug_Linhas
+            long = classificar_csr(csr_m, CODIGOS_OFICIAIS, SUB_NORM2CANON)
+    else:
+        if csr is not None:
+            long = classificar_csr(csr, CODIGOS_OFICIAIS, SUB_NORM2CANON)
+        else:
+            long = classificar_tokens(df_tok, gcols, CODIGOS_OFICIAIS, SUB_NORM2CANON)
+        df_all['Nota_calculada'], df_all['_fallback'] = notas_colunar_detalhe(long, len(df_tok), NOTAS_IDX)
+        df_all['_n_tok'], df_all['_n_ruido'] = contagens_longo(long, len(df_tok))
+    if long is not None:
+        codes, subs = codes_subs_colunar(long, len(df_tok))
+        df_all['codes'] = codes.values
+        df_all['subs']  = subs.values
+        if engine != 'matrix':
+            df_all['_n_codes'] = codes.map(len).to_numpy()
+            df_all['_n_subs'] = subs.map(len).to_numpy()
+
+    m['linhas_out'] = len(df_all)
 
     # 7. Score
+    m = metricas.passo("score", "7/9 score", linhas_in=len(df_all))
     print(f"[7/9] Agregando Score por Fundo...")
-    scores = calcular_scores(df_all, drop_na_score=drop_na_score, drop_na_norm=drop_na_norm)
+    if engine == 'matrix':
+        scores = score_matriz.scores_matriz(df_all['Fundo'], df_all['Norm.'], df_all['Nota_calculada'],
+                                            drop_na_score=drop_na_score, drop_na_norm=drop_na_norm)
+    else:
+        scores = calcular_scores(df_all, drop_na_score=drop_na_score, drop_na_norm=drop_na_norm)
     df_scores = scores.reset_index()
+    m['linhas_out'] = len(df_scores)
 
     # 8. Stats e Debug
+    m = metricas.passo("score", "8/9 stats/debug", linhas_in=len(df_all))
     print(f"[8/9] Montando Stats/Debug...")
     df_debug = None
-    if not scores_only:
+    if not scores_only or debug_por_fundo is not None:
+        if csr is not None:
+            df_tok = tokens_csr.para_largo(csr)
+            gcols = [c for c in df_tok.columns if c.startswith('G')]
         df_debug = build_debug_df(df_fin, df_tok, df_all, gcols)
 
     # Stats sempre (para QC / export)
-    stats_rows = []
-    for f, g in df_all.groupby('Fundo', sort=False):
-        stats_rows.append({
-            'Fundo': f,
-            'Linhas': len(g),
-            'Sem_codes': (g['codes'].apply(len) == 0).sum(),
-            'Sem_subs':  (g['subs'].apply(len) == 0).sum(),
-            'Nota_calc_NaN': g['Nota_calculada'].isna().sum(),
-            'Soma_Norm': g['Norm.'].sum(),
-            'Score_calc': scores.loc[f] if f in scores.index else np.nan,
-        })
-    df_stats = pd.DataFrame(stats_rows)
-
-    # 9. Atualizar placar master, se pedido
+    df_stats = calcular_stats(df_all, scores)
+
+    if scores_cache is not None:
+        df_scores, df_stats, novo_cache = mesclar_cache_scores(
+            cache, df_scores, df_stats, fps, fundos_recalc, selecao=fundos)
+        novo_cache.to_csv(scores_cache, index=False)
+        print(f"      Cache de scores atualizado: {scores_cache}")
+    m['linhas_out'] = len(df_debug) if df_debug is not None else len(df_stats)
+
+    # 9. Histórico / placar master, se pedido
+    if historico is not None:
+        # só fundos calculados nesta rodada (no incremental, os do cache não mudaram)
+        metricas.passo("score", "9/9 histórico", linhas_in=len(df_scores))
+        if update_master_scores and scores_master_xlsx is not None:
+            # histórico novo/parcial: traz antes os fundos que só o placar acumulado tem
+            sem = historico_scores.semear_placar(historico, scores_master_xlsx)
+            if sem is not None:
+                print(f"[9/9] Histórico semeado com {sem['gravados']} fundo(s) de {scores_master_xlsx}")
+        master_hashes = incremental.fingerprints(df_fin, ['Fundo','Ativo','%PL','Norm.','Garantia'])
+        reg = historico_scores.gravar_rodada(
+            historico,
+            df_scores[df_scores['Fundo'].isin(master_hashes)],
+            df_stats[df_stats['Fundo'].isin(master_hashes)],
+            regras_hash=regras_hash,
+            master_hashes=master_hashes,
+            origem='score_app',
+        )
+        print(f"[9/9] Histórico {historico}: rodada {reg['rodada']}, "
+              f"{reg['gravados']} fundo(s) gravado(s), {reg['iguais']} sem mudança")
+
     if update_master_scores and scores_master_xlsx is not None:
+        metricas.passo("score", "9/9 placar master", linhas_in=len(df_scores))
         print(f"[9/9] Atualizando placar master em {scores_master_xlsx} ...")
-        update_scores_master(
-            df_scores_new=df_scores,
-            path_master=scores_master_xlsx,
-            replace=True,
-            sort_by="Fundo"
-        )
+        if historico is not None:
+            historico_scores.exportar_placar(historico, scores_master_xlsx)
+            print(f"    [OK] Placar master exportado do histórico: {scores_master_xlsx}")
+        else:
+            update_scores_master(
+                df_scores_new=df_scores,
+                path_master=scores_master_xlsx,
+                replace=True,
+                sort_by="Fundo"
+            )
 
     # ------------------------------------------------------------------
     # Workbook detalhado desta rodada
     # ------------------------------------------------------------------
     if saida_xlsx is not None:
-        engine_name = _pick_excel_engine()
-        with pd.ExcelWriter(saida_xlsx, engine=engine_name) as xlw:
-            df_scores.to_excel(xlw, sheet_name='Scores', index=False)
-            if not scores_only:
-                df_debug.to_excel(xlw, sheet_name='Debug_Linhas', index=False)
-            df_stats.to_excel(xlw, sheet_name='Stats', index=False)
-        print(f"✅ Workbook detalhado salvo em: {saida_xlsx}")
+        abas = [('Scores', df_scores)]
+        if not scores_only:
+            abas.append(('Debug_Linhas', df_debug))
+        abas.append(('Stats', df_stats))
+        metricas.passo("score", f"saída detalhada ({formato})", linhas_in=sum(len(df) for _, df in abas))
+        gravados = saida_score.gravar_abas(saida_xlsx, abas, formato)
+        print(f"✅ Saída detalhada salva em: {', '.join(map(str, gravados))}")
+
+    if debug_por_fundo is not None:
+        metricas.passo("score", "debug por fundo", linhas_in=len(df_debug))
+        arqs = saida_score.gravar_debug_por_fundo(debug_por_fundo, df_debug, formato, workers)
+        print(f"✅ Debug por fundo: {len(arqs)} arquivo(s) em {debug_por_fundo}")
 
     # ------------------------------------------------------------------
     # Placar enxuto desta rodada
     # ------------------------------------------------------------------
     if scores_out_xlsx is not None:
+        metricas.passo("score", "placar enxuto", linhas_in=len(df_scores))
         export_scores_xlsx(
             path_out=scores_out_xlsx,
             df_scores=df_scores,
@@ -370,10 +706,13 @@ def run_score(path_fin: Path,
             include_stats=scores_out_stats
         )
 
+    metricas.fim_passos("score")
+
     # Resumo console
-    print("\n─── Scores por Fundo ───")
-    for _, row in df_scores.iterrows():
-        print(f"{row['Fundo']}: {row['Score_Garantia']:.2f}")
+    if resumo_console:
+        print("\n─── Scores por Fundo ───")
+        for _, row in df_scores.iterrows():
+            print(f"{row['Fundo']}: {row['Score_Garantia']:.2f}")
 
     return {
         'scores': df_scores,
@@ -388,15 +727,18 @@ def run_score(path_fin: Path,
 def main():
     ap = argparse.ArgumentParser(description="Calcula Score Garantia (sem Nota humana).")
     ap.add_argument("--fin",        default="data/df_tidy_simp_MASTER.csv",
-                    help="CSV financeiro MASTER.")
+                    help="CSV financeiro MASTER (ou store particionado, ver master_store.py).")
     ap.add_argument("--tok",        default="data/garantias_cod_MASTER.csv",
-                    help="CSV tokens codificados MASTER.")
+                    help="Tokens codificados MASTER (CSV largo ou .npz CSR).")
     ap.add_argument("--classif",    default="data/Estudo_de_Garantias_v3.xlsx",
                     help="Planilha Classificação.")
     ap.add_argument("--saida-xlsx", default="score_garantia_MASTER_debug.xlsx",
                     help="Arquivo XLSX detalhado (Scores + Debug + Stats). Use '' para pular.")
     ap.add_argument("--fundo",      default=None,
                     help="Filtrar um único fundo (ticker).")
+    ap.add_argument("--fundos",     default=None,
+                    help="Lista de fundos separados por vírgula (ex.: A,B,C). Só as linhas "
+                         "deles são lidas dos MASTER (partições do store / índice de bytes do CSV).")
 
     ap.add_argument("--drop-na-norm", action="store_true",
                     help="Drop linhas com Norm. NaN antes do score.")
@@ -408,6 +750,9 @@ def main():
                     help="Caminho do XLSX que mantém o placar cumulativo de scores por Fundo.")
     ap.add_argument("--update-master-scores", action="store_true",
                     help="Atualiza (ou cria) o placar master com o(s) score(s) calculado(s) nesta rodada.")
+    ap.add_argument("--historico", default=None,
+                    help="SQLite append-only de scores (historico_scores.py). Registra a rodada; com "
+                         "--update-master-scores o placar é exportado dele.")
 
     # Modo rápido: omitir Debug_Linhas
     ap.add_argument("--scores-only", action="store_true",
@@ -419,26 +764,67 @@ def main():
     ap.add_argument("--scores-out-stats", action="store_true",
                     help="Quando usado com --scores-out-xlsx, inclui sheet Stats.")
 
+    # Incremental
+    ap.add_argument("--incremental", action="store_true",
+                    help="Recalcula só fundos cujas linhas/tokens/regras mudaram; os demais vêm do cache. "
+                         "Debug_Linhas traz só os fundos recalculados.")
+    ap.add_argument("--scores-cache", default="data/scores_cache.csv",
+                    help="CSV de cache por fundo usado com --incremental.")
+
+    ap.add_argument("--engine", choices=["colunar", "matrix"], default="colunar",
+                    help="Motor da nota/score: 'colunar' (tabela longa) ou 'matrix' "
+                         "(incidência esparsa em blocos, requer scipy).")
+
+    # Formato das saídas
+    ap.add_argument("--format", dest="formato", choices=list(saida_score.FORMATOS), default="xlsx",
+                    help="Saída detalhada: xlsx (gravado em streaming) ou um arquivo por aba "
+                         "<saida>_<Aba>.csv/.parquet.")
+    ap.add_argument("--debug-por-fundo", default=None,
+                    help="Pasta onde gravar um Debug_Linhas por fundo (<Fundo>.<formato>), em paralelo.")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Processos p/ --debug-por-fundo (padrão: nº de CPUs).")
+
+    # Viagem no tempo
+    ap.add_argument("--as-of", default=None,
+                    help="Pontua os MASTER como estavam num snapshot (id ou data AAAA-MM-DD; "
+                         "vale o último até ela). Ignora --fin/--tok. Ver snapshots.py.")
+    ap.add_argument("--snapshots", default=str(snapshots.RAIZ_PADRAO),
+                    help="Pasta dos snapshots usada por --as-of.")
+
+    metricas.adicionar_argumentos(ap)
     args = ap.parse_args()
 
     saida_xlsx = None if args.saida_xlsx == '' else Path(args.saida_xlsx)
     scores_out_xlsx = Path(args.scores_out_xlsx) if args.scores_out_xlsx else None
     scores_master_xlsx = Path(args.scores_master_xlsx) if args.scores_master_xlsx else None
-
-    run_score(
-        path_fin=Path(args.fin),
-        path_tok=Path(args.tok),
-        path_classif=Path(args.classif),
-        saida_xlsx=saida_xlsx,
-        fundo_filter=args.fundo,
-        drop_na_norm=args.drop_na_norm,
-        drop_na_score=args.drop_na_score,
-        scores_master_xlsx=scores_master_xlsx,
-        update_master_scores=args.update_master_scores,
-        scores_only=args.scores_only,
-        scores_out_xlsx=scores_out_xlsx,
-        scores_out_stats=args.scores_out_stats,
-    )
+    fundos = [args.fundo] if args.fundo else []
+    if args.fundos:
+        fundos += [f.strip() for f in args.fundos.split(',') if f.strip()]
+    fundos = list(dict.fromkeys(fundos)) or None
+
+    with metricas.execucao("score_app", args):
+        run_score(
+            path_fin=Path(args.fin),
+            path_tok=Path(args.tok),
+            path_classif=Path(args.classif),
+            saida_xlsx=saida_xlsx,
+            fundo_filter=fundos,
+            drop_na_norm=args.drop_na_norm,
+            drop_na_score=args.drop_na_score,
+            scores_master_xlsx=scores_master_xlsx,
+            update_master_scores=args.update_master_scores,
+            scores_only=args.scores_only,
+            scores_out_xlsx=scores_out_xlsx,
+            scores_out_stats=args.scores_out_stats,
+            scores_cache=Path(args.scores_cache) if args.incremental else None,
+            engine=args.engine,
+            formato=args.formato,
+            debug_por_fundo=Path(args.debug_por_fundo) if args.debug_por_fundo else None,
+            workers=args.workers,
+            historico=Path(args.historico) if args.historico else None,
+            as_of=args.as_of,
+            snapshots_raiz=Path(args.snapshots),
+        )
 
 
 if __name__ == "__main__":
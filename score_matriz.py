@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+score_matriz.py
+---------------
+Motor matricial do score (score_app.py --engine matrix).
+
+Cada linha de carteira vira uma incidência esparsa linha × código (C) e
+linha × subclasse (S); a Classificação vira a matriz densa N[código, subclasse]
+de notas e o vetor m[código] com a melhor nota do código.
+
+  - nota da linha = max{N[c, s] : C[i, c] = S[i, s] = 1}; sem par válido cai em
+    max{m[c] : C[i, c] = 1}. O max mascarado sai por limiares: para cada nota
+    distinta v (decrescente), a linha "alcança" v se (C · [N >= v]) ⊙ S tem
+    algum termo não nulo.
+  - score do fundo = Σ Norm. × nota / 0.03, soma segmentada por fundo (bincount).
+
+As linhas são processadas em blocos direto do CSR de tokens (tokens_csr), sem
+montar a tabela longa inteira, então a memória fica limitada pelo tamanho do
+bloco. Resultado igual ao do motor colunar (scores iguais até arredondamento
+de ponto flutuante da soma).
+
+Requer scipy.
+"""
+
+import numpy as np
+import pandas as pd
+
+try:
+    import scipy.sparse as sp
+except ImportError:  # scipy é opcional: só o --engine matrix precisa
+    sp = None
+
+from texto import normalizar
+
+BLOCO_LINHAS = 500_000
+
+
+def _exigir_scipy():
+    if sp is None:
+        raise ImportError("--engine matrix requer scipy (pip install scipy).")
+
+
+# ------------------------------------------------------------------
+# Vocabulário de tokens → índices de código / subclasse
+# ------------------------------------------------------------------
+def classificar_vocab(vocab, CODIGOS_OFICIAIS, SUB_NORM2CANON, notas_idx):
+    """
+    Mesma regra de classificar_longo, aplicada a cada token distinto:
+    código (upper/strip) tem prioridade; senão subclasse por normalizar.
+    Retorna (id_codigo, id_sub) por token (-1 = não é), lista de códigos e de
+    subclasses normalizadas (as chaves de notas_idx['pares']).
+    """
+    sub_norm = notas_idx['sub_norm']
+    codigos, subs = {}, {}
+    id_cod = np.full(len(vocab), -1, dtype=np.int64)
+    id_sub = np.full(len(vocab), -1, dtype=np.int64)
+    for i, tok in enumerate(vocab):
+        if not isinstance(tok, str) or tok.strip() == '':
+            continue
+        t_up = tok.upper().strip()
+        if t_up in CODIGOS_OFICIAIS:
+            id_cod[i] = codigos.setdefault(t_up, len(codigos))
+            continue
+        canon = SUB_NORM2CANON.get(normalizar(tok))
+        if canon is not None:
+            s_n = sub_norm[canon] if canon in sub_norm else normalizar(canon)
+            id_sub[i] = subs.setdefault(s_n, len(subs))
+    return id_cod, id_sub, list(codigos), list(subs)
+
+
+def matriz_notas(codigos, subs_n, notas_idx):
+    """N[código, subclasse] (NaN = par sem nota) e m[código] (NaN = sem nota)."""
+    pares = notas_idx['pares']
+    N = np.full((len(codigos), len(subs_n)), np.nan)
+    for a, c in enumerate(codigos):
+        for b, s in enumerate(subs_n):
+            v = pares.get((c, s), np.nan)
+            if not np.isnan(v):
+                N[a, b] = v
+    m = np.array([notas_idx['max_codigo'].get(c, np.nan) for c in codigos], dtype=float)
+    return N, m
+
+
+def _incidencia(lin, col, n, k):
+    """Matriz binária n × k (duplicatas colapsadas)."""
+    ok = col >= 0
+    M = sp.csr_matrix((np.ones(int(ok.sum()), dtype=np.int8), (lin[ok], col[ok])), shape=(n, k))
+    M.sum_duplicates()
+    M.data[:] = 1
+    return M
+
+
+def _soma_por_linha(flag_vocab, csr) -> np.ndarray:
+    """Nº de tokens da linha com flag_vocab[id] verdadeiro (cumsum + offsets)."""
+    acum = np.zeros(len(csr['ids']) + 1, dtype=np.int64)
+    np.cumsum(flag_vocab[csr['ids']], out=acum[1:])
+    return acum[csr['offsets'][1:]] - acum[csr['offsets'][:-1]]
+
+
+def _max_por_limiar(alcanca, valores, n):
+    """max v tal que alcanca(v) é True na linha; NaN se nenhum."""
+    out = np.full(n, np.nan)
+    for v in valores:               # decrescente: o 1º que alcança é o máximo
+        livre = np.isnan(out)
+        if not livre.any():
+            break
+        out[livre & alcanca(v)] = v
+    return out
+
+
+# ------------------------------------------------------------------
+# Incidências por bloco de linhas
+# ------------------------------------------------------------------
+def incidencias(csr: dict, id_cod, id_sub, k_cod: int, k_sub: int,
+                bloco: int = BLOCO_LINHAS):
+    """Gera (ini, fim, C, S) para cada bloco de linhas do CSR."""
+    _exigir_scipy()
+    offsets = csr['offsets']
+    n = len(offsets) - 1
+    for ini in range(0, n, bloco):
+        fim = min(ini + bloco, n)
+        o = offsets[ini:fim + 1]
+        lin = np.repeat(np.arange(fim - ini), np.diff(o))
+        ids = csr['ids'][o[0]:o[-1]]
+        yield (ini, fim,
+               _incidencia(lin, id_cod[ids], fim - ini, k_cod),
+               _incidencia(lin, id_sub[ids], fim - ini, k_sub))
+
+
+# ------------------------------------------------------------------
+# Nota por linha
+# ------------------------------------------------------------------
+def notas_matriz(csr: dict, CODIGOS_OFICIAIS, SUB_NORM2CANON, notas_idx,
+                 bloco: int = BLOCO_LINHAS) -> dict:
+    """
+    CSR de tokens → {'nota', 'n_codes', 'n_subs', 'n_tok', 'n_ruido', 'fallback'}
+    por linha (mesma ordem do CSR). n_tok conta tokens não vazios; n_ruido, os
+    que não são código nem subclasse; fallback marca nota vinda só do código.
+    """
+    _exigir_scipy()
+    id_cod, id_sub, codigos, subs_n = classificar_vocab(
+        csr['vocab'], CODIGOS_OFICIAIS, SUB_NORM2CANON, notas_idx)
+    N, m = matriz_notas(codigos, subs_n, notas_idx)
+    vals_par = np.unique(N[~np.isnan(N)])[::-1]
+    vals_cod = np.unique(m[~np.isnan(m)])[::-1]
+    # [N >= v] e [m >= v] esparsas, uma por nota distinta
+    lim_par = {v: sp.csr_matrix(np.nan_to_num(N, nan=-np.inf) >= v, dtype=np.int8) for v in vals_par}
+    lim_cod = {v: (np.nan_to_num(m, nan=-np.inf) >= v).astype(np.int8) for v in vals_cod}
+
+    n = len(csr['offsets']) - 1
+    nota = np.full(n, np.nan)
+    fallback = np.zeros(n, dtype=bool)
+    n_codes = np.zeros(n, dtype=np.int64)
+    n_subs = np.zeros(n, dtype=np.int64)
+
+    # contagens de tokens por linha (por token do vocabulário: vazio / ruído)
+    valido = np.array([isinstance(t, str) and t.strip() != '' for t in csr['vocab']], dtype=bool)
+    ruido = valido & (id_cod < 0) & (id_sub < 0)
+    n_tok = _soma_por_linha(valido, csr)
+    n_ruido = _soma_por_linha(ruido, csr)
+
+    for ini, fim, C, S in incidencias(csr, id_cod, id_sub, len(codigos), len(subs_n), bloco):
+        n_codes[ini:fim] = C.getnnz(axis=1)
+        n_subs[ini:fim] = S.getnnz(axis=1)
+
+        par = _max_por_limiar(
+            lambda v: np.asarray((C @ lim_par[v]).multiply(S).sum(axis=1)).ravel() > 0,
+            vals_par, fim - ini)
+        cod = _max_por_limiar(lambda v: (C @ lim_cod[v]) > 0, vals_cod, fim - ini)
+        nota[ini:fim] = np.where(np.isnan(par), cod, par)
+        fallback[ini:fim] = np.isnan(par) & ~np.isnan(cod)
+
+    return {'nota': nota, 'n_codes': n_codes, 'n_subs': n_subs,
+            'n_tok': n_tok, 'n_ruido': n_ruido, 'fallback': fallback}
+
+
+# ------------------------------------------------------------------
+# Assinaturas (conjunto de códigos, conjunto de subclasses) por linha
+# ------------------------------------------------------------------
+def assinaturas(csr: dict, CODIGOS_OFICIAIS, SUB_NORM2CANON, notas_idx,
+                bloco: int = BLOCO_LINHAS) -> dict:
+    """
+    Deduplica as linhas pela assinatura (códigos, subclasses): a nota de uma
+    linha só depende dela. Retorna {'sig': id da assinatura por linha,
+    'codes': bool J × códigos, 'subs': bool J × subclasses, 'codigos', 'subs_n'}.
+    """
+    id_cod, id_sub, codigos, subs_n = classificar_vocab(
+        csr['vocab'], CODIGOS_OFICIAIS, SUB_NORM2CANON, notas_idx)
+    k_cod = len(codigos)
+    n = len(csr['offsets']) - 1
+    sig = np.empty(n, dtype=np.int64)
+    vistas = {}          # bytes da assinatura → id
+    linhas = []
+    for ini, fim, C, S in incidencias(csr, id_cod, id_sub, k_cod, len(subs_n), bloco):
+        M = np.hstack([C.toarray(), S.toarray()]).astype(bool)
+        chaves = np.packbits(M, axis=1)
+        uniq, prim, inv = np.unique(chaves, axis=0, return_index=True, return_inverse=True)
+        ids = np.empty(len(uniq), dtype=np.int64)
+        for j, u in enumerate(uniq):
+            b = u.tobytes()
+            if b not in vistas:
+                vistas[b] = len(vistas)
+                linhas.append(M[prim[j]])
+            ids[j] = vistas[b]
+        sig[ini:fim] = ids[inv.ravel()]
+    M = np.array(linhas, dtype=bool).reshape(len(linhas), k_cod + len(subs_n))
+    return {'sig': sig, 'codes': M[:, :k_cod], 'subs': M[:, k_cod:],
+            'codigos': codigos, 'subs_n': subs_n}
+
+
+# ------------------------------------------------------------------
+# Score por fundo (soma segmentada)
+# ------------------------------------------------------------------
+def scores_matriz(fundo, norm, nota,
+                  drop_na_score: bool = False,
+                  drop_na_norm: bool = False) -> pd.Series:
+    """Equivalente a calcular_scores: Σ Norm. × nota / 0.03 por fundo, na ordem de aparição."""
+    norm = np.asarray(norm, dtype=float)
+    nota = np.asarray(nota, dtype=float)
+    ids, fundos = pd.factorize(pd.Series(fundo), sort=False)
+    manter = ids >= 0
+    if drop_na_norm:
+        manter &= ~np.isnan(norm)
+    if drop_na_score:
+        manter &= ~np.isnan(nota)
+    prod = np.nan_to_num(norm * nota, nan=0.0)
+    soma = np.bincount(ids[manter], weights=prod[manter], minlength=len(fundos))
+    s = pd.Series(soma / 0.03, index=pd.Index(fundos, name='Fundo'), name='Score_Garantia')
+    # fundo sem nenhuma linha mantida some do placar, como no groupby
+    return s.iloc[pd.unique(ids[manter])]
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+servico_score.py
+----------------
+Serviço local de score "quente": carrega Classificação, MASTER financeiro e
+tokens uma vez, roda o score_app.run_score_df completo e responde consultas
+por fundo direto da memória (JSON sobre HTTP, em localhost ou socket Unix).
+
+Rotas (GET):
+  /scores[?fundo=A,B]   placar (todos os fundos ou os pedidos)
+  /stats[?fundo=A,B]    Stats por fundo
+  /debug?fundo=A[,B]    linhas de Debug_Linhas (codes, subs, nota, G1..Gn);
+                        sem fundo → 400
+  /fundos               lista de fundos carregados
+  /status               arquivos, mtimes, hora da carga, nº de linhas
+  /reload               força recarga
+
+Hot reload: uma thread verifica a cada --intervalo segundos o mtime/tamanho
+de --fin, --tok e --classif (no store particionado, o manifest.json). Se
+algo mudou, recalcula tudo em segundo plano e troca o estado de uma vez; as
+consultas continuam servindo o estado anterior enquanto isso. Se a recarga
+falhar (ex.: arquivo no meio de uma gravação), o estado anterior é mantido e
+o erro aparece em /status.
+
+Uso:
+    python servico_score.py --porta 8765
+    curl 'http://127.0.0.1:8765/scores?fundo=MXRF11'
+    python servico_score.py --socket /tmp/score.sock
+    curl --unix-socket /tmp/score.sock 'http://x/debug?fundo=MXRF11'
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import master_store
+import score_app
+
+
+# ------------------------------------------------------------------
+# Estado em memória
+# ------------------------------------------------------------------
+def assinatura_arquivo(path: Path):
+    """(mtime_ns, tamanho) do arquivo; no store, do manifest.json."""
+    path = Path(path)
+    if master_store.eh_store(path):
+        path = path / master_store.MANIFEST
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def carregar_estado(fin: Path, tok: Path, classif: Path, engine: str = "colunar") -> dict:
+    """Roda o score completo e indexa as linhas de debug por fundo."""
+    t0 = time.perf_counter()
+    arquivos = {'fin': Path(fin), 'tok': Path(tok), 'classif': Path(classif)}
+
+    classif_t = score_app.load_classificacao(arquivos['classif'])
+    # trava compartilhada: não lê (nem assina) no meio de uma transacao_master
+    with master_store.travar(arquivos['fin'].parent, exclusiva=False):
+        assinaturas = {k: assinatura_arquivo(p) for k, p in arquivos.items()}
+        df_fin = score_app.load_fin(arquivos['fin'])
+        df_tok = score_app.load_tokens(arquivos['tok'])
+    res = score_app.run_score_df(df_fin, df_tok, classif_t, saida_xlsx=None,
+                                 scores_only=False, engine=engine, resumo_console=False)
+
+    debug = res['debug']
+    return {
+        'arquivos': arquivos,
+        'assinaturas': assinaturas,
+        'engine': engine,
+        'scores': res['scores'].set_index('Fundo', drop=False),
+        'stats': res['stats'].set_index('Fundo', drop=False),
+        'debug': debug,
+        'linhas': debug.groupby('Fundo', sort=False).indices,
+        'carregado_em': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'segundos_carga': round(time.perf_counter() - t0, 3),
+    }
+
+
+def mudou(estado: dict) -> bool:
+    return any(assinatura_arquivo(p) != estado['assinaturas'][k]
+               for k, p in estado['arquivos'].items())
+
+
+def novo_servico(fin, tok, classif, engine="colunar") -> dict:
+    """Estado atual + o necessário p/ recarregar (o handler só lê ['estado'])."""
+    params = (fin, tok, classif, engine)
+    return {'params': params, 'estado': carregar_estado(*params),
+            'erro_recarga': None, 'lock': threading.Lock()}
+
+
+def recarregar(servico: dict, forcar: bool = False) -> bool:
+    with servico['lock']:
+        if not forcar and not mudou(servico['estado']):
+            return False
+        print("[servico] Artefatos alterados: recarregando...")
+        try:
+            novo = carregar_estado(*servico['params'])
+        except Exception as e:  # mantém o estado anterior
+            servico['erro_recarga'] = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            return False
+        servico['estado'] = novo
+        servico['erro_recarga'] = None
+        print(f"[servico] Recarregado em {novo['segundos_carga']}s")
+        return True
+
+
+def vigiar(servico: dict, intervalo: float):
+    while True:
+        time.sleep(intervalo)
+        recarregar(servico)
+
+
+# ------------------------------------------------------------------
+# Consultas
+# ------------------------------------------------------------------
+def _fundos_pedidos(qs: dict):
+    v = qs.get('fundo')
+    if not v:
+        return None
+    return [f.strip() for item in v for f in item.split(',') if f.strip()]
+
+
+def _registros(df: pd.DataFrame) -> list:
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+def consultar(estado: dict, rota: str, qs: dict, erro_recarga=None):
+    """Retorna (status HTTP, corpo) para a rota pedida."""
+    fundos = _fundos_pedidos(qs)
+    if fundos is not None:
+        faltando = [f for f in fundos if f not in estado['scores'].index]
+        if faltando:
+            return 404, {'erro': f"fundo(s) não encontrado(s): {', '.join(faltando)}"}
+
+    if rota in ('/scores', '/stats'):
+        df = estado[rota[1:]]
+        return 200, _registros(df.loc[fundos] if fundos else df)
+    if rota == '/debug':
+        if fundos is None:
+            # Debug_Linhas inteiro num corpo só não é consulta: exige o fundo
+            return 400, {'erro': "/debug exige ?fundo=A[,B]"}
+        pos = [i for f in fundos for i in estado['linhas'].get(f, [])]
+        return 200, _registros(estado['debug'].iloc[pos])
+    if rota == '/fundos':
+        return 200, list(estado['scores'].index)
+    if rota == '/status':
+        return 200, {
+            'arquivos': {k: str(p) for k, p in estado['arquivos'].items()},
+            'assinaturas': estado['assinaturas'],
+            'engine': estado['engine'],
+            'carregado_em': estado['carregado_em'],
+            'segundos_carga': estado['segundos_carga'],
+            'fundos': len(estado['scores']),
+            'linhas': len(estado['debug']),
+            'erro_recarga': erro_recarga,
+        }
+    return 404, {'erro': f"rota desconhecida: {rota}"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    servico: dict = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/reload':
+            recarregar(self.servico, forcar=True)
+            url = url._replace(path='/status')
+        status, corpo = consultar(self.servico['estado'], url.path, parse_qs(url.query),
+                                  self.servico['erro_recarga'])
+        dados = json.dumps(corpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def address_string(self):
+        # socket Unix não tem (host, porta)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+
+class _ServidorUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Serviço local de score com dados em memória e hot reload.")
+    ap.add_argument("--fin",     default="data/df_tidy_simp_MASTER.csv",
+                    help="CSV financeiro MASTER (ou store particionado).")
+    ap.add_argument("--tok",     default="data/garantias_cod_MASTER.csv",
+                    help="Tokens codificados MASTER (CSV largo ou .npz CSR).")
+    ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
+                    help="Planilha Classificação.")
+    ap.add_argument("--engine", choices=["colunar", "matrix"], default="colunar",
+                    help="Motor do score (ver score_app.py --engine).")
+    ap.add_argument("--host", default="127.0.0.1", help="Endereço HTTP (padrão: só localhost).")
+    ap.add_argument("--porta", type=int, default=8765, help="Porta HTTP.")
+    ap.add_argument("--socket", default=None,
+                    help="Caminho de socket Unix (substitui --host/--porta).")
+    ap.add_argument("--intervalo", type=float, default=2.0,
+                    help="Segundos entre verificações de mtime p/ hot reload (0 = desligado).")
+    args = ap.parse_args()
+
+    servico = novo_servico(Path(args.fin), Path(args.tok), Path(args.classif), args.engine)
+    _Handler.servico = servico
+    if args.intervalo > 0:
+        threading.Thread(target=vigiar, args=(servico, args.intervalo), daemon=True).start()
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        httpd = _ServidorUnix(args.socket, _Handler)
+        onde = f"unix:{args.socket}"
+    else:
+        httpd = ThreadingHTTPServer((args.host, args.porta), _Handler)
+        onde = f"http://{args.host}:{args.porta}"
+    print(f"[servico] {len(servico['estado']['scores'])} fundos em memória "
+          f"(carga {servico['estado']['segundos_carga']}s). Ouvindo em {onde}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+snapshots.py
+------------
+Snapshots versionados dos MASTER (financeiro, garantias limpas, tokens), por
+conteúdo e por fundo, para reconstituir o que um fundo tinha (e pontuava)
+numa data passada sem reingerir relatórios antigos.
+
+    data/snapshots/
+        objetos/3f/3fa9...e1.parquet     # partição de um fundo, nomeada pelo hash
+        snapshots/20261017T101500.json   # o que compõe cada snapshot
+
+Cada snapshot lista, por artefato, os fundos e o hash do conteúdo de cada
+partição. Partições iguais têm o mesmo hash e apontam para o mesmo objeto:
+um fundo que não mudou entre dois snapshots não ocupa espaço de novo, o
+custo de um snapshot é só o delta (mais o JSON). Do CSV, cada fundo é
+guardado só com as colunas que usa (os G1..Gk dele) e tipos normalizados:
+um fundo novo com mais tokens, que alarga o MASTER inteiro, não muda o hash
+dos outros.
+
+Os MASTER são lidos como o score_app lê (CSV; tokens com dtype=str; store
+particionado e .npz também servem). No store, o hash do manifest é
+reaproveitado: partições já guardadas nem são abertas.
+
+--as-of aceita o id do snapshot ou uma data/hora (AAAA-MM-DD[THH:MM:SS]); no
+segundo caso vale o último snapshot até ela.
+
+Uso:
+    python snapshots.py criar --rotulo "pos-ingest 3T26"
+    python snapshots.py listar
+    python snapshots.py diff 20260630T180000 20260930T180000 [--artefato fin] [--csv diff.csv]
+    python snapshots.py remover 20260101T000000
+    python score_app.py --as-of 2026-06-30 --scores-only --saida-xlsx score_2T26.xlsx
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import master_store
+import tokens_csr
+
+RAIZ_PADRAO = Path("data/snapshots")
+OBJETOS = "objetos"
+SNAPS = "snapshots"
+
+# artefato → (MASTER padrão, kwargs de leitura do CSV)
+ARTEFATOS = {
+    'fin':    ("data/df_tidy_simp_MASTER",    {}),
+    'limpas': ("data/garantias_limpas_MASTER", {}),
+    'tok':    ("data/garantias_cod_MASTER",    {'dtype': str}),
+}
+# chave das posições no diff
+CHAVE = ['Ativo']
+
+
+def _ts_limite(ate: str) -> str:
+    """'AAAA-MM-DD' vale até o fim do dia."""
+    return ate + "T23:59:59" if len(ate) == 10 else ate
+
+
+# ------------------------------------------------------------------
+# Objetos
+# ------------------------------------------------------------------
+def _objeto(raiz: Path, h: str) -> Path | None:
+    """Caminho do objeto `h` já guardado (parquet ou pickle), ou None."""
+    pasta = raiz / OBJETOS / h[:2]
+    for ext in ('.parquet', '.pkl'):
+        p = pasta / (h + ext)
+        if p.exists():
+            return p
+    return None
+
+
+def _guardar(raiz: Path, h: str, df: pd.DataFrame, formato: str) -> Path:
+    p = _objeto(raiz, h)
+    if p is not None:
+        return p
+    destino = raiz / OBJETOS / h[:2] / (h + ('.parquet' if formato == 'parquet' else '.pkl'))
+    return master_store._gravar_particao(destino, df, formato)
+
+
+def _normalizar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tipos que não dependem do resto do CSV: numérico → float64 (um NaN em
+    outro fundo não muda int para float), o resto → texto (vazios = NaN).
+    """
+    df = df.copy()
+    for c in df.columns:
+        v = df[c]
+        if pd.api.types.is_numeric_dtype(v) and not pd.api.types.is_bool_dtype(v):
+            df[c] = v.astype('float64')
+        else:
+            df[c] = v.astype(object).where(v.isna(), v.astype(str))
+    return df
+
+
+def _hashes_por_fundo(df: pd.DataFrame) -> dict:
+    """
+    {fundo: (hash, posições, colunas)} na ordem de aparição. Cada fundo é
+    aparado às suas colunas não vazias (G1..Gk dele, não o G1..Gn do MASTER)
+    e `df` deve vir de _normalizar: alargar o MASTER ou mudar o tipo inferido
+    pelo read_csv não muda o hash de quem não mudou. Um hash por coluna no
+    frame inteiro, como incremental._hash_tokens.
+    """
+    cols = list(df.columns)
+    cheio = df.notna().to_numpy()
+    hcols = np.stack([pd.util.hash_array(df[c].to_numpy()) for c in cols], axis=1) if cols else None
+    out = {}
+    for fundo, pos in df.groupby('Fundo', sort=False).indices.items():
+        usadas = np.flatnonzero(cheio[pos].any(axis=0))
+        h = hashlib.sha256("|".join(cols[k] for k in usadas).encode('utf-8'))
+        h.update(np.ascontiguousarray(np.where(cheio[pos][:, usadas], hcols[pos][:, usadas], 0)).tobytes())
+        out[fundo] = (h.hexdigest(), pos, [cols[k] for k in usadas])
+    return out
+
+
+def _snap_artefato(raiz: Path, origem: Path, kwargs: dict, formato: str) -> dict:
+    """Guarda as partições que faltam de um MASTER; retorna a entrada do snapshot."""
+    fundos = {}
+    if master_store.eh_store(origem):
+        man = master_store.ler_manifest(origem)
+        for f, info in man['fundos'].items():
+            p = _objeto(raiz, info['hash'])
+            if p is None:
+                df = master_store._ler_particao(origem / info['arquivo'])
+                p = _guardar(raiz, info['hash'], df, formato)
+            fundos[f] = {'hash': info['hash'], 'linhas': info['linhas'], 'arquivo': _rel(raiz, p)}
+        colunas = man['colunas']
+    else:
+        if tokens_csr.eh_csr(origem):
+            df = tokens_csr.ler_largo(origem)
+        else:
+            df = pd.read_csv(origem, **kwargs)
+        df = _normalizar(df)
+        for f, (h, pos, cols) in _hashes_por_fundo(df).items():
+            p = _objeto(raiz, h)
+            if p is None:
+                p = _guardar(raiz, h, df.iloc[pos][cols].reset_index(drop=True), formato)
+            fundos[f] = {'hash': h, 'linhas': int(len(pos)), 'arquivo': _rel(raiz, p)}
+        colunas = list(df.columns)
+    return {'origem': str(origem), 'colunas': colunas, 'fundos': fundos}
+
+
+def _rel(raiz: Path, p: Path) -> str:
+    return Path(p).relative_to(raiz).as_posix()
+
+
+# ------------------------------------------------------------------
+# Snapshots
+# ------------------------------------------------------------------
+def criar(raiz: Path = RAIZ_PADRAO, masters: dict | None = None, rotulo: str | None = None) -> dict:
+    """
+    Snapshot dos MASTER (`masters` = {artefato: caminho}; padrão: ARTEFATOS
+    que existirem). Só partições novas são gravadas. Retorna o snapshot.
+    Chamar sob master_store.travar (o CLI e a transacao_master já a tomam).
+    """
+    raiz = Path(raiz)
+    if masters is None:
+        masters = {a: master_store.resolver_master(base) for a, (base, _) in ARTEFATOS.items()}
+        masters = {a: p for a, p in masters.items() if p.exists()}
+    formato = master_store._pick_formato()
+
+    ts = time.strftime('%Y-%m-%dT%H:%M:%S')
+    snap_id = time.strftime('%Y%m%dT%H%M%S')
+    pasta = raiz / SNAPS
+    pasta.mkdir(parents=True, exist_ok=True)
+    n = 2
+    base_id = snap_id
+    while (pasta / f"{snap_id}.json").exists():
+        snap_id = f"{base_id}-{n}"
+        n += 1
+
+    snap = {'id': snap_id, 'ts': ts, 'rotulo': rotulo, 'artefatos': {}}
+    for art, origem in masters.items():
+        kwargs = ARTEFATOS.get(art, (None, {}))[1]
+        snap['artefatos'][art] = _snap_artefato(raiz, Path(origem), kwargs, formato)
+
+    master_store.escrever_atomico(
+        pasta / f"{snap_id}.json",
+        lambda tmp: Path(tmp).write_text(json.dumps(snap, ensure_ascii=False, indent=1), encoding='utf-8'),
+    )
+    return snap
+
+
+def listar(raiz: Path = RAIZ_PADRAO) -> list:
+    """Snapshots em ordem cronológica."""
+    pasta = Path(raiz) / SNAPS
+    snaps = [json.loads(p.read_text(encoding='utf-8')) for p in pasta.glob("*.json")]
+    return sorted(snaps, key=lambda s: (s['ts'], s['id']))
+
+
+def carregar(raiz: Path, snap_id: str) -> dict:
+    arq = Path(raiz) / SNAPS / f"{snap_id}.json"
+    if not arq.exists():
+        raise FileNotFoundError(f"Snapshot {snap_id} não encontrado em {Path(raiz) / SNAPS}")
+    return json.loads(arq.read_text(encoding='utf-8'))
+
+
+def resolver(raiz: Path, as_of: str) -> dict:
+    """Snapshot pelo id, ou o último com ts <= `as_of` (data/hora)."""
+    raiz = Path(raiz)
+    if (raiz / SNAPS / f"{as_of}.json").exists():
+        return carregar(raiz, as_of)
+    if not re.fullmatch(r'\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2})?)?', as_of):
+        raise ValueError(f"--as-of '{as_of}' não é id de snapshot nem data AAAA-MM-DD[THH:MM:SS].")
+    limite = _ts_limite(as_of)
+    anteriores = [s for s in listar(raiz) if s['ts'] <= limite]
+    if not anteriores:
+        raise FileNotFoundError(f"Nenhum snapshot em {raiz} até {as_of}.")
+    return anteriores[-1]
+
+
+def ler(raiz: Path, snap: dict, artefato: str, fundos=None) -> pd.DataFrame:
+    """MASTER `artefato` como estava no snapshot (só `fundos`, se informado)."""
+    raiz = Path(raiz)
+    if artefato not in snap['artefatos']:
+        raise KeyError(f"Snapshot {snap['id']} não tem o artefato '{artefato}'.")
+    ent = snap['artefatos'][artefato]
+    nomes = list(ent['fundos'])
+    if fundos is not None:
+        pedidos = set(fundos)
+        nomes = [f for f in nomes if f in pedidos]
+    partes = [master_store._ler_particao(raiz / ent['fundos'][f]['arquivo']) for f in nomes]
+    if not partes:
+        return pd.DataFrame(columns=ent['colunas'])
+    # objetos aparados (só as colunas não vazias do fundo): realarga
+    df = pd.concat(partes, ignore_index=True).reindex(columns=ent['colunas'])
+    if ARTEFATOS.get(artefato, (None, {}))[1].get('dtype') is str:
+        df = df.astype(object)
+    return df
+
+
+def remover(raiz: Path, snap_id: str) -> int:
+    """Apaga o snapshot e os objetos que nenhum outro usa. Retorna nº de objetos apagados."""
+    raiz = Path(raiz)
+    carregar(raiz, snap_id)
+    (raiz / SNAPS / f"{snap_id}.json").unlink()
+    usados = {e['arquivo'] for s in listar(raiz)
+              for a in s['artefatos'].values() for e in a['fundos'].values()}
+    apagados = 0
+    for p in (raiz / OBJETOS).glob("*/*"):
+        if _rel(raiz, p) not in usados:
+            p.unlink()
+            apagados += 1
+    return apagados
+
+
+# ------------------------------------------------------------------
+# Diff
+# ------------------------------------------------------------------
+def _iguais(a: pd.Series, b: pd.Series) -> np.ndarray:
+    return ((a == b) | (a.isna() & b.isna())).to_numpy()
+
+
+def diff(raiz: Path, de: dict, para: dict, artefato: str = 'fin', chave=None) -> pd.DataFrame:
+    """
+    Posições que mudaram entre dois snapshots, só nos fundos cujo hash
+    difere: [Fundo, <chave>, Situacao (incluida/removida/alterada), Mudancas].
+    Posições repetidas (mesma chave) são pareadas pela ordem no fundo.
+    """
+    chave = list(chave or CHAVE)
+    fa = de['artefatos'].get(artefato, {}).get('fundos', {})
+    fb = para['artefatos'].get(artefato, {}).get('fundos', {})
+    mudaram = [f for f in dict.fromkeys(list(fa) + list(fb))
+               if fa.get(f, {}).get('hash') != fb.get(f, {}).get('hash')]
+
+    colunas = ['Fundo'] + chave + ['Situacao', 'Mudancas']
+    if not mudaram:
+        return pd.DataFrame(columns=colunas)
+    a = ler(raiz, de, artefato, mudaram) if fa else pd.DataFrame(columns=['Fundo'] + chave)
+    b = ler(raiz, para, artefato, mudaram) if fb else pd.DataFrame(columns=['Fundo'] + chave)
+    for df in (a, b):
+        df['_n'] = df.groupby(['Fundo'] + chave, sort=False, dropna=False).cumcount()
+
+    m = a.merge(b, on=['Fundo'] + chave + ['_n'], how='outer', suffixes=('_de', '_para'),
+                indicator=True, sort=False)
+    valores = [c for c in dict.fromkeys(list(a.columns) + list(b.columns))
+               if c not in ['Fundo', '_n'] + chave]
+
+    mudancas = [[] for _ in range(len(m))]
+    for c in valores:
+        x = m[f"{c}_de"] if f"{c}_de" in m else pd.Series(np.nan, index=m.index)
+        y = m[f"{c}_para"] if f"{c}_para" in m else pd.Series(np.nan, index=m.index)
+        dif = ~_iguais(x, y) & (m['_merge'] == 'both').to_numpy()
+        for i in np.flatnonzero(dif):
+            mudancas[i].append(f"{c}: {x.iat[i]} → {y.iat[i]}")
+
+    m['Situacao'] = m['_merge'].map({'left_only': 'removida', 'right_only': 'incluida', 'both': 'alterada'})
+    m['Mudancas'] = ['; '.join(l) for l in mudancas]
+    m = m[(m['Situacao'] != 'alterada') | (m['Mudancas'] != '')]
+    return m[colunas].reset_index(drop=True)
+
+
+def resumo_diff(de: dict, para: dict, artefato: str = 'fin') -> dict:
+    """Contagem de fundos incluídos/removidos/alterados/iguais entre dois snapshots."""
+    fa = de['artefatos'].get(artefato, {}).get('fundos', {})
+    fb = para['artefatos'].get(artefato, {}).get('fundos', {})
+    return {
+        'incluidos': sorted(set(fb) - set(fa)),
+        'removidos': sorted(set(fa) - set(fb)),
+        'alterados': sorted(f for f in set(fa) & set(fb) if fa[f]['hash'] != fb[f]['hash']),
+        'iguais':    sum(1 for f in set(fa) & set(fb) if fa[f]['hash'] == fb[f]['hash']),
+    }
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Snapshots por conteúdo dos MASTER (por fundo).")
+    ap.add_argument("--raiz", default=str(RAIZ_PADRAO), help="Pasta dos snapshots.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    c = sub.add_parser("criar", help="Snapshot dos MASTER atuais.")
+    c.add_argument("--rotulo", default=None)
+    for art, (base, _) in ARTEFATOS.items():
+        c.add_argument(f"--{art}", default=None,
+                       help=f"MASTER '{art}' (padrão: {base} ou {base}.csv).")
+
+    sub.add_parser("listar", help="Lista os snapshots.")
+
+    d = sub.add_parser("diff", help="Posições alteradas entre dois snapshots.")
+    d.add_argument("de", help="Id ou data/hora.")
+    d.add_argument("para", help="Id ou data/hora.")
+    d.add_argument("--artefato", choices=list(ARTEFATOS), default="fin")
+    d.add_argument("--csv", default=None, help="Salva o diff em CSV.")
+
+    r = sub.add_parser("remover", help="Apaga um snapshot (e objetos órfãos).")
+    r.add_argument("id")
+
+    args = ap.parse_args()
+    raiz = Path(args.raiz)
+
+    if args.cmd == "criar":
+        masters = None
+        explicitos = {a: getattr(args, a) for a in ARTEFATOS if getattr(args, a)}
+        if explicitos:
+            masters = {a: Path(p) for a, p in explicitos.items()}
+        # trava compartilhada: não fotografa uma transacao_master pela metade
+        fin = Path(explicitos.get('fin') or ARTEFATOS['fin'][0])
+        with master_store.travar(fin.parent, exclusiva=False):
+            snap = criar(raiz, masters=masters, rotulo=args.rotulo)
+        for art, ent in snap['artefatos'].items():
+            print(f"  {art:<7} {len(ent['fundos']):>5} fundos  ({ent['origem']})")
+        n_obj = sum(1 for _ in (raiz / OBJETOS).glob("*/*"))
+        print(f"[OK] Snapshot {snap['id']} criado ({n_obj} objetos no total em {raiz / OBJETOS})")
+    elif args.cmd == "listar":
+        for s in listar(raiz):
+            arts = ", ".join(f"{a}={len(e['fundos'])}" for a, e in s['artefatos'].items())
+            print(f"{s['id']:<20} {s['ts']}  {arts}  {s.get('rotulo') or ''}")
+    elif args.cmd == "diff":
+        a, b = resolver(raiz, args.de), resolver(raiz, args.para)
+        res = resumo_diff(a, b, args.artefato)
+        print(f"{a['id']} → {b['id']} ({args.artefato}): "
+              f"{len(res['incluidos'])} incluído(s), {len(res['removidos'])} removido(s), "
+              f"{len(res['alterados'])} alterado(s), {res['iguais']} igual(is)")
+        df = diff(raiz, a, b, args.artefato)
+        if args.csv:
+            df.to_csv(args.csv, index=False)
+            print(f"[OK] {len(df)} posição(ões) salvas em {args.csv}")
+        else:
+            with pd.option_context('display.max_rows', 200, 'display.width', 200,
+                                   'display.max_colwidth', 120):
+                print(df)
+    else:
+        n = remover(raiz, args.id)
+        print(f"[OK] Snapshot {args.id} removido ({n} objeto(s) órfão(s) apagado(s))")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+texto.py
+--------
+Normalização de texto compartilhada por classificacao, limpeza, mapear_codigo
+e score_app: lowercase, sem acento (unidecode), espaços colapsados.
+
+  - normalizar(s): escalar, com cache (lru) por string;
+  - normalizar_serie(serie): normaliza só os valores distintos e espalha de volta.
+
+A transliteração de caracteres latinos usa uma tabela pré-computada com o
+próprio unidecode caractere a caractere (str.translate); texto com outros
+caracteres cai no unidecode direto. O resultado é idêntico a
+    re.sub(r'\\s+', ' ', unidecode(s).lower()).strip()
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+# ASCII + Latin-1 + Latin Extended-A/B: cobre o português e quase todo o resto
+_LIMITE_TABELA = 0x250
+_TABELA = {i: unidecode(chr(i)) for i in range(128, _LIMITE_TABELA)}
+_MAX_TABELA = chr(_LIMITE_TABELA - 1)
+
+CACHE_MAX = 1 << 16
+
+
+def transliterar(s: str) -> str:
+    if s.isascii():
+        return s
+    if max(s) <= _MAX_TABELA:
+        return s.translate(_TABELA)
+    return unidecode(s)
+
+
+@lru_cache(maxsize=CACHE_MAX)
+def _normalizar_str(s: str) -> str:
+    # split()/join colapsa e apara os mesmos espaços que \s+ / strip()
+    return ' '.join(transliterar(s).lower().split())
+
+
+def normalizar(s: str) -> str:
+    """Lowercase, sem acento, espaços colapsados. Não-string volta como veio."""
+    if not isinstance(s, str):
+        return s
+    return _normalizar_str(s)
+
+
+def normalizar_serie(serie: pd.Series) -> pd.Series:
+    """normalizar sobre uma Series, uma chamada por valor distinto (NaN preservado)."""
+    cod, distintos = pd.factorize(serie)
+    if not len(distintos):
+        return serie.copy()
+    norm = np.empty(len(distintos) + 1, dtype=object)
+    norm[:-1] = [normalizar(v) for v in distintos]
+    norm[-1] = np.nan
+    out = pd.Series(norm[cod], index=serie.index, name=serie.name, dtype=object)
+    # valores ausentes voltam como estavam (None continua None)
+    falta = cod < 0
+    if falta.any():
+        out[falta] = serie[falta]
+    return out
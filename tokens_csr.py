@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+tokens_csr.py
+-------------
+Tokens por linha em formato CSR (compressed sparse row), no lugar do frame
+largo [Fundo, Ativo, G1..Gn]:
+
+    fundo, ativo : uma entrada por linha (strings; NaN preservado)
+    offsets      : int64, len = n_linhas + 1; tokens da linha i = ids[offsets[i]:offsets[i+1]]
+    ids          : int32, índice de cada token em `vocab`
+    vocab        : tokens distintos
+
+Em disco é um .npz (arrays numéricos + strings unicode, sem pickle). Uma
+linha verbosa não alarga as demais; o CSV largo segue disponível como
+exportação (para_largo / `python tokens_csr.py exportar`).
+
+limpeza.py, mapear_codigo.py e score_app.py escolhem o formato pela extensão
+do caminho (.npz = CSR, qualquer outra = CSV largo).
+
+Uso:
+    python tokens_csr.py importar data/garantias_cod_MASTER.csv data/garantias_cod_MASTER.npz
+    python tokens_csr.py exportar data/garantias_cod_MASTER.npz data/garantias_cod_MASTER.csv
+"""
+
+import argparse
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import master_store
+import metricas
+
+EXT = '.npz'
+
+
+def eh_csr(path) -> bool:
+    return Path(path).suffix.lower() == EXT
+
+
+def _gcols(df: pd.DataFrame) -> list:
+    return sorted((c for c in df.columns if re.fullmatch(r'G\d+', str(c))),
+                  key=lambda c: int(c[1:]))
+
+
+# ------------------------------------------------------------------
+# Conversões
+# ------------------------------------------------------------------
+def de_listas(fundo, ativo, listas) -> dict:
+    """Listas de tokens por linha → CSR."""
+    tam = np.fromiter((len(l) for l in listas), dtype=np.int64, count=len(listas))
+    offsets = np.zeros(len(listas) + 1, dtype=np.int64)
+    np.cumsum(tam, out=offsets[1:])
+    planos = [t for l in listas for t in l]
+    ids, vocab = pd.factorize(pd.Series(planos, dtype=object))
+    return {
+        'fundo':   np.asarray(fundo, dtype=object),
+        'ativo':   np.asarray(ativo, dtype=object),
+        'offsets': offsets,
+        'ids':     ids.astype(np.int32),
+        'vocab':   np.asarray(vocab, dtype=object),
+    }
+
+
+def de_largo(df: pd.DataFrame) -> dict:
+    """[Fundo, Ativo, G1..Gn] → CSR (tokens não vazios, na ordem das colunas)."""
+    gcols = _gcols(df)
+    n = len(df)
+    vals = df[gcols].to_numpy(dtype=object)
+    ok = pd.notna(vals) & (vals != '')
+    tam = ok.sum(axis=1)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(tam, out=offsets[1:])
+    ids, vocab = pd.factorize(pd.Series(vals[ok], dtype=object))   # ordem linha a linha
+    return {
+        'fundo':   df['Fundo'].to_numpy(dtype=object),
+        'ativo':   df['Ativo'].to_numpy(dtype=object),
+        'offsets': offsets,
+        'ids':     ids.astype(np.int32),
+        'vocab':   np.asarray(vocab, dtype=object),
+    }
+
+
+def n_linhas(csr: dict) -> int:
+    return len(csr['offsets']) - 1
+
+
+def para_longo(csr: dict) -> pd.DataFrame:
+    """CSR → tabela longa (_lin, _pos, tok), uma linha por token."""
+    tam = np.diff(csr['offsets'])
+    lin = np.repeat(np.arange(len(tam)), tam)
+    pos = np.arange(len(csr['ids'])) - np.repeat(csr['offsets'][:-1], tam)
+    return pd.DataFrame({
+        '_lin': lin,
+        '_pos': pos,
+        'tok':  csr['vocab'][csr['ids']] if len(csr['ids']) else np.array([], dtype=object),
+    })
+
+
+def para_largo(csr: dict) -> pd.DataFrame:
+    """CSR → [Fundo, Ativo, G1..Gn] (exportação compatível com o CSV largo)."""
+    n = n_linhas(csr)
+    tam = np.diff(csr['offsets'])
+    largura = int(tam.max()) if n else 0
+    grade = np.full((n, largura), np.nan, dtype=object)
+    longo = para_longo(csr)
+    grade[longo['_lin'].to_numpy(), longo['_pos'].to_numpy()] = longo['tok'].to_numpy()
+    df = pd.DataFrame(grade, columns=[f'G{i+1}' for i in range(largura)])
+    df.insert(0, 'Ativo', csr['ativo'])
+    df.insert(0, 'Fundo', csr['fundo'])
+    return df
+
+
+def filtrar(csr: dict, mask) -> dict:
+    """Subconjunto de linhas (máscara booleana), mesmo vocabulário."""
+    mask = np.asarray(mask, dtype=bool)
+    tam = np.diff(csr['offsets'])
+    tok_mask = np.repeat(mask, tam)
+    offsets = np.zeros(int(mask.sum()) + 1, dtype=np.int64)
+    np.cumsum(tam[mask], out=offsets[1:])
+    return {
+        'fundo':   csr['fundo'][mask],
+        'ativo':   csr['ativo'][mask],
+        'offsets': offsets,
+        'ids':     csr['ids'][tok_mask],
+        'vocab':   csr['vocab'],
+    }
+
+
+def traduzir_vocab(csr: dict, func) -> dict:
+    """Aplica `func` a cada token distinto (não a cada ocorrência) e re-deduplica o vocabulário."""
+    novo = pd.Series([func(t) for t in csr['vocab']], dtype=object)
+    remap, vocab = pd.factorize(novo)
+    return dict(csr, ids=remap[csr['ids']].astype(np.int32), vocab=np.asarray(vocab, dtype=object))
+
+
+# ------------------------------------------------------------------
+# Disco
+# ------------------------------------------------------------------
+def _str_com_nulos(v) -> tuple[np.ndarray, np.ndarray]:
+    nulo = pd.isna(v)
+    return np.where(nulo, '', v).astype(str), nulo
+
+
+def gravar(path: Path, csr: dict):
+    """CSR → .npz (gravação atômica)."""
+    fundo, fundo_nulo = _str_com_nulos(csr['fundo'])
+    ativo, ativo_nulo = _str_com_nulos(csr['ativo'])
+    arrays = {
+        'fundo': fundo, 'fundo_nulo': fundo_nulo,
+        'ativo': ativo, 'ativo_nulo': ativo_nulo,
+        'offsets': csr['offsets'], 'ids': csr['ids'],
+        'vocab': csr['vocab'].astype(str),
+    }
+
+    def _w(tmp):
+        with open(tmp, 'wb') as fh:
+            np.savez_compressed(fh, **arrays)
+    master_store.escrever_atomico(Path(path), _w)
+
+
+@metricas.medir()
+def ler(path: Path) -> dict:
+    with np.load(path, allow_pickle=False) as z:
+        fundo = z['fundo'].astype(object)
+        fundo[z['fundo_nulo']] = np.nan
+        ativo = z['ativo'].astype(object)
+        ativo[z['ativo_nulo']] = np.nan
+        return {
+            'fundo':   fundo,
+            'ativo':   ativo,
+            'offsets': z['offsets'].astype(np.int64),
+            'ids':     z['ids'].astype(np.int32),
+            'vocab':   z['vocab'].astype(object),
+        }
+
+
+@metricas.medir()
+def ler_largo(path: Path) -> pd.DataFrame:
+    """Tokens em frame largo, de .npz ou do CSV largo (dtype=str, vazios = NaN)."""
+    if eh_csr(path):
+        return para_largo(ler(path))
+    return pd.read_csv(path, dtype=str)
+
+
+def ler_csr(path: Path) -> dict:
+    """Tokens em CSR, de .npz ou do CSV largo."""
+    if eh_csr(path):
+        return ler(path)
+    return de_largo(pd.read_csv(path, dtype=str))
+
+
+@metricas.medir()
+def gravar_tokens(path: Path, tokens):
+    """
+    Grava frame largo ou CSR no formato indicado pela extensão de `path`
+    (gravação atômica nos dois casos).
+    """
+    if eh_csr(path):
+        gravar(path, tokens if isinstance(tokens, dict) else de_largo(tokens))
+    else:
+        df = para_largo(tokens) if isinstance(tokens, dict) else tokens
+        master_store.escrever_atomico(Path(path), lambda tmp: df.to_csv(tmp, index=False))
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Converte tokens entre CSV largo (G1..Gn) e CSR (.npz).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("importar", help="CSV largo → .npz")
+    p.add_argument("csv")
+    p.add_argument("npz")
+
+    p = sub.add_parser("exportar", help=".npz → CSV largo")
+    p.add_argument("npz")
+    p.add_argument("csv")
+    args = ap.parse_args()
+
+    if args.cmd == "importar":
+        csr = ler_csr(Path(args.csv))
+        gravar(Path(args.npz), csr)
+        print(f"{n_linhas(csr)} linhas, {len(csr['ids'])} tokens, vocabulário {len(csr['vocab'])} → {args.npz}")
+    else:
+        df = para_largo(ler(Path(args.npz)))
+        df.to_csv(args.csv, index=False)
+        print(f"{len(df)} linhas × {len(df.columns) - 2} colunas G → {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
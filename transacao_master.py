@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+transacao_master.py
+-------------------
+Inclusão/substituição e remoção de vários fundos de uma vez em todos os
+MASTER (financeiro, garantias limpas, tokens codificados), numa transação:
+
+  1. trava exclusiva em data/.masters.lock (fcntl / msvcrt): duas rodadas
+     concorrentes esperam uma pela outra; o score_app lê sob trava
+     compartilhada;
+  2. lê cada MASTER uma vez e aplica o lote inteiro em memória; limpeza e
+     mapear_codigo rodam só nos fundos incluídos, e as saídas derivadas são
+     remontadas na ordem de linhas do financeiro novo (mesmo merge do
+     --incremental), então as três continuam alinhadas;
+  3. prepara tudo antes de tocar no que os leitores veem: CSV/.npz em
+     temporários ao lado dos originais; no store particionado, partições
+     novas com nome próprio (master_store.preparar_lote) e o manifest novo em
+     temporário. Falha nesta fase apaga o preparado e não altera nenhum
+     MASTER;
+  4. grava a lista de trocas em data/.masters.journal.json e só então troca
+     cada temporário pelo original (os.replace) e apaga as partições
+     substituídas. Se o processo morrer no meio das trocas, o próximo a pegar
+     a trava (qualquer script) termina as que faltam a partir do jornal: os
+     MASTER nunca ficam com metade do lote.
+
+N fundos custam uma regravação de cada MASTER, não N. O estado do
+--incremental (<saida>.fp.json) perde só as entradas dos fundos tocados.
+
+Uso:
+    python transacao_master.py --remover HGCR11 XPTO11
+    python transacao_master.py --upsert input_dados/KNIP11_staging.csv input_dados/MXRF11_staging.csv
+    python transacao_master.py --upsert input_dados/KNIP11_staging.csv --remover HGCR11 --snapshot "troca KNIP"
+    python transacao_master.py --remover HGCR11 --simular
+"""
+
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+import append_to_master
+import incremental
+import limpeza
+import mapear_codigo
+import master_store
+import metricas
+import snapshots
+import tokens_csr
+from classificacao import carregar_regras
+
+# artefato → MASTER padrão (sem extensão: store se existir, senão .csv)
+MASTERS = {
+    'fin':    "data/df_tidy_simp_MASTER",
+    'limpas': "data/garantias_limpas_MASTER",
+    'cod':    "data/garantias_cod_MASTER",
+}
+TIMEOUT_PADRAO = 300.0
+
+
+# ------------------------------------------------------------------
+# Leitura
+# ------------------------------------------------------------------
+@metricas.medir('ler_master')
+def _ler(path: Path, tokens: bool) -> pd.DataFrame | None:
+    path = Path(path)
+    if master_store.eh_store(path):
+        df = master_store.ler_store(path)
+        return df if len(df.columns) else None
+    if not path.exists():
+        return None
+    return tokens_csr.ler_largo(path) if tokens else pd.read_csv(path)
+
+
+def ler_upserts(paths) -> pd.DataFrame | None:
+    """CSVs staging (ingest_fundo) → um frame no esquema MASTER."""
+    if not paths:
+        return None
+    return pd.concat([append_to_master.padronizar_staging(pd.read_csv(p)) for p in paths],
+                     ignore_index=True)
+
+
+# ------------------------------------------------------------------
+# Lote em memória
+# ------------------------------------------------------------------
+@metricas.medir()
+def aplicar_em_memoria(df_fin, df_limpas, df_cod, df_novos, remover, regras=None) -> dict:
+    """
+    Aplica o lote aos três frames (qualquer um pode ser None = MASTER
+    inexistente). Retorna {'fin', 'limpas', 'cod', 'fin_novos', 'limpas_novos',
+    'cod_novos', 'incluidos', 'removidos', 'ausentes'}.
+    """
+    remover = list(dict.fromkeys(remover))
+    incluidos = list(df_novos['Fundo'].drop_duplicates()) if df_novos is not None else []
+    conflito = set(incluidos) & set(remover)
+    if conflito:
+        raise ValueError(f"Fundo(s) no --upsert e no --remover ao mesmo tempo: {sorted(conflito)}")
+
+    existentes = set(df_fin['Fundo']) if df_fin is not None else set()
+    tocados = set(incluidos) | set(remover)
+
+    # financeiro: sai quem foi removido/substituído, os incluídos vão para o fim
+    partes = [] if df_fin is None else [df_fin[~df_fin['Fundo'].isin(tocados)]]
+    if df_novos is not None:
+        partes.append(df_novos)
+    fin = pd.concat(partes, ignore_index=True) if partes else None
+
+    out = {
+        'fin': fin, 'limpas': None, 'cod': None,
+        'fin_novos': df_novos, 'limpas_novos': None, 'cod_novos': None,
+        'incluidos': incluidos,
+        'removidos': [f for f in remover if f in existentes],
+        'ausentes':  [f for f in remover if f not in existentes],
+    }
+
+    if df_novos is not None and (df_limpas is not None or df_cod is not None):
+        if regras is None:
+            raise ValueError("Incluir fundos exige a Classificação (--classif) p/ limpeza/mapeamento.")
+        out['limpas_novos'], _ = limpeza.limpar_garantias(df_novos, regras)
+        out['cod_novos'], _ = mapear_codigo.mapear_codigos(out['limpas_novos'], regras)
+
+    vazio = pd.DataFrame(columns=['Fundo'])
+    for nome, df_ant in (('limpas', df_limpas), ('cod', df_cod)):
+        if df_ant is None:
+            continue
+        faltando = set(fin['Fundo']) - set(df_ant['Fundo']) - set(incluidos)
+        if faltando:
+            raise ValueError(
+                f"MASTER '{nome}' não tem {len(faltando)} fundo(s) do financeiro "
+                f"(ex.: {sorted(faltando)[:5]}): já estava desalinhado; rode limpeza/mapear_codigo antes."
+            )
+        novos = out[f'{nome}_novos']
+        out[nome] = incremental.mesclar_por_linha(
+            fin, df_ant, novos if novos is not None else vazio, incluidos)
+    return out
+
+
+# ------------------------------------------------------------------
+# Gravação
+# ------------------------------------------------------------------
+def _escritor(df: pd.DataFrame, tokens: bool):
+    if tokens:
+        return lambda tmp: tokens_csr.gravar_tokens(tmp, df)
+    return lambda tmp: df.to_csv(tmp, index=False)
+
+
+def _limpar_estado(path: Path, fundos):
+    """Tira os fundos tocados do <saida>.fp.json (o --incremental os recalcula)."""
+    estado = incremental.ler_estado(path)
+    if not estado:
+        return
+    for f in fundos:
+        estado.pop(f, None)
+    incremental.gravar_estado(path, estado)
+
+
+@metricas.medir()
+def gravar(masters: dict, res: dict, remover):
+    """Prepara todos os MASTER (CSV/.npz e store) e só então efetiva, via jornal."""
+    tocados = set(res['incluidos']) | set(remover)
+    planos = []
+    try:
+        for nome, path in masters.items():
+            if res[nome] is None:
+                continue
+            if master_store.eh_store(path):
+                novos = res[f'{nome}_novos']
+                if novos is not None and nome != 'fin':
+                    novos = tokens_csr.para_largo(novos) if isinstance(novos, dict) else novos
+                planos.append(master_store.preparar_lote(path, novos, remover=list(remover)))
+            else:
+                planos.append(master_store.plano_arquivo(path, _escritor(res[nome], nome != 'fin')))
+    except BaseException:
+        master_store.descartar(planos)
+        raise
+
+    for nome, path in masters.items():
+        if nome != 'fin' and res[nome] is not None:
+            _limpar_estado(path, tocados)
+    master_store.efetivar(planos, jornal=masters['fin'].parent)
+
+
+def transacao(masters: dict,
+              df_novos: pd.DataFrame | None = None,
+              remover=(),
+              classif: Path | None = None,
+              timeout: float | None = TIMEOUT_PADRAO,
+              simular: bool = False,
+              snapshot: str | None = None) -> dict:
+    """
+    Aplica o lote a todos os `masters` ({'fin', 'limpas', 'cod'} → caminho)
+    sob trava exclusiva. `snapshot` (rótulo) tira um snapshot (snapshots.py)
+    logo depois, ainda sob a trava. Retorna o resultado de aplicar_em_memoria.
+    """
+    masters = {k: Path(v) for k, v in masters.items()}
+    with master_store.travar(masters['fin'].parent, exclusiva=True, timeout=timeout):
+        dfs = {nome: _ler(path, tokens=nome != 'fin') for nome, path in masters.items()}
+        regras = carregar_regras(classif) if df_novos is not None and classif is not None else None
+        res = aplicar_em_memoria(dfs['fin'], dfs.get('limpas'), dfs.get('cod'),
+                                 df_novos, remover, regras=regras)
+        if not simular:
+            gravar(masters, res, remover)
+            if snapshot is not None:
+                snapshots.criar(masters={'fin': masters['fin'], 'limpas': masters['limpas'],
+                                         'tok': masters['cod']}, rotulo=snapshot or None)
+    return res
+
+
+# ------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------
+def _lista(valores) -> list:
+    return [f.strip() for v in valores for f in v.split(',') if f.strip()]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inclui/substitui e remove fundos em todos os MASTER, numa transação.")
+    ap.add_argument("--upsert", nargs="+", default=[],
+                    help="CSV(s) staging (ingest_fundo) dos fundos a incluir/substituir.")
+    ap.add_argument("--remover", nargs="+", default=[],
+                    help="Fundos a remover (espaço ou vírgula).")
+    for nome, base in MASTERS.items():
+        ap.add_argument(f"--{nome}", default=base,
+                        help=f"MASTER '{nome}' (padrão: store {base}/ se existir, senão {base}.csv).")
+    ap.add_argument("--classif", default="data/Estudo_de_Garantias_v3.xlsx",
+                    help="Classificação (limpeza/mapeamento dos fundos incluídos).")
+    ap.add_argument("--timeout", type=float, default=TIMEOUT_PADRAO,
+                    help="Segundos esperando a trava antes de desistir.")
+    ap.add_argument("--simular", action="store_true",
+                    help="Mostra o que mudaria, sem gravar.")
+    ap.add_argument("--snapshot", nargs="?", const="", default=None, metavar="ROTULO",
+                    help="Tira um snapshot (snapshots.py) depois de aplicar.")
+    metricas.adicionar_argumentos(ap)
+    args = ap.parse_args()
+
+    remover = _lista(args.remover)
+    if not args.upsert and not remover:
+        ap.error("nada a fazer: informe --upsert e/ou --remover.")
+
+    with metricas.execucao("transacao_master", args):
+        masters = {nome: master_store.resolver_master(getattr(args, nome)) for nome in MASTERS}
+        res = transacao(masters, ler_upserts(args.upsert), remover, classif=Path(args.classif),
+                        timeout=args.timeout, simular=args.simular, snapshot=args.snapshot)
+
+        for f in res['ausentes']:
+            print(f"[WARN] {f} não está no MASTER financeiro; nada a remover.")
+        acao = "Simulação" if args.simular else "MASTER atualizados"
+        print(f"{acao}: {len(res['incluidos'])} fundo(s) incluído(s)/substituído(s) "
+              f"({', '.join(res['incluidos']) or '—'}), {len(res['removidos'])} removido(s) "
+              f"({', '.join(res['removidos']) or '—'}).")
+        for nome, path in masters.items():
+            if res[nome] is not None:
+                print(f"    {nome:<7} {len(res[nome]):>8} linhas  {path}")
+
+
+if __name__ == "__main__":
+    main()